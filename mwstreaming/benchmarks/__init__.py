@@ -0,0 +1,5 @@
+"""
+Benchmarks for the core generators of the utilities, run against synthetic
+wikis.  See :mod:`mwstreaming.benchmarks.run` and
+:mod:`mwstreaming.benchmarks.synthetic`.
+"""
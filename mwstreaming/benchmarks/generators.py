@@ -0,0 +1,126 @@
+"""
+Benchmarks of the core generator of each utility.  Each benchmark prepares its
+input from a :class:`~mwstreaming.benchmarks.synthetic.SyntheticWiki` outside
+of the timed section and then times consuming the generator.  Like the
+utilities themselves, input is decoded from JSON lines as it is read, so
+decoding is included in the timing.
+"""
+import io
+import json
+import time
+from itertools import islice
+
+from mw import Timestamp, xml_dump
+
+from ..utilities.diffs2persistence import token_persistence
+from ..utilities.dump2json import dump2json
+from ..utilities.json2diffs import json2diffs
+from ..utilities.json2tsv import lines2tsv
+from ..utilities.mend_diffs import mend_diffs
+from ..utilities.persistence2stats import persistence2stats
+from .synthetic import write_xml
+
+SUNSET = Timestamp("2015-01-01T00:00:00Z")
+
+TSV_FIELDS = ["id", "page.id", "page.title", "contributor.user_text",
+              "timestamp", "persistence_stats.tokens_added",
+              "persistence_stats.tokens_persisted",
+              "persistence_stats.censored"]
+
+
+def timed(docs):
+    """
+    Consumes `docs` and returns (`records`, `seconds`).  A record is a
+    revision in all benchmarks.
+    """
+    start = time.perf_counter()
+    records = 0
+    for _ in docs:
+        records += 1
+    return records, time.perf_counter() - start
+
+def encode(docs):
+    return [json.dumps(doc) for doc in docs]
+
+def decode(lines):
+    return (json.loads(line) for line in lines)
+
+def chunked_diffs(revision_docs, diff_engine, chunk_size):
+    """
+    Diffs `revision_docs` in independent chunks (like a mapper would), which
+    leaves seams for :func:`mend_diffs` to mend.
+    """
+    revision_docs = iter(revision_docs)
+    while True:
+        chunk = list(islice(revision_docs, chunk_size))
+        if len(chunk) == 0:
+            break
+        yield from json2diffs(chunk, diff_engine)
+
+def diff_lines(wiki, diff_engine):
+    diff_docs = json2diffs(wiki.revision_docs(), diff_engine)
+    return encode(drop_text(diff_docs))
+
+def persistence_lines(wiki, diff_engine):
+    lines = []
+    for doc, token_stats in token_persistence(
+            decode(diff_lines(wiki, diff_engine)), 50, 15, SUNSET):
+        doc.pop('diff', None)
+        for ts in token_stats:
+            ts['revision'] = doc
+            lines.append(json.dumps(ts))
+    return lines
+
+def consume_stats(persistence):
+    """
+    Consumes the token stats of each revision and yields the revision.
+    """
+    for doc, token_stats in persistence:
+        for _ in token_stats:
+            pass
+        yield doc
+
+def drop_text(docs):
+    for doc in docs:
+        doc.pop('text', None)
+        yield doc
+
+
+def bench_dump2json(wiki, diff_engine):
+    f = io.StringIO()
+    write_xml(wiki, f)
+    f.seek(0)
+    return timed(dump2json(xml_dump.Iterator.from_file(f)))
+
+def bench_json2diffs(wiki, diff_engine):
+    lines = encode(wiki.revision_docs())
+    return timed(json2diffs(decode(lines), diff_engine))
+
+def bench_mend_diffs(wiki, diff_engine):
+    lines = encode(chunked_diffs(wiki.revision_docs(), diff_engine, 25))
+    return timed(mend_diffs(decode(lines), diff_engine))
+
+def bench_token_persistence(wiki, diff_engine):
+    lines = diff_lines(wiki, diff_engine)
+    return timed(consume_stats(token_persistence(decode(lines), 50, 15,
+                                                 SUNSET)))
+
+def bench_persistence2stats(wiki, diff_engine):
+    lines = persistence_lines(wiki, diff_engine)
+    return timed(persistence2stats(decode(lines), 5, 14 * 24 * 60 * 60))
+
+def bench_json2tsv(wiki, diff_engine):
+    stats_docs = persistence2stats(
+        decode(persistence_lines(wiki, diff_engine)), 5, 14 * 24 * 60 * 60)
+    lines = encode(stats_docs)
+    return timed(lines2tsv(lines, TSV_FIELDS))
+
+
+BENCHMARKS = {
+    'dump2json': bench_dump2json,
+    'json2diffs': bench_json2diffs,
+    'mend_diffs': bench_mend_diffs,
+    'token_persistence': bench_token_persistence,
+    'persistence2stats': bench_persistence2stats,
+    'json2tsv': bench_json2tsv
+}
@@ -0,0 +1,148 @@
+"""
+Runs benchmarks of the core generator of each utility against a synthetic wiki
+and reports records (revisions) per second and peak resident memory.  Each
+benchmark runs in a fresh process so that peak memory is its own.
+
+Results can be saved with `--save` and compared against a saved baseline with
+`--compare`.  When comparing, benchmarks that got slower or used more memory
+than the baseline by more than `--tolerance` are flagged and the exit status
+is 1.
+
+$ python -m mwstreaming.benchmarks.run --save=baseline.json
+$ git checkout my-branch
+$ python -m mwstreaming.benchmarks.run --compare=baseline.json
+
+Usage:
+    run (-h|--help)
+    run [<benchmark>...] [--config=<path>] [--pages=<num>] [--seed=<num>]
+                         [--repeat=<num>] [--save=<path>] [--compare=<path>]
+                         [--tolerance=<prop>]
+
+Options:
+    -h|--help           Print this documentation
+    <benchmark>         Names of benchmarks to run [default: <all>]
+    --config=<path>     The path to difference detection configuration
+                        [default: config/western.diffs.yaml]
+    --pages=<num>       The number of synthetic pages [default: 50]
+    --seed=<num>        The random seed for the synthetic wiki [default: 0]
+    --repeat=<num>      Run each benchmark this many times and keep the
+                        fastest [default: 1]
+    --save=<path>       Write results to this path as JSON
+    --compare=<path>    Compare results to a baseline written with `--save`
+    --tolerance=<prop>  The proportion by which a benchmark can be slower or
+                        use more memory than the baseline before it is
+                        flagged as a regression [default: 0.1]
+"""
+import json
+import resource
+import sys
+from multiprocessing import get_context
+
+import docopt
+
+from ..utilities.util import load_diff_engine
+from .generators import BENCHMARKS
+from .synthetic import SyntheticWiki
+
+
+def main(argv=None):
+    args = docopt.docopt(__doc__, argv=argv)
+
+    names = args['<benchmark>'] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            raise RuntimeError("Unknown benchmark {0}.  Expected one of {1}."
+                               .format(repr(name), ", ".join(BENCHMARKS)))
+
+    if args['--compare'] is not None:
+        baseline = json.load(open(args['--compare']))
+    else:
+        baseline = None
+
+    regressions = run(names, args['--config'], int(args['--pages']),
+                      int(args['--seed']), int(args['--repeat']),
+                      args['--save'], baseline, float(args['--tolerance']))
+
+    sys.exit(1 if regressions > 0 else 0)
+
+def run(names, config_path, pages, seed, repeat, save_path, baseline,
+        tolerance):
+
+    results = {}
+    for name in names:
+        result = None
+        for _ in range(repeat):
+            # A fresh process per run so that peak RSS is the benchmark's own
+            with get_context("spawn").Pool(1) as pool:
+                r = pool.apply(run_benchmark, (name, config_path, pages, seed))
+            if result is None or r['records_per_sec'] > \
+                                 result['records_per_sec']:
+                result = r
+        results[name] = result
+        sys.stdout.write(format_result(name, result) + "\n")
+        sys.stdout.flush()
+
+    if save_path is not None:
+        with open(save_path, "w") as f:
+            json.dump({'pages': pages, 'seed': seed, 'results': results}, f,
+                      indent=2)
+
+    regressions = 0
+    if baseline is not None:
+        if (baseline['pages'], baseline['seed']) != (pages, seed):
+            sys.stderr.write("Warning: the baseline was run with " +
+                             "--pages={0} --seed={1}\n"
+                             .format(baseline['pages'], baseline['seed']))
+        sys.stdout.write("\nCompared to baseline:\n")
+        for name, result in results.items():
+            if name not in baseline['results']:
+                continue
+            comparison = compare(result, baseline['results'][name], tolerance)
+            regressions += comparison['regression']
+            sys.stdout.write(format_comparison(name, comparison) + "\n")
+
+    return regressions
+
+def run_benchmark(name, config_path, pages, seed):
+    diff_engine = load_diff_engine(config_path)
+    wiki = SyntheticWiki(pages=pages, seed=seed)
+
+    records, seconds = BENCHMARKS[name](wiki, diff_engine)
+
+    return {
+        'records': records,
+        'seconds': seconds,
+        'records_per_sec': records / seconds if seconds > 0 else None,
+        'peak_rss_mb': peak_rss() / 2 ** 20
+    }
+
+def peak_rss():
+    """
+    The peak resident set size of this process in bytes.
+    """
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, OS X reports bytes
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+def compare(result, baseline, tolerance):
+    speed = result['records_per_sec'] / baseline['records_per_sec']
+    memory = result['peak_rss_mb'] / baseline['peak_rss_mb']
+    return {
+        'speed': speed,
+        'memory': memory,
+        'regression': speed < 1 - tolerance or memory > 1 + tolerance
+    }
+
+def format_result(name, result):
+    return "{0:<20} {1:>8} records {2:>9.2f}s {3:>11.1f} records/s " \
+           "{4:>8.1f} MB peak".format(name, result['records'],
+                                      result['seconds'],
+                                      result['records_per_sec'],
+                                      result['peak_rss_mb'])
+
+def format_comparison(name, comparison):
+    return "{0:<20} speed {1:>6.2f}x  memory {2:>6.2f}x  {3}".format(
+        name, comparison['speed'], comparison['memory'],
+        "REGRESSION" if comparison['regression'] else "ok")
+
+if __name__ == "__main__": main()
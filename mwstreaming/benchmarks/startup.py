@@ -0,0 +1,87 @@
+"""
+Measures how long each utility takes to start.  For every utility, two times
+are reported (the median of `--repeat` fresh interpreters each):
+
+* import -- the time to import the utility's module, as measured inside the
+  interpreter
+* help -- the wall-clock time of `mwstream <utility> --help`, including
+  interpreter startup
+
+In Hadoop streaming, every task starts `mwstream` fresh, so startup time is
+paid once per task.
+
+Usage:
+    startup (-h|--help)
+    startup [<utility>...] [--repeat=<num>]
+
+Options:
+    -h|--help       Print this documentation
+    <utility>       Names of utilities to measure [default: <all>]
+    --repeat=<num>  The number of interpreters to start per measurement
+                    [default: 5]
+"""
+import os
+import pkgutil
+import subprocess
+import sys
+import time
+
+import docopt
+
+from .. import utilities
+
+IMPORT_SCRIPT = """
+import time
+start = time.perf_counter()
+import mwstreaming.utilities.{0}
+print(time.perf_counter() - start)
+"""
+
+
+def main(argv=None):
+    args = docopt.docopt(__doc__, argv=argv)
+
+    names = args['<utility>'] or utility_names()
+
+    run(names, int(args['--repeat']))
+
+def run(names, repeat):
+
+    for name in names:
+        import_time = median(measure_import(name) for _ in range(repeat))
+        help_time = median(measure_help(name) for _ in range(repeat))
+        sys.stdout.write("{0:<20} import {1:>7.1f} ms  help {2:>7.1f} ms\n"
+                         .format(name, import_time * 1000, help_time * 1000))
+        sys.stdout.flush()
+
+def utility_names():
+    return sorted(name for _, name, is_package
+                  in pkgutil.iter_modules(utilities.__path__)
+                  if not is_package and name != "util")
+
+def measure_import(name):
+    output = subprocess.check_output(
+        [sys.executable, "-c", IMPORT_SCRIPT.format(name)], env=environment())
+    return float(output)
+
+def measure_help(name):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-m", "mwstreaming.mwstream", name,
+                    "--help"], stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL, env=environment())
+    return time.perf_counter() - start
+
+def environment():
+    # Make sure the subprocess imports this copy of mwstreaming
+    root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [root] + ([env['PYTHONPATH']] if 'PYTHONPATH' in env else []))
+    return env
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+if __name__ == "__main__": main()
@@ -0,0 +1,274 @@
+"""
+Generates synthetic wikis for benchmarking.  The same `seed` always produces
+the same pages and revisions, either as RevisionDocument JSON blobs or as an
+XML dump.
+
+The generated history is meant to exercise the cases that matter for
+performance:
+
+* Page sizes are skewed -- most pages have a handful of revisions and a few
+  have many (Pareto distributed).
+* Some pages carry very large texts.
+* Some pages have revert wars: two versions of the text alternate for a run
+  of revisions.
+* Most edits are small (a few words inserted, removed or replaced); the rest
+  add or remove whole paragraphs.
+
+Usage:
+    synthetic (-h|--help)
+    synthetic [--format=<format>] [--pages=<num>] [--seed=<num>]
+
+Options:
+    -h|--help          Print this documentation
+    --format=<format>  "json" for RevisionDocument JSON blobs or "xml" for an
+                       XML dump [default: json]
+    --pages=<num>      The number of pages to generate [default: 100]
+    --seed=<num>       The random seed [default: 0]
+"""
+import hashlib
+import json
+import random
+import sys
+from xml.sax.saxutils import escape
+
+import docopt
+from mw import Timestamp
+
+START = Timestamp("2005-01-01T00:00:00Z").unix()
+
+SITEINFO = """<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/" version="0.10" xml:lang="en">
+  <siteinfo>
+    <sitename>Synthetic</sitename>
+    <dbname>syntheticwiki</dbname>
+    <base>http://synthetic.example.org/wiki/Main_Page</base>
+    <generator>mwstreaming.benchmarks.synthetic</generator>
+    <case>first-letter</case>
+    <namespaces>
+      <namespace key="0" case="first-letter" />
+      <namespace key="1" case="first-letter">Talk</namespace>
+    </namespaces>
+  </siteinfo>
+"""
+
+
+def main(argv=None):
+    args = docopt.docopt(__doc__, argv=argv)
+
+    wiki = SyntheticWiki(pages=int(args['--pages']), seed=int(args['--seed']))
+
+    if args['--format'] == "xml":
+        write_xml(wiki, sys.stdout)
+    else:
+        for revision_doc in wiki.revision_docs():
+            json.dump(revision_doc, sys.stdout)
+            sys.stdout.write("\n")
+
+
+class SyntheticWiki:
+    """
+    :Parameters:
+        pages : int
+            The number of pages to generate
+        seed : int
+            The random seed
+        mean_revisions : float
+            The approximate mean number of revisions per page
+        max_revisions : int
+            The maximum number of revisions of a page
+        large_text_rate : float
+            The proportion of pages that start with a very large text
+        large_text_chars : int
+            The approximate size of a very large text in characters
+        revert_war_rate : float
+            The proportion of pages with a revert war
+        small_edit_rate : float
+            The proportion of edits that only change a few words
+    """
+    def __init__(self, pages=100, seed=0, mean_revisions=20,
+                 max_revisions=500, large_text_rate=0.02,
+                 large_text_chars=2 ** 18, revert_war_rate=0.05,
+                 small_edit_rate=0.8):
+        self.pages = pages
+        self.seed = seed
+        self.mean_revisions = mean_revisions
+        self.max_revisions = max_revisions
+        self.large_text_rate = large_text_rate
+        self.large_text_chars = large_text_chars
+        self.revert_war_rate = revert_war_rate
+        self.small_edit_rate = small_edit_rate
+
+        vocabulary_random = random.Random(seed)
+        self.vocabulary = [
+            "".join(vocabulary_random.choice("abcdefghijklmnopqrstuvwxyz")
+                    for _ in range(vocabulary_random.randint(1, 10)))
+            for _ in range(5000)
+        ] + ["[[Link]]", "{{cite}}", "''", "==", "*", "|"]
+
+    def page_revisions(self):
+        """
+        Generates (`page_doc`, `revision_docs`) pairs.  `revision_docs` is a
+        generator.
+        """
+        rev_id = 1
+        for page_index in range(self.pages):
+            r = random.Random("{0}:{1}".format(self.seed, page_index))
+            page_doc = {
+                'id': page_index + 1,
+                'title': "Synthetic page {0}".format(page_index + 1),
+                'namespace': r.choice([0, 0, 0, 1]),
+                'redirect_title': None,
+                'restrictions': []
+            }
+            # Pareto gives a long tail of very active pages
+            alpha = 1.16 # ~80/20
+            scale = self.mean_revisions * (alpha - 1) / alpha
+            n_revisions = min(int(r.paretovariate(alpha) * scale) + 1,
+                              self.max_revisions)
+
+            yield page_doc, self.generate_revisions(r, page_doc, rev_id,
+                                                    n_revisions)
+            rev_id += n_revisions
+
+    def revision_docs(self):
+        for page_doc, revision_docs in self.page_revisions():
+            yield from revision_docs
+
+    def generate_revisions(self, r, page_doc, first_id, n_revisions):
+        if r.random() < self.large_text_rate:
+            paragraphs = [self.paragraph(r, 200)
+                          for _ in range(self.large_text_chars // 1200 + 1)]
+        else:
+            paragraphs = [self.paragraph(r) for _ in range(r.randint(1, 8))]
+
+        if r.random() < self.revert_war_rate and n_revisions > 4:
+            war_start = r.randrange(1, n_revisions - 2)
+            war_length = r.randint(2, min(20, n_revisions - war_start))
+        else:
+            war_start, war_length = None, 0
+
+        timestamp = START + r.randint(0, 10 ** 8)
+        parent_id = None
+        war_texts = None
+        for i in range(n_revisions):
+            rev_id = first_id + i
+
+            if war_start is not None and war_start <= i < war_start + \
+                                                           war_length:
+                if war_texts is None:
+                    # Two factions revert each other's version
+                    war_texts = [list(paragraphs),
+                                 paragraphs + [self.paragraph(r)]]
+                paragraphs = list(war_texts[(i - war_start + 1) % 2])
+                contributor = self.contributor(r, (i - war_start) % 2)
+                comment = "Reverted edits"
+            else:
+                if i > 0:
+                    self.edit(r, paragraphs)
+                contributor = self.contributor(r)
+                comment = r.choice([None, "copyedit", "+cat", "expand"])
+
+            text = "\n\n".join(paragraphs)
+            timestamp += int(r.expovariate(1 / 86400)) + 1
+
+            yield {
+                'page': dict(page_doc),
+                'id': rev_id,
+                'timestamp': Timestamp(timestamp).long_format(),
+                'contributor': contributor,
+                'minor': r.random() < 0.3,
+                'comment': comment,
+                'text': text,
+                'bytes': len(text.encode('utf-8')),
+                'sha1': hashlib.sha1(text.encode('utf-8')).hexdigest(),
+                'parent_id': parent_id,
+                'model': "wikitext",
+                'format': "text/x-wiki"
+            }
+            parent_id = rev_id
+
+    def paragraph(self, r, words=None):
+        words = words or r.randint(5, 120)
+        return " ".join(r.choice(self.vocabulary) for _ in range(words)) + "."
+
+    def edit(self, r, paragraphs):
+        if r.random() < self.small_edit_rate or len(paragraphs) == 0:
+            if len(paragraphs) == 0:
+                paragraphs.append(self.paragraph(r))
+            p = r.randrange(len(paragraphs))
+            words = paragraphs[p].split(" ")
+            i = r.randrange(len(words))
+            action = r.random()
+            if action < 0.4:
+                words[i:i] = [r.choice(self.vocabulary)
+                              for _ in range(r.randint(1, 5))]
+            elif action < 0.7 and len(words) > 1:
+                del words[i:i + r.randint(1, 3)]
+            else:
+                words[i] = r.choice(self.vocabulary)
+            paragraphs[p] = " ".join(words)
+        elif r.random() < 0.55 or len(paragraphs) == 1:
+            paragraphs.insert(r.randint(0, len(paragraphs)),
+                              self.paragraph(r))
+        else:
+            del paragraphs[r.randrange(len(paragraphs))]
+
+    def contributor(self, r, faction=None):
+        if faction is not None:
+            user_id = 1000 + faction
+        elif r.random() < 0.2:
+            ip = "10.0.{0}.{1}".format(r.randint(0, 255), r.randint(0, 255))
+            return {'id': None, 'user_text': ip}
+        else:
+            user_id = int(r.paretovariate(1.5)) + 1
+        return {'id': user_id, 'user_text': "User{0}".format(user_id)}
+
+
+def write_xml(wiki, f):
+    """
+    Writes `wiki` to `f` as an XML dump.
+    """
+    f.write(SITEINFO)
+    for page_doc, revision_docs in wiki.page_revisions():
+        f.write("  <page>\n" +
+                "    <title>{0}</title>\n".format(escape(page_doc['title'])) +
+                "    <ns>{0}</ns>\n".format(page_doc['namespace']) +
+                "    <id>{0}</id>\n".format(page_doc['id']))
+        for doc in revision_docs:
+            f.write(revision_xml(doc))
+        f.write("  </page>\n")
+    f.write("</mediawiki>\n")
+
+def revision_xml(doc):
+    parts = ["    <revision>\n",
+             "      <id>{0}</id>\n".format(doc['id'])]
+    if doc['parent_id'] is not None:
+        parts.append("      <parentid>{0}</parentid>\n"
+                     .format(doc['parent_id']))
+    parts.append("      <timestamp>{0}</timestamp>\n"
+                 .format(doc['timestamp']))
+
+    contributor = doc['contributor']
+    if contributor['id'] is None:
+        parts.append("      <contributor>\n" +
+                     "        <ip>{0}</ip>\n".format(contributor['user_text']) +
+                     "      </contributor>\n")
+    else:
+        parts.append("      <contributor>\n" +
+                     "        <username>{0}</username>\n"
+                     .format(escape(contributor['user_text'])) +
+                     "        <id>{0}</id>\n".format(contributor['id']) +
+                     "      </contributor>\n")
+    if doc['minor']:
+        parts.append("      <minor />\n")
+    if doc['comment'] is not None:
+        parts.append("      <comment>{0}</comment>\n"
+                     .format(escape(doc['comment'])))
+    parts.append(('      <text xml:space="preserve" bytes="{0}">{1}</text>\n'
+                  .format(doc['bytes'], escape(doc['text']))) +
+                 "      <sha1>{0}</sha1>\n".format(doc['sha1']) +
+                 "      <model>{0}</model>\n".format(doc['model']) +
+                 "      <format>{0}</format>\n".format(doc['format']) +
+                 "    </revision>\n")
+    return "".join(parts)
+
+if __name__ == "__main__": main()
@@ -0,0 +1,28 @@
+import io
+
+from mw import xml_dump
+from nose.tools import eq_
+
+from ...utilities.dump2json import dump2json
+from ..synthetic import SyntheticWiki, write_xml
+
+
+def test_xml_round_trip():
+    wiki = SyntheticWiki(pages=10, seed=1, large_text_chars=10000)
+
+    f = io.StringIO()
+    write_xml(wiki, f)
+    f.seek(0)
+
+    expected = list(wiki.revision_docs())
+    for doc in expected:
+        doc['bytes'] = None # Not read from dumps
+    eq_(list(dump2json(xml_dump.Iterator.from_file(f))), expected)
+
+def test_revert_war():
+    wiki = SyntheticWiki(pages=10, seed=1, revert_war_rate=1)
+    for page_doc, revision_docs in wiki.page_revisions():
+        checksums = [doc['sha1'] for doc in revision_docs]
+        if len(checksums) > 4:
+            # Some revision's text was seen before
+            assert len(set(checksums)) < len(checksums)
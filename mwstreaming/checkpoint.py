@@ -0,0 +1,206 @@
+"""
+Records the progress of long-running stream jobs at page boundaries so that
+they can be resumed after a crash or preemption.
+
+A checkpoint is a small JSON document that is atomically replaced at most
+once every `interval` seconds.  It records how much of the input was consumed
+(in records and, when available, bytes), the last page that was completely
+written and the byte offset of the output at that point.
+
+Resuming expects that output is written to a regular file opened for
+appending (e.g. `>> diffs.json`) so that a partially written page can be
+truncated away before processing continues.
+"""
+import io
+import json
+import os
+import stat
+import time
+
+
+class InputPosition:
+    """
+    Tracks how far a line reader has gotten into its input.
+
+    Page-partitioned generators (e.g. those using `groupby`) detect the end of
+    a page by reading the first record of the next page.  `boundary()` accounts
+    for that read-ahead.
+    """
+    def __init__(self, offset=0, records=0):
+        self.offset = offset
+        self.records = records
+        self.last_offset = offset
+        self.eof = False
+
+    def advance(self, length, records=1):
+        self.last_offset = self.offset
+        self.offset += length
+        self.records += records
+
+    def boundary(self):
+        """
+        Returns the (offset, records) at the start of the record that follows
+        the last completed page.
+        """
+        if self.eof:
+            return self.offset, self.records
+        else:
+            return self.last_offset, self.records - 1
+
+
+class Checkpoint:
+    """
+    Writes progress to `path` when `page_done()` is called at a page boundary.
+
+    :Parameters:
+        path : str
+            Where to write the checkpoint document
+        output : file
+            The output stream.  Flushed before its offset is recorded.
+        position : :class:`InputPosition`
+            The position of a JSON-lines reader (if any)
+        interval : float
+            The minimum number of seconds between checkpoint writes
+        state : dict
+            A previously loaded checkpoint document to continue from
+    """
+    def __init__(self, path, output=None, position=None, interval=60,
+                 state=None):
+        self.path = path
+        self.output = output
+        self.position = position
+        self.interval = interval
+        self.state = state
+
+        state = state or {}
+        self.pages = state.get('pages', 0)
+        self.page_id = state.get('page_id')
+        self.last_write = time.time()
+
+    def page_done(self, page_id):
+        """
+        Records that all output for `page_id` has been written.
+        """
+        self.pages += 1
+        self.page_id = page_id
+
+        if time.time() - self.last_write >= self.interval:
+            self.write()
+
+    def write(self):
+        doc = {
+            'pages': self.pages,
+            'page_id': self.page_id,
+            'input_offset': None,
+            'input_records': None,
+            'output_offset': None,
+            'timestamp': time.time()
+        }
+        if self.position is not None:
+            doc['input_offset'], doc['input_records'] = \
+                    self.position.boundary()
+
+        if self.output is not None:
+            doc['output_offset'] = output_offset(self.output)
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(doc, f)
+        os.replace(tmp_path, self.path)
+
+        self.last_write = time.time()
+
+    @property
+    def resumed_pages(self):
+        """
+        The number of pages that were completed before resuming.
+        """
+        if self.state is None:
+            return 0
+        else:
+            return self.state['pages']
+
+    @classmethod
+    def start(cls, path, interval=60, resume=False, input=None, output=None):
+        """
+        Constructs a checkpoint, loading any prior progress from `path` when
+        `resume` is set.  If a JSON-lines `input` is provided, it is positioned
+        at the first record after the last completed page and the returned
+        checkpoint's `position` should be passed to
+        :func:`~mwstreaming.utilities.util.read_docs`.  `output` is truncated to
+        the last checkpointed offset -- or emptied if the job is resumed before
+        any checkpoint was written.
+        """
+        state = load(path) if resume else None
+
+        if input is not None:
+            position = seek_input(input, state)
+        else:
+            position = None
+
+        if resume and output is not None:
+            if state is not None:
+                truncate_output(output, state['output_offset'])
+            elif is_regular_file(output):
+                # The job stopped before its first checkpoint.  Anything it
+                # wrote will be written again.
+                truncate_output(output, 0)
+
+        return cls(path, output=output, position=position, interval=interval,
+                   state=state)
+
+
+def load(path):
+    """
+    Loads a checkpoint document.  Returns `None` if there is no checkpoint.
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def seek_input(f, state):
+    """
+    Positions a JSON-lines input stream just after the last completed page
+    recorded in `state`.  Seeks when the input is a regular file and skips
+    records otherwise.
+    """
+    if state is None or state['input_records'] is None:
+        return InputPosition()
+
+    buffer = f.buffer
+    if buffer.seekable():
+        buffer.seek(state['input_offset'])
+    else:
+        for _ in range(state['input_records']):
+            buffer.readline()
+
+    return InputPosition(state['input_offset'], state['input_records'])
+
+def output_offset(output):
+    output.flush()
+    try:
+        return os.lseek(output.fileno(), 0, os.SEEK_CUR)
+    except OSError:
+        # Pipes have no offset
+        return None
+
+def is_regular_file(output):
+    try:
+        return stat.S_ISREG(os.fstat(output.fileno()).st_mode)
+    except (OSError, AttributeError, io.UnsupportedOperation):
+        return False
+
+def truncate_output(output, offset):
+    if offset is None:
+        raise RuntimeError("Can't resume: the checkpoint does not record " +
+                           "an output offset.  Was output written to a pipe?")
+
+    output.flush()
+    try:
+        os.ftruncate(output.fileno(), offset)
+        os.lseek(output.fileno(), offset, os.SEEK_SET)
+    except OSError as e:
+        raise RuntimeError("Can't resume: output must be redirected to a " +
+                           "regular file (>>).") from e
@@ -0,0 +1,137 @@
+"""
+A compact format for token persistence statistics.  Rather than repeating the
+revision document for every token a revision added, each revision is written
+once as a header followed by one row per token:
+
+.. code-block:: javascript
+
+    {"revision": {"id": 10, "page": {...}, ...}}
+    [10, "foo", 3, 5, 2, 4, 86400, 172800]
+    [10, "bar", 5, 5, 4, 4, 172800, 172800]
+
+Rows are JSON arrays of the revision id, the token and the stats in
+`STAT_FIELDS` order.
+
+With a token dictionary, each distinct token string of a page is written once
+in the 'new_tokens' of the first header that needs it and rows reference
+tokens by their index in the dictionary.  'token_offset' is the index of the
+first of the 'new_tokens' (0 starts a new dictionary):
+
+.. code-block:: javascript
+
+    {"revision": {...}, "token_offset": 0, "new_tokens": ["foo", "bar"]}
+    [10, 0, 3, 5, 2, 4, 86400, 172800]
+    [10, 1, 5, 5, 4, 4, 172800, 172800]
+"""
+from itertools import chain, groupby
+
+from .utilities.util import write_doc
+
+STAT_FIELDS = ("persisted", "processed", "non_self_persisted",
+               "non_self_processed", "seconds_visible", "seconds_possible")
+
+
+class CompactWriter:
+    """
+    Writes revisions and their token stats in the compact format.
+
+    :Parameters:
+        f : file
+            Where to write
+        token_dictionary : bool
+            Reference tokens by index into a per-page dictionary
+    """
+    def __init__(self, f, token_dictionary=False):
+        self.f = f
+        self.token_dictionary = token_dictionary
+        self.page_id = None
+        self.token_ids = {}
+
+    def write(self, revision_doc, token_stats):
+        """
+        Writes `revision_doc` and its `token_stats`.  Nothing is written for
+        a revision without token stats.  Returns the number of characters
+        written.
+        """
+        if self.token_dictionary:
+            page_id = revision_doc['page']['id']
+            if page_id != self.page_id:
+                self.page_id = page_id
+                self.token_ids = {}
+            token_offset = len(self.token_ids)
+
+        rev_id = revision_doc['id']
+        new_tokens = []
+        rows = []
+        for ts in token_stats:
+            token = ts['token']
+            if self.token_dictionary:
+                token_id = self.token_ids.get(token)
+                if token_id is None:
+                    token_id = len(self.token_ids)
+                    self.token_ids[token] = token_id
+                    new_tokens.append(token)
+                token = token_id
+            rows.append([rev_id, token] +
+                        [ts[field] for field in STAT_FIELDS])
+
+        if len(rows) == 0:
+            return 0
+
+        header = {'revision': revision_doc}
+        if self.token_dictionary:
+            header['token_offset'] = token_offset
+            header['new_tokens'] = new_tokens
+
+        length = write_doc(header, self.f)
+        for row in rows:
+            length += write_doc(row, self.f)
+
+        return length
+
+
+def group_revisions(persistence_docs):
+    """
+    Generates (`revision_doc`, `token_docs`) pairs from token persistence
+    stats in either the compact format or one JSON blob per token (with a
+    'revision' field).  `token_docs` are dicts with a 'token' field and the
+    `STAT_FIELDS`.  Revisions are grouped by 'id'.
+    """
+    persistence_docs = iter(persistence_docs)
+    first = next(persistence_docs, None)
+    if first is None:
+        return
+    persistence_docs = chain([first], persistence_docs)
+
+    if isinstance(first, dict) and 'token' in first:
+        for _, token_docs in groupby(persistence_docs,
+                                     key=lambda p: p['revision']['id']):
+            first = next(token_docs)
+            yield first['revision'], chain([first], token_docs)
+    else:
+        yield from read_compact(persistence_docs)
+
+def read_compact(docs):
+    """
+    Generates (`revision_doc`, `token_docs`) pairs from the compact format.
+    """
+    dictionary = []
+    header = None
+    for is_row, group in groupby(docs, key=lambda d: isinstance(d, list)):
+        if not is_row:
+            for header in group:
+                if 'new_tokens' in header:
+                    del dictionary[header['token_offset']:]
+                    dictionary.extend(header['new_tokens'])
+        elif header is None:
+            raise ValueError("Expected a revision header before token rows")
+        else:
+            yield header['revision'], (row2doc(row, dictionary)
+                                       for row in group)
+
+def row2doc(row, dictionary):
+    token = row[1]
+    doc = {'token': token if isinstance(token, str) else dictionary[token]}
+    for field, value in zip(STAT_FIELDS, row[2:]):
+        doc[field] = value
+    return doc
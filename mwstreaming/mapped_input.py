@@ -0,0 +1,174 @@
+"""
+Reads uncompressed JSON lines from a regular file in parallel.  The file is
+memory-mapped and split into newline-aligned chunks that are processed by a
+pool of processes.  Results are generated in the order of the file.
+
+Chunks can be aligned to page boundaries so that a stage that processes whole
+pages (or revisions) can process each chunk on its own.
+"""
+import io
+import json
+import mmap
+import os
+import stat
+from collections import deque
+from functools import partial
+
+CHUNK_SIZE = 2 ** 22
+"""
+The approximate number of bytes per chunk.
+"""
+
+PAGE_FIELDS = ["page.id", "revision.page.id"]
+
+
+def map_chunks(f, process, threads, chunk_size=CHUNK_SIZE, align_pages=False,
+               position=None, initializer=None, initargs=()):
+    """
+    Generates the results of `process(chunk)` for newline-aligned chunks of
+    the bytes of `f` (from its current position) in `threads` processes.
+    `process` must be picklable (e.g. a module-level function or a
+    :func:`functools.partial` of one).  If `align_pages` is True, chunks only
+    end where a page ends.  If an :class:`~mwstreaming.checkpoint.InputPosition`
+    is provided, it is advanced by each chunk as its result is generated.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import get_context
+
+    mapped, offset = open_mapped(f)
+    try:
+        with ProcessPoolExecutor(threads, get_context("spawn"),
+                                 initializer=initializer,
+                                 initargs=initargs) as executor:
+            pending = deque()
+            for start, end in chunk_boundaries(mapped, offset, chunk_size,
+                                               align_pages):
+                chunk = mapped[start:end]
+                pending.append((len(chunk), chunk.count(b"\n"),
+                                executor.submit(process, chunk)))
+                if len(pending) >= threads * 2:
+                    yield finish(pending.popleft(), position)
+
+            while len(pending) > 0:
+                yield finish(pending.popleft(), position)
+
+        if position is not None: position.eof = True
+    finally:
+        mapped.close()
+
+def finish(pending_chunk, position):
+    length, lines, future = pending_chunk
+    result = future.result()
+    if position is not None: position.advance(length, lines)
+    return result
+
+def read_docs(f, threads, field=1, position=None, max_bytes=None,
+              chunk_size=CHUNK_SIZE):
+    """
+    Generates JSON documents from the `field`th tab-separated column of each
+    line of `f`, parsing chunks in `threads` processes.  See
+    :func:`mwstreaming.utilities.util.read_docs`.
+    """
+    process = partial(parse_chunk, field, max_bytes)
+    for docs in map_chunks(f, process, threads, chunk_size=chunk_size,
+                           position=position):
+        yield from docs
+
+def parse_chunk(field, max_bytes, chunk):
+    from .utilities.util import read_lines
+
+    docs = []
+    for line, _, truncated in read_lines(io.BytesIO(chunk), max_bytes):
+        doc = json.loads(str(line, 'utf-8').strip().split("\t")[field-1])
+        if truncated: doc['truncated'] = True
+        docs.append(doc)
+    return docs
+
+def chunk_lines(chunk):
+    """
+    Returns the lines of `chunk` as strings (without newlines).
+    """
+    lines = str(chunk, 'utf-8').split("\n")
+    if lines[-1] == "": lines.pop()
+    return lines
+
+def open_mapped(f):
+    """
+    Memory-maps the file underlying the text stream `f`.  Returns the map and
+    the current position of `f`.
+    """
+    if not is_mappable(f):
+        raise RuntimeError("Parallel reading requires an uncompressed " +
+                           "regular file as input (e.g. `< revisions.json`).")
+
+    fileno = f.buffer.fileno()
+    if os.fstat(fileno).st_size == 0:
+        # Empty files can't be mapped
+        return EmptyMap(), 0
+    return mmap.mmap(fileno, 0, access=mmap.ACCESS_READ), f.buffer.tell()
+
+def is_mappable(f):
+    """
+    Returns True if the text stream `f` reads from a regular file.
+    """
+    try:
+        return stat.S_ISREG(os.fstat(f.buffer.fileno()).st_mode)
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return False
+
+def chunk_boundaries(mapped, start, chunk_size, align_pages=False):
+    """
+    Generates (`start`, `end`) offsets of chunks of `mapped` that end after a
+    newline (or at the end of the file).
+    """
+    if align_pages:
+        from .utilities.json2tsv import FieldExtractor
+        extractor = FieldExtractor(PAGE_FIELDS)
+
+    length = len(mapped)
+    while start < length:
+        end = mapped.find(b"\n", min(start + chunk_size, length) - 1)
+        end = length if end == -1 else end + 1
+        if align_pages:
+            end = page_end(mapped, end, extractor)
+        yield start, end
+        start = end
+
+def page_end(mapped, start, extractor):
+    """
+    Returns the offset of the end of the page that the line at `start` belongs
+    to (or, if that can't be told, of the first page that starts after it).
+    Lines that aren't JSON objects (e.g. compact token rows) belong to the
+    page before them.
+    """
+    if start > 0:
+        # The page of the line before, if it starts a revision
+        page_id = line_page_id(mapped[mapped.rfind(b"\n", 0, start - 1) + 1:
+                                      start], extractor)
+    else:
+        page_id = None
+
+    length = len(mapped)
+    while start < length:
+        end = mapped.find(b"\n", start)
+        end = length if end == -1 else end + 1
+        current_page_id = line_page_id(mapped[start:end], extractor)
+        if current_page_id is not None:
+            if page_id is None:
+                page_id = current_page_id
+            elif current_page_id != page_id:
+                return start
+        start = end
+
+    return length
+
+def line_page_id(line, extractor):
+    if line.lstrip()[:1] != b"{":
+        return None
+    page_id, token_page_id = extractor.extract(str(line, 'utf-8'))
+    return page_id if token_page_id is None else token_page_id
+
+
+class EmptyMap(bytes):
+    def close(self):
+        pass
@@ -0,0 +1,218 @@
+"""
+Collects throughput and latency metrics while a utility runs and periodically
+reports them -- as a human-readable line to <stderr> (`--verbose`) and/or as
+JSON lines to a metrics file (`--metrics=<path>`).
+
+Recording is a few attribute updates per revision, so the hot loops of the
+utilities can afford to call :meth:`Metrics.revision` for every revision.
+
+A report looks like::
+
+    {"time": 1420070400.0, "elapsed": 60.0, "revisions": 12000,
+     "revisions_per_sec": 200.0, "pages": 30, "pages_per_sec": 0.5,
+     "bytes_in": 123456789, "bytes_out": 234567890, "diff_time": {...},
+     "slowest": {"page": "Foo", "revision": 1234, "time": 2.3},
+     "counts": {"reverts": 12, "timeouts": 0}, "gauges": {}}
+
+Rates, `diff_time` percentiles and `slowest` describe the interval since the
+last report.  Totals are cumulative.
+"""
+import json
+import random
+import sys
+import time
+
+
+class Metrics:
+    """
+    :Parameters:
+        text_output : file
+            Where to write human-readable reports (e.g. `sys.stderr`)
+        json_output : file
+            Where to write JSON-lines reports
+        interval : float
+            The number of seconds between reports
+        position : :class:`~mwstreaming.checkpoint.InputPosition`
+            The position of the input reader (used to report bytes read)
+        sample_size : int
+            The maximum number of diff times to keep per interval for
+            computing percentiles
+    """
+    def __init__(self, text_output=None, json_output=None, interval=60,
+                 position=None, sample_size=10000):
+        self.text_output = text_output
+        self.json_output = json_output
+        self.interval = interval
+        self.position = position
+        self.sample_size = sample_size
+
+        self.revisions = 0
+        self.pages = 0
+        self.bytes_out = 0
+        self.counts = {}
+        self.gauges = {}
+
+        self.start = time.time()
+        self.last_report = self.start
+        self.last_revisions = 0
+        self.last_pages = 0
+        self.last_bytes_in = 0
+        self.last_bytes_out = 0
+        self.reset_interval()
+
+    def reset_interval(self):
+        self.diff_times = []
+        self.diff_times_seen = 0
+        self.slowest = None
+
+    def revision(self):
+        self.revisions += 1
+        if time.time() - self.last_report >= self.interval:
+            self.report()
+
+    def page(self):
+        self.pages += 1
+
+    def wrote(self, length):
+        self.bytes_out += length
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def gauge(self, name, get_value):
+        """
+        Registers a function that will be called to include a value in each
+        report.
+        """
+        self.gauges[name] = get_value
+
+    def diff_time(self, seconds, revision_doc):
+        """
+        Records how long it took to diff a revision.  Percentiles are
+        computed from a random sample of the interval's diff times.
+        """
+        self.diff_times_seen += 1
+        if len(self.diff_times) < self.sample_size:
+            self.diff_times.append(seconds)
+        else:
+            i = random.randrange(self.diff_times_seen)
+            if i < self.sample_size:
+                self.diff_times[i] = seconds
+
+        if self.slowest is None or seconds > self.slowest['time']:
+            self.slowest = {'page': revision_doc['page'].get('title'),
+                            'revision': revision_doc.get('id'),
+                            'time': seconds}
+
+    @property
+    def bytes_in(self):
+        return self.position.offset if self.position is not None else None
+
+    def report(self):
+        now = time.time()
+        elapsed = max(now - self.last_report, 0.000001)
+        bytes_in = self.bytes_in
+
+        doc = {
+            'time': now,
+            'elapsed': now - self.start,
+            'revisions': self.revisions,
+            'revisions_per_sec': (self.revisions - self.last_revisions) /
+                                 elapsed,
+            'pages': self.pages,
+            'pages_per_sec': (self.pages - self.last_pages) / elapsed,
+            'bytes_in': bytes_in,
+            'bytes_in_per_sec': (bytes_in - self.last_bytes_in) / elapsed
+                                if bytes_in is not None else None,
+            'bytes_out': self.bytes_out,
+            'bytes_out_per_sec': (self.bytes_out - self.last_bytes_out) /
+                                 elapsed,
+            'diff_time': percentiles(self.diff_times),
+            'slowest': self.slowest,
+            'counts': dict(self.counts),
+            'gauges': {name: get_value()
+                       for name, get_value in self.gauges.items()}
+        }
+
+        if self.json_output is not None:
+            self.json_output.write(json.dumps(doc) + "\n")
+            self.json_output.flush()
+        if self.text_output is not None:
+            self.text_output.write(format_report(doc) + "\n")
+            self.text_output.flush()
+
+        self.last_report = now
+        self.last_revisions = self.revisions
+        self.last_pages = self.pages
+        self.last_bytes_in = bytes_in or 0
+        self.last_bytes_out = self.bytes_out
+        self.reset_interval()
+
+    def close(self):
+        """
+        Writes a final report.
+        """
+        self.report()
+        if self.json_output is not None:
+            self.json_output.close()
+
+    @classmethod
+    def from_options(cls, path, interval, verbose, position=None):
+        """
+        Constructs metrics from command-line options.  Returns `None` if no
+        reporting was requested.
+        """
+        if path is None and not verbose:
+            return None
+
+        return cls(text_output=sys.stderr if verbose else None,
+                   json_output=open(path, "w") if path is not None else None,
+                   interval=interval, position=position)
+
+
+def from_verbose(verbose, metrics=None):
+    """
+    Returns `metrics` or, for callers that only pass the `verbose` flag that
+    utilities' functions used to take, metrics that report to <stderr>.
+    """
+    if metrics is None and verbose:
+        return Metrics(text_output=sys.stderr)
+    else:
+        return metrics
+
+def percentiles(values):
+    if len(values) == 0:
+        return None
+
+    values = sorted(values)
+    return {
+        'p50': values[int(len(values) * 0.50)],
+        'p90': values[int(len(values) * 0.90)],
+        'p99': values[int(len(values) * 0.99)],
+        'max': values[-1]
+    }
+
+def format_report(doc):
+    parts = ["{0:.0f}s".format(doc['elapsed']),
+             "revisions={0} ({1:.1f}/s)".format(doc['revisions'],
+                                                doc['revisions_per_sec']),
+             "pages={0} ({1:.2f}/s)".format(doc['pages'],
+                                            doc['pages_per_sec'])]
+    if doc['bytes_in'] is not None:
+        parts.append("in={0:.1f}MB ({1:.2f}MB/s)".format(
+            doc['bytes_in'] / 2**20, doc['bytes_in_per_sec'] / 2**20))
+    parts.append("out={0:.1f}MB ({1:.2f}MB/s)".format(
+        doc['bytes_out'] / 2**20, doc['bytes_out_per_sec'] / 2**20))
+
+    if doc['diff_time'] is not None:
+        parts.append("diff_time p50={p50:.3f} p90={p90:.3f} p99={p99:.3f} "
+                     "max={max:.3f}".format(**doc['diff_time']))
+    if doc['slowest'] is not None:
+        parts.append("slowest={page!r}:{revision}".format(**doc['slowest']))
+
+    parts.extend("{0}={1}".format(name, value)
+                 for name, value in sorted(doc['counts'].items()))
+    parts.extend("{0}={1}".format(name, json.dumps(value))
+                 for name, value in sorted(doc['gauges'].items()))
+
+    return " ".join(parts)
@@ -22,26 +22,94 @@ Data processing utilities:
 * persistence2stats     Aggregates a token persistence statistics to revision
                         statistics
 
+* prepare               Upgrades RevisionDocument JSON blobs to the latest
+                        schema, truncates their text and optionally validates
+                        them in a single pass.
+
+* serve                 Runs a local service that adds diffs to RevisionDocument
+                        JSON blobs sent over a socket or HTTP
+
 * wikihadoop2json       Converts a Wikihadoop-processed stream of XML pages to
                         JSON blobs
 
 General utilities:
 
+* aggregate             Sums or counts fields of a stream of JSON blobs grouped
+                        by one or more keys.
+
+* compact_state         Removes stale page states from an `--incremental` state
+                        database and reclaims unused space.
+
+* index                 Builds an offset index of a file of JSON lines so that
+                        utilities can read only a few pages or revisions.
+
+* json2parquet          Writes fields of a stream of JSON blobs to a Parquet
+                        file as typed columns.
+
 * json2tsv              Converts a stream of JSON blobs to tab-separated values
                         based a set of /fieldnames/.
 
 * normalize             Normalizes old versions of RevisionDocument json schemas
                         to correspond to the most recent schema version.
 
+* plan                  Estimates the cost of each file of a multi-file run from
+                        a sample and assigns files to workers largest-first.
+
 * validate              Validates JSON against a provided schema.
 
 * truncate_text         Truncates the 'text' field of JSON blobs to a limited
                         length in unicode characters.  (addresses content dump
                         vandalism issues) and adds a boolean 'truncated' field.
 
+Profiling:
+
+A utility can be profiled by passing `--profile=<path>` before its name.
+pstats output is written to <path> once `--profile-records` records have been
+read or written or `--profile-seconds` have passed, and the run continues
+unprofiled.
+A summary of the time spent decoding input, computing and encoding output is
+printed to <stderr> at the end of the run.
+
+$ mwstream --profile=json2diffs.prof json2diffs --config=conf.yaml \
+           < revisions.json > diffs.json
+$ python -m pstats json2diffs.prof
+
+`--profile-mode=sample` samples the stack every `--profile-interval`
+milliseconds rather than tracing every call, which is cheap enough to leave on
+for a whole production run.
+
+Pipelining:
+
+Utilities read (and split lines) in a reader thread and encode and write
+output in a writer thread while they compute, so that computing doesn't wait
+on pipes or an upstream decompressor and vice versa.  The stages are connected
+by queues of up to `--queue-depth` batches.  With `--metrics` or `--verbose`,
+each queue's occupancy is reported as the 'queues' gauge, which shows which
+stage is the bottleneck (see :mod:`mwstreaming.pipeline`).  `--queue-depth=0`
+runs every stage in one thread.
+
+$ mwstream --queue-depth=64 json2diffs --config=conf.yaml --verbose \
+           < revisions.json > diffs.json
+
 Usage:
     mwstream (-h | --help)
-    mwstream <utility> [-h|--help]
+    mwstream [--profile=<path>] [--profile-mode=<mode>]
+             [--profile-records=<num>] [--profile-seconds=<secs>]
+             [--profile-interval=<ms>] [--queue-depth=<batches>]
+             <utility> [-h|--help]
+
+Options:
+    --profile=<path>          Write pstats output to this path
+    --profile-mode=<mode>     "cprofile" or "sample" [default: cprofile]
+    --profile-records=<num>   Stop profiling after this many records have been
+                              read or written [default: <mode_default>]
+    --profile-seconds=<secs>  Stop profiling after this many seconds
+                              [default: <all>]
+    --profile-interval=<ms>   The sampling interval in milliseconds when
+                              `--profile-mode=sample` [default: 5]
+    --queue-depth=<batches>   The number of batches to queue between the
+                              reading, computing and writing stages
+                              [default: 16]
 """
 
 import sys
@@ -50,10 +118,20 @@ from importlib import import_module
 
 import docopt
 
-
 USAGE = """Usage:
     mwstream (-h | --help)
-    mwstream <utility> [-h|--help]\n"""
+    mwstream [--profile=<path>] [--profile-mode=<mode>]
+             [--profile-records=<num>] [--profile-seconds=<secs>]
+             [--profile-interval=<ms>] [--queue-depth=<batches>]
+             <utility> [-h|--help]\n"""
+
+PROFILE_RECORDS = {
+    'cprofile': 10000,
+    'sample': None
+}
+"""
+The default number of records to profile in each mode.
+"""
 
 
 def main():
@@ -64,11 +142,23 @@ def main():
     elif sys.argv[1] in ("-h", "--help"):
         sys.stderr.write(__doc__ + "\n")
         sys.exit(1)
-    elif sys.argv[1][:1] == "-":
+
+    # Options for mwstream itself come before the utility's name
+    i = 1
+    while i < len(sys.argv) and \
+          sys.argv[i].startswith(("--profile", "--queue-depth")):
+        i += 1 if "=" in sys.argv[i] else 2
+
+    if i >= len(sys.argv) or sys.argv[i][:1] == "-":
         sys.stderr.write(USAGE)
         sys.exit(1)
 
-    module_name = sys.argv[1]
+    args = docopt.docopt(__doc__, argv=sys.argv[1:i + 1])
+
+    from . import pipeline
+    pipeline.QUEUE_DEPTH = int(args['--queue-depth'])
+
+    module_name = sys.argv[i]
     try:
         module = import_module("mwstreaming.utilities." + module_name)
     except ImportError as e:
@@ -76,6 +166,28 @@ def main():
         sys.stderr.write("Could not load utility {0}.\n".format(module_name))
         sys.exit(1)
 
-    module.main(sys.argv[2:])
+    if args['--profile'] is None:
+        module.main(sys.argv[i + 1:])
+    else:
+        mode = args['--profile-mode']
+        if args['--profile-records'] == "<mode_default>":
+            records = PROFILE_RECORDS.get(mode)
+        else:
+            records = int(args['--profile-records'])
+
+        if args['--profile-seconds'] == "<all>":
+            seconds = None
+        else:
+            seconds = float(args['--profile-seconds'])
+
+        from . import profiling
+        profile = profiling.start(args['--profile'], mode=mode,
+                                  records=records, seconds=seconds,
+                                  interval=float(args['--profile-interval']) /
+                                           1000)
+        try:
+            module.main(sys.argv[i + 1:])
+        finally:
+            profiling.finish(profile)
 
 if __name__ == "__main__": main()
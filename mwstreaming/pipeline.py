@@ -0,0 +1,384 @@
+"""
+Overlaps reading, computing and writing.  A utility's `run()` loop is the
+compute stage.  Input is read (and split into lines) by a reader thread and
+output is encoded and written by a writer thread.  The stages are connected by
+bounded queues of batches, so a stage that gets ahead of the next one blocks
+rather than buffering without limit.  The threads overlap waiting (on pipes,
+an upstream decompressor or a slow consumer) with computing.  They don't
+compute in parallel, so a stage that is purely CPU-bound gains nothing.
+
+The depth of the queues (in batches) can be set with
+`mwstream --queue-depth=<batches>`.  A depth of 0 runs all stages in the
+calling thread, as does profiling (so that stage timings stay meaningful).
+
+While metrics are being reported, the occupancy of each queue is included as
+the 'queues' gauge:
+
+.. code-block:: javascript
+
+    {"read": {"depth": 16, "size": 16, "occupancy": 0.97,
+              "full_wait": 12.1, "empty_wait": 0.0},
+     "write": {"depth": 16, "size": 0, "occupancy": 0.02,
+               "full_wait": 0.0, "empty_wait": 11.8}}
+
+`occupancy` is the average fraction of the queue that was filled when a batch
+was added.  `full_wait` is the time the producing stage spent blocked on a
+full queue and `empty_wait` the time the consuming stage spent waiting on an
+empty one.  A full read queue and an empty write queue (as above) mean that
+compute is the bottleneck.  An empty read queue means that reading is and a
+full write queue means that writing is.
+"""
+import atexit
+import io
+import json
+import queue
+import threading
+import time
+
+from . import profiling
+from .records import to_json
+from .utilities.util import write_doc
+
+QUEUE_DEPTH = 16
+"""
+The number of batches each queue holds.  0 disables the reader and writer
+threads.
+"""
+
+BATCH_SIZE = 256
+"""
+The maximum number of lines (or documents) per batch.
+"""
+
+BLOCK_SIZE = 2 ** 16
+"""
+The number of bytes per read when reading ahead a byte stream.
+"""
+
+QUEUES = {}
+"""
+The most recent :class:`StageQueue` by name.
+"""
+
+READERS = set()
+"""
+The (`stop`, `stage_queue`, `thread`) of each running reader thread.
+"""
+
+END = object()
+
+
+def queue_depth():
+    """
+    Returns the depth of the queues between stages, or 0 if stages should run
+    in the calling thread.
+    """
+    if profiling.STAGES is not None:
+        return 0
+    return QUEUE_DEPTH
+
+def queue_stats():
+    return {name: stage_queue.stats()
+            for name, stage_queue in sorted(QUEUES.items())}
+
+
+class StageQueue:
+    """
+    A bounded queue of batches between two stages that keeps track of how
+    full it is and how long each side waited on the other.
+    """
+    def __init__(self, name, depth):
+        self.name = name
+        self.depth = depth
+        self.queue = queue.Queue(depth)
+
+        self.batches = 0
+        self.filled = 0
+        self.full_wait = 0.0
+        self.empty_wait = 0.0
+
+        QUEUES[name] = self
+
+    def put(self, batch):
+        self.batches += 1
+        self.filled += self.queue.qsize()
+        try:
+            self.queue.put_nowait(batch)
+        except queue.Full:
+            start = time.perf_counter()
+            self.queue.put(batch)
+            self.full_wait += time.perf_counter() - start
+
+    def get(self):
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            start = time.perf_counter()
+            batch = self.queue.get()
+            self.empty_wait += time.perf_counter() - start
+            return batch
+
+    def empty(self):
+        return self.queue.empty()
+
+    def drain(self):
+        """
+        Discards the batches in the queue (so that a blocked producer can
+        continue).
+        """
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def stats(self):
+        return {
+            'depth': self.depth,
+            'size': self.queue.qsize(),
+            'occupancy': round(self.filled / max(self.batches, 1) /
+                               self.depth, 3),
+            'full_wait': round(self.full_wait, 3),
+            'empty_wait': round(self.empty_wait, 3)
+        }
+
+
+def read_ahead(items, name="read", depth=None, batch_size=BATCH_SIZE):
+    """
+    Generates `items`, which are produced by a reader thread up to `depth`
+    batches ahead of the caller.  A batch is handed over early when the
+    caller is waiting, so sparse input (e.g. `tail -f`) isn't held back.
+    Errors raised while producing items are re-raised in the caller.  If the
+    caller stops early (it raised or closed the generator), the reader thread
+    is stopped and waited for.
+    """
+    depth = queue_depth() if depth is None else depth
+    if depth == 0:
+        yield from items
+        return
+
+    stage_queue = StageQueue(name, depth)
+    stop = threading.Event()
+    thread = threading.Thread(target=produce,
+                              args=(items, stage_queue, batch_size, stop),
+                              daemon=True)
+    reader = (stop, stage_queue, thread)
+    READERS.add(reader)
+    thread.start()
+
+    try:
+        while True:
+            batch = stage_queue.get()
+            if batch is END:
+                break
+            elif isinstance(batch, BaseException):
+                raise batch
+            yield from batch
+    finally:
+        stop_reader(*reader)
+        READERS.discard(reader)
+
+def stop_reader(stop, stage_queue, thread):
+    """
+    Stops a reader thread and waits for it.  A reader that is left running
+    (e.g. blocked on a full queue) can hold the lock of the input (e.g.
+    <stdin>) while the interpreter shuts down, which aborts it.
+    """
+    stop.set()
+    while thread.is_alive():
+        stage_queue.drain()
+        thread.join(0.01)
+
+@atexit.register
+def stop_readers():
+    """
+    Stops the readers of generators that were never closed (e.g. because an
+    error was raised while they were being consumed).
+    """
+    for reader in list(READERS):
+        stop_reader(*reader)
+
+def produce(items, stage_queue, batch_size, stop):
+    try:
+        batch = []
+        for item in items:
+            if stop.is_set():
+                return
+            batch.append(item)
+            if len(batch) >= batch_size or stage_queue.empty():
+                stage_queue.put(batch)
+                batch = []
+
+        if len(batch) > 0: stage_queue.put(batch)
+        stage_queue.put(END)
+    except BaseException as e:
+        stage_queue.put(e)
+
+def open_read_ahead(f, depth=None):
+    """
+    Returns a text stream that reads the bytes of the text stream `f` in a
+    reader thread (e.g. for an XML parser).  Returns `f` if stages run in the
+    calling thread.
+    """
+    depth = queue_depth() if depth is None else depth
+    if depth == 0:
+        return f
+
+    return io.TextIOWrapper(io.BufferedReader(ReadAheadStream(f.buffer,
+                                                              depth)),
+                            encoding='utf-8')
+
+
+class ReadAheadStream(io.RawIOBase):
+    """
+    A raw byte stream that is read from `buffer` in blocks by a reader thread.
+    """
+    def __init__(self, buffer, depth=None, block_size=BLOCK_SIZE):
+        # read1() returns what is available rather than waiting for a full
+        # block
+        read = getattr(buffer, 'read1', buffer.read)
+        self.blocks = read_ahead(iter(lambda: read(block_size), b""),
+                                 depth=depth, batch_size=1)
+        self.block = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while len(self.block) == 0:
+            block = next(self.blocks, None)
+            if block is None:
+                return 0
+            self.block = memoryview(block)
+
+        length = min(len(b), len(self.block))
+        b[:length] = self.block[:length]
+        self.block = self.block[length:]
+        return length
+
+
+class Writer:
+    """
+    Writes documents (as lines of JSON) and text to `f` from a writer thread
+    that does the encoding.  Documents must not be modified once they are
+    written.  A `Writer` can be used as a file (e.g. as a checkpoint's output)
+    -- `flush()` waits until everything queued has been written.  Used as a
+    context manager, it is closed (and everything queued is written) even if
+    the computation fails.
+
+    :Parameters:
+        f : file
+            Where to write
+        metrics : :class:`~mwstreaming.metrics.Metrics`
+            Records the number of characters written and the queues'
+            occupancy
+        depth : int
+            The number of batches to queue.  0 writes in the calling thread.
+    """
+    def __init__(self, f, metrics=None, depth=None, batch_size=BATCH_SIZE):
+        self.f = f
+        self.metrics = metrics
+        self.batch_size = batch_size
+        self.batch = []
+        self.error = None
+
+        depth = queue_depth() if depth is None else depth
+        if depth > 0:
+            self.queue = StageQueue("write", depth)
+            self.thread = threading.Thread(target=self.consume, daemon=True)
+            self.thread.start()
+            if metrics is not None: metrics.gauge('queues', queue_stats)
+        else:
+            self.queue = None
+
+    def write_doc(self, doc):
+        if self.queue is None:
+            length = write_doc(doc, self.f)
+            if self.metrics is not None: self.metrics.wrote(length)
+        else:
+            self.add(doc)
+
+        # Counted here rather than in the writer thread so that the window
+        # of a profile closes in the compute stage.
+        stages = profiling.STAGES
+        if stages is not None: stages.wrote(1)
+
+    def write(self, text):
+        stages = profiling.STAGES
+        if self.queue is None:
+            if stages is not None: start = time.perf_counter()
+            self.write_text(text)
+            if stages is not None:
+                stages.encoded(time.perf_counter() - start)
+        else:
+            self.add(text)
+
+        if stages is not None: stages.wrote(text.count("\n"))
+        return len(text)
+
+    def add(self, item):
+        self.batch.append(item)
+        if len(self.batch) >= self.batch_size or self.queue.empty():
+            self.send()
+
+    def send(self):
+        if self.error is not None:
+            raise self.error
+        if len(self.batch) > 0:
+            self.queue.put(self.batch)
+            self.batch = []
+
+    def consume(self):
+        while True:
+            batch = self.queue.get()
+            try:
+                if batch is END:
+                    break
+                elif self.error is None:
+                    self.write_text("".join(item if isinstance(item, str)
+                                            else encode(item)
+                                            for item in batch))
+            except BaseException as e:
+                # Raised in the calling thread.  Later batches are dropped.
+                self.error = e
+            finally:
+                self.queue.queue.task_done()
+
+    def write_text(self, text):
+        self.f.write(text)
+        if self.metrics is not None: self.metrics.wrote(len(text))
+
+    def flush(self):
+        """
+        Waits until everything that was written has been written to `f` and
+        flushes it.
+        """
+        if self.queue is not None:
+            self.send()
+            self.queue.queue.join()
+            if self.error is not None:
+                raise self.error
+        self.f.flush()
+
+    def fileno(self):
+        return self.f.fileno()
+
+    def close(self):
+        """
+        Flushes and stops the writer thread.  `f` is left open.
+        """
+        self.flush()
+        if self.queue is not None:
+            self.queue.put(END)
+            self.thread.join()
+            self.queue = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def encode(doc):
+    return json.dumps(doc, default=to_json) + "\n"
@@ -0,0 +1,144 @@
+"""
+An LRU cache of per-page diff processors.  This makes it possible to diff a
+stream of revisions that is interleaved across pages (e.g. a live, time-ordered
+feed of edits) without sorting it by page first.
+
+The cache is bounded by an approximate memory budget.  When it is exceeded,
+the least recently used processors are evicted and their last revision's text
+is spilled to a :class:`~mwstreaming.state.StateStore`.  Evicted processors are
+reconstructed from the spilled text on demand.
+"""
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+from .state import StateStore
+
+BYTES_PER_CHAR = 12
+"""
+The approximate memory used by a processor (tokens, segments and the text
+itself) per character of the last text.
+"""
+
+
+class CacheEntry:
+    __slots__ = ('processor', 'id', 'timestamp', 'text', 'size')
+
+    def __init__(self, processor, id, timestamp, text):
+        self.processor = processor
+        self.id = id
+        self.timestamp = timestamp
+        self.text = text
+        self.size = BYTES_PER_CHAR * len(text)
+
+    def state(self):
+        return {'id': self.id, 'timestamp': self.timestamp, 'text': self.text}
+
+
+class ProcessorCache:
+    """
+    Caches diff processors by page id.
+
+    :Parameters:
+        diff_engine : :class:`deltas.DiffEngine`
+            Used to construct new processors
+        max_bytes : int
+            The approximate memory budget for cached processors
+        spill : :class:`~mwstreaming.state.StateStore`
+            Where evicted processor state is written.  A temporary store is
+            used if not provided.
+    """
+    def __init__(self, diff_engine, max_bytes, spill=None):
+        self.diff_engine = diff_engine
+        self.max_bytes = max_bytes
+
+        if spill is None:
+            self.spill_dir = tempfile.mkdtemp(prefix="mwstreaming-")
+            self.spill = StateStore(os.path.join(self.spill_dir, "spill.db"),
+                                    "diffs")
+        else:
+            self.spill_dir = None
+            self.spill = spill
+
+        self.entries = OrderedDict()
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.evictions = 0
+
+    def get(self, page_id):
+        """
+        Gets the processor for a page.
+
+        :Returns:
+            A tuple of (`processor`, `state`) where `state` is a dict of the
+            `id`, `timestamp` and `text` of the last revision processed or
+            `None` if the page has not been seen before.
+        """
+        if page_id in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(page_id)
+            entry = self.entries[page_id]
+            return entry.processor, entry.state()
+
+        self.misses += 1
+        state = self.spill.get(page_id)
+        if state is None:
+            return self.diff_engine.processor(), None
+        else:
+            self.reloads += 1
+            processor = self.diff_engine.processor(last_text=state['text'])
+            return processor, state
+
+    def put(self, page_id, processor, revision_doc):
+        """
+        Caches `processor` after it has processed `revision_doc` and evicts
+        least recently used processors until the cache fits in `max_bytes`.
+        """
+        if page_id in self.entries:
+            self.bytes -= self.entries[page_id].size
+
+        entry = CacheEntry(processor, revision_doc['id'],
+                           revision_doc['timestamp'],
+                           revision_doc['text'] or "")
+        self.entries[page_id] = entry
+        self.entries.move_to_end(page_id)
+        self.bytes += entry.size
+
+        while self.bytes > self.max_bytes and len(self.entries) > 1:
+            old_page_id, old_entry = self.entries.popitem(last=False)
+            self.bytes -= old_entry.size
+            self.spill.put(old_page_id, old_entry.state())
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'pages': len(self.entries),
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups > 0 else None,
+            'reloads': self.reloads,
+            'evictions': self.evictions
+        }
+
+    def close(self):
+        """
+        Writes the state of all cached processors to the spill store (so that
+        a later `--incremental` run can pick them up) and closes it.  A
+        temporary spill store is removed.
+        """
+        if self.spill_dir is None:
+            for page_id, entry in self.entries.items():
+                self.spill.put(page_id, entry.state())
+
+        self.spill.close()
+        self.entries.clear()
+        self.bytes = 0
+
+        if self.spill_dir is not None:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
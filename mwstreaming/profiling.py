@@ -0,0 +1,263 @@
+"""
+Profiling hooks for `mwstream --profile=<path>`.  A profile covers a bounded
+window of a run -- the first `records` records or the first `seconds` seconds
+-- after which the utility continues unprofiled.  Records are counted as they
+are read and as they are written (whichever count is higher), so the window
+also closes for utilities that only write records (e.g. dump2json) and ones
+that only write at the end (e.g. aggregate).  Stats are written in
+:mod:`pstats` format.
+
+Two modes are available:
+
+* `cprofile` -- deterministic profiling of every call with :mod:`cProfile`.
+  Accurate, but slows a utility down substantially.
+* `sample` -- samples the stack every `interval` seconds of CPU time using
+  `SIGPROF`.  Overhead is low enough for long production runs.
+
+While profiling, input read with :func:`timed_decode` (e.g. by
+:func:`~mwstreaming.utilities.util.read_docs`) and output written with a
+:class:`~mwstreaming.pipeline.Writer` are timed as the decode and encode
+stages of a utility so that I/O can be told apart from compute.
+"""
+import cProfile
+import marshal
+import signal
+import sys
+import threading
+import time
+from collections import defaultdict
+
+STAGES = None
+"""
+The :class:`StageTimers` of the running profile or `None` when not profiling.
+"""
+
+
+class StageTimers:
+    """
+    Accumulates the time spent decoding input and encoding output.  Compute is
+    whatever is left of the wall-clock time.
+    """
+    def __init__(self, profile=None):
+        self.profile = profile
+        self.start = time.perf_counter()
+        self.decode = 0.0
+        self.encode = 0.0
+        self.read = 0
+        self.written = 0
+
+    @property
+    def records(self):
+        return max(self.read, self.written)
+
+    def timed_decode(self, docs):
+        """
+        Wraps an iterator of decoded documents (or lines) and times and counts
+        each `next()`.
+        """
+        docs = iter(docs)
+        while True:
+            # Checked once the previous record has been processed
+            self.check()
+            start = time.perf_counter()
+            try:
+                doc = next(docs)
+            except StopIteration:
+                self.decode += time.perf_counter() - start
+                return
+            self.decode += time.perf_counter() - start
+            self.read += 1
+            yield doc
+
+    def encoded(self, seconds):
+        self.encode += seconds
+
+    def wrote(self, records):
+        self.written += records
+        self.check()
+
+    def check(self):
+        if self.profile is not None:
+            self.profile.check(self.records)
+
+    def report(self):
+        wall = time.perf_counter() - self.start
+        return {
+            'wall': wall,
+            'decode': self.decode,
+            'compute': max(wall - self.decode - self.encode, 0),
+            'encode': self.encode,
+            'records': self.records
+        }
+
+
+class Profile:
+    """
+    Base class for profiles that run over a bounded window.
+
+    :Parameters:
+        path : str
+            Where to write pstats output
+        records : int
+            Stop profiling after this many records have been read or written
+        seconds : float
+            Stop profiling after this many seconds.  Checked by an alarm (when
+            started in the main thread), so the window closes even while no
+            records arrive.
+    """
+    def __init__(self, path, records=None, seconds=None):
+        self.path = path
+        self.records = records
+        self.seconds = seconds
+        self.active = False
+        self.started = None
+        self.old_alarm_handler = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.active = True
+        if self.seconds is not None and \
+           threading.current_thread() is threading.main_thread():
+            self.old_alarm_handler = signal.signal(signal.SIGALRM,
+                                                   self.alarm)
+            signal.setitimer(signal.ITIMER_REAL, self.seconds)
+
+    def alarm(self, signum, frame):
+        self.stop()
+
+    def check(self, records):
+        if not self.active:
+            return
+        if (self.records is not None and records >= self.records) or \
+           (self.seconds is not None and
+            time.perf_counter() - self.started >= self.seconds):
+            self.stop()
+
+    def stop(self):
+        if self.active:
+            self.active = False
+            if self.old_alarm_handler is not None:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+                signal.signal(signal.SIGALRM, self.old_alarm_handler)
+                self.old_alarm_handler = None
+            self.dump()
+
+    def dump(self):
+        raise NotImplementedError()
+
+
+class DeterministicProfile(Profile):
+
+    def start(self):
+        self.profiler = cProfile.Profile()
+        super().start()
+        self.profiler.enable()
+
+    def dump(self):
+        self.profiler.disable()
+        self.profiler.dump_stats(self.path)
+
+
+class SamplingProfile(Profile):
+    """
+    Samples the stack of the main thread every `interval` seconds of CPU time
+    and writes the counts as pstats data.  Each sample is attributed
+    `interval` seconds.  A signal is used rather than a sampling thread since
+    a thread would only get to run when the main thread releases the GIL,
+    which biases samples towards I/O.
+    """
+    def __init__(self, path, records=None, seconds=None, interval=0.005):
+        super().__init__(path, records=records, seconds=seconds)
+        self.interval = interval
+        self.samples = 0
+        self.self_counts = defaultdict(int)
+        self.total_counts = defaultdict(int)
+        self.caller_counts = defaultdict(lambda: defaultdict(int))
+
+    def start(self):
+        super().start()
+        self.old_handler = signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append((code.co_filename, code.co_firstlineno,
+                          code.co_name))
+            frame = frame.f_back
+
+        self.samples += 1
+        self.self_counts[stack[0]] += 1
+        for func in set(stack):
+            self.total_counts[func] += 1
+        for callee, caller in set(zip(stack, stack[1:])):
+            self.caller_counts[callee][caller] += 1
+
+    def dump(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self.old_handler)
+
+        stats = {}
+        for func, total in self.total_counts.items():
+            callers = {caller: (n, n, 0.0, n * self.interval)
+                       for caller, n in self.caller_counts[func].items()}
+            stats[func] = (total, total,
+                           self.self_counts.get(func, 0) * self.interval,
+                           total * self.interval, callers)
+
+        with open(self.path, "wb") as f:
+            marshal.dump(stats, f)
+
+
+MODES = {
+    'cprofile': DeterministicProfile,
+    'sample': SamplingProfile
+}
+
+def start(path, mode="cprofile", records=None, seconds=None, interval=None):
+    """
+    Starts profiling and stage timing.  Returns the :class:`Profile`.
+    """
+    global STAGES
+    if mode not in MODES:
+        raise ValueError("Unknown profile mode {0}.  Expected one of {1}."
+                         .format(repr(mode), ", ".join(sorted(MODES))))
+
+    if mode == "sample" and interval is not None:
+        profile = SamplingProfile(path, records=records, seconds=seconds,
+                                  interval=interval)
+    else:
+        profile = MODES[mode](path, records=records, seconds=seconds)
+
+    STAGES = StageTimers(profile)
+    profile.start()
+    return profile
+
+def timed_decode(items):
+    """
+    Times and counts reading `items` (documents or lines) if profiling.
+    """
+    if STAGES is None:
+        return items
+    return STAGES.timed_decode(items)
+
+def finish(profile, output=None):
+    """
+    Stops `profile` (if its window is still open) and writes a summary of the
+    stage timers to `output`.
+    """
+    global STAGES
+    output = output or sys.stderr
+    profile.stop()
+    if STAGES is not None:
+        output.write("Stages: " + format_stages(STAGES.report()) + "\n")
+        STAGES = None
+
+def format_stages(doc):
+    wall = max(doc['wall'], 0.000001)
+    return " ".join(
+        ["{0}={1:.3f}s ({2:.0%})".format(stage, doc[stage], doc[stage] / wall)
+         for stage in ('decode', 'compute', 'encode')] +
+        ["wall={0:.3f}s".format(doc['wall']),
+         "records={0}".format(doc['records'])])
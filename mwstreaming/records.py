@@ -0,0 +1,270 @@
+"""
+Compact, `__slots__`-based records of RevisionDocuments for stages that run
+in-process.  Records behave like the JSON dict form (`doc['page']['id']`,
+`doc['diff'] = ...`, `doc.pop('diff', None)`), so generators like
+:func:`~mwstreaming.utilities.json2diffs.json2diffs` and
+:func:`~mwstreaming.utilities.diffs2persistence.token_persistence` accept
+either.
+
+Page and contributor sub-records are interned by an :class:`Interner` so that
+all revisions of a page share one :class:`PageRecord` and each contributor of
+a page has one :class:`ContributorRecord`.
+
+Records are converted to dicts lazily with :meth:`Record.to_doc`.
+:func:`to_json` can be passed as the `default` of :func:`json.dumps` so that
+records are encoded like their dict form.
+"""
+
+
+class Record:
+    """
+    Base class for records.  Keys are the `FIELDS` of a record.  Unset fields
+    are missing keys.
+
+    Records are equal to records and dicts with the same content.  They hash
+    by their `HASH_FIELDS` (a subset of what they are compared by), so a
+    record must not change those fields while it is in a set or a dict key.
+    """
+    __slots__ = ()
+    FIELDS = ()
+    HASH_FIELDS = ()
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        try:
+            setattr(self, key, value)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __delitem__(self, key):
+        try:
+            delattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return isinstance(key, str) and key in self.FIELDS and \
+               hasattr(self, key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, *default):
+        try:
+            value = self[key]
+        except KeyError:
+            if len(default) > 0:
+                return default[0]
+            raise
+        del self[key]
+        return value
+
+    def keys(self):
+        return [key for key in self.FIELDS if hasattr(self, key)]
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        elif isinstance(other, (Record, dict)):
+            return self.to_doc() == (other.to_doc()
+                                     if isinstance(other, Record) else other)
+        else:
+            return NotImplemented
+
+    def __hash__(self):
+        return hash(tuple(getattr(self, key, None)
+                          for key in self.HASH_FIELDS))
+
+    def to_doc(self):
+        """
+        Converts the record (and its sub-records) to its JSON dict form.
+        """
+        return {key: value.to_doc() if isinstance(value, Record) else value
+                for key, value in self.items()}
+
+    @classmethod
+    def from_doc(cls, doc):
+        record = cls()
+        for key, value in doc.items():
+            record[key] = value
+        return record
+
+    def __repr__(self):
+        return "{0}({1})".format(self.__class__.__name__, repr(self.to_doc()))
+
+
+class PageRecord(Record):
+    __slots__ = FIELDS = ('id', 'title', 'namespace', 'redirect_title',
+                          'restrictions')
+    HASH_FIELDS = ('id', 'title')
+
+
+class ContributorRecord(Record):
+    __slots__ = FIELDS = ('id', 'user_text')
+
+    def __eq__(self, other):
+        # Contributors are compared a lot in diffs2persistence
+        if self is other:
+            return True
+        elif isinstance(other, ContributorRecord):
+            return self.id == other.id and self.user_text == other.user_text
+        else:
+            return super().__eq__(other)
+
+    def __hash__(self):
+        return hash((self.id, self.user_text))
+
+
+class RevisionRecord(Record):
+    """
+    A RevisionDocument.  Fields that are not part of the schema (other than
+    the common 'diff', 'tokens' and 'truncated') are stored in `extra`.
+    """
+    FIELDS = ('page', 'id', 'timestamp', 'contributor', 'minor', 'comment',
+              'text', 'bytes', 'sha1', 'parent_id', 'model', 'format',
+              'truncated', 'diff', 'tokens')
+    __slots__ = FIELDS + ('extra',)
+    HASH_FIELDS = ('id',)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            extra = getattr(self, 'extra', None)
+            if extra is not None and key in extra:
+                return extra[key]
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in self.FIELDS:
+            setattr(self, key, value)
+        else:
+            if getattr(self, 'extra', None) is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self.FIELDS and hasattr(self, key):
+            delattr(self, key)
+        elif getattr(self, 'extra', None) is not None and key in self.extra:
+            del self.extra[key]
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return (key in self.FIELDS and hasattr(self, key)) or \
+               (getattr(self, 'extra', None) is not None and
+                key in self.extra)
+
+    def keys(self):
+        keys = [key for key in self.FIELDS if hasattr(self, key)]
+        if getattr(self, 'extra', None) is not None:
+            keys.extend(self.extra)
+        return keys
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+
+class Interner:
+    """
+    Shares page and contributor sub-records between revisions.  Only the
+    current page's records are kept, so memory stays bounded.
+    """
+    def __init__(self):
+        self.page = None
+        self.page_key = None
+        self.source = None
+        self.contributors = {}
+
+    def page_record(self, page_doc):
+        if isinstance(page_doc, PageRecord):
+            return page_doc
+        key = (page_doc.get('id'), page_doc.get('title'),
+               page_doc.get('namespace'), page_doc.get('redirect_title'))
+        if key != self.page_key:
+            self.new_page(PageRecord.from_doc(page_doc))
+            self.page_key = key
+        return self.page
+
+    def source_page_record(self, source, convert):
+        """
+        Returns the page record of `source` (e.g. a page of an XML dump).
+        `convert` converts `source` to a page dict and is only called when
+        `source` changes.
+        """
+        if source is not self.source:
+            self.new_page(PageRecord.from_doc(convert(source)))
+            self.source = source
+        return self.page
+
+    def new_page(self, page):
+        self.page = page
+        self.page_key = None
+        self.source = None
+        self.contributors = {}
+
+    def contributor_record(self, contributor_doc):
+        if contributor_doc is None or \
+           isinstance(contributor_doc, ContributorRecord):
+            return contributor_doc
+        return self.contributor(contributor_doc.get('id'),
+                                contributor_doc.get('user_text'))
+
+    def contributor(self, id, user_text):
+        key = (id, user_text)
+        record = self.contributors.get(key)
+        if record is None:
+            record = ContributorRecord()
+            record.id = id
+            record.user_text = user_text
+            self.contributors[key] = record
+        return record
+
+    def revision_record(self, revision_doc):
+        """
+        Converts a RevisionDocument dict to a :class:`RevisionRecord`.
+        """
+        record = RevisionRecord()
+        for key, value in revision_doc.items():
+            if key == 'page':
+                value = self.page_record(value)
+            elif key == 'contributor':
+                value = self.contributor_record(value)
+            record[key] = value
+        return record
+
+
+def from_docs(revision_docs):
+    """
+    Converts a stream of RevisionDocument dicts to :class:`RevisionRecord`s.
+    """
+    interner = Interner()
+    for revision_doc in revision_docs:
+        yield interner.revision_record(revision_doc)
+
+def to_json(obj):
+    """
+    A `default` for :func:`json.dumps` that encodes records.
+    """
+    if isinstance(obj, Record):
+        return obj.to_doc()
+    else:
+        raise TypeError("{0} is not JSON serializable".format(repr(obj)))
@@ -0,0 +1,71 @@
+"""
+Selects a deterministic sample of pages by a stable hash of their page id and
+a seed.  Every stage that is given the same rate and seed selects the same
+pages (independently of the order or partitioning of its input), so a sampled
+`dump2diffs` run can be continued by sampled `diffs2persistence` runs or
+compared to other sampled runs.
+
+Pages are sampled before their revisions are read (from XML) or decoded (from
+JSON lines), so sampled-out pages cost little more than reading past them.
+"""
+import hashlib
+
+HASH_BYTES = 8
+
+
+class PageSampler:
+    """
+    Selects a fraction `rate` of page ids.
+
+    :Parameters:
+        rate : float
+            The fraction of pages to select (between 0 and 1)
+        seed : int
+            Selects a different (but equally deterministic) sample
+    """
+    def __init__(self, rate, seed=0):
+        if not 0 <= rate <= 1:
+            raise RuntimeError("The page sampling rate must be between 0 " +
+                               "and 1, not {0}".format(rate))
+        self.rate = rate
+        self.seed = seed
+        self.threshold = int(rate * 2 ** (HASH_BYTES * 8))
+        self.extractor = None
+
+    def sampled(self, page_id):
+        """
+        Returns True if `page_id` is in the sample.
+        """
+        key = "{0}:{1}".format(self.seed, page_id).encode('utf-8')
+        digest = hashlib.blake2b(key, digest_size=HASH_BYTES).digest()
+        return int.from_bytes(digest, 'big') < self.threshold
+
+    def sampled_line(self, line):
+        """
+        Returns True if the JSON document in `line` (a str) belongs to a
+        sampled page.  Only the 'page.id' is decoded.
+        """
+        if self.extractor is None:
+            from .utilities.json2tsv import FieldExtractor
+            self.extractor = FieldExtractor(["page.id"])
+        page_id, = self.extractor.extract(line)
+        return self.sampled(page_id)
+
+    def filter_docs(self, docs):
+        """
+        Generates the documents of `docs` that belong to sampled pages.
+        """
+        for doc in docs:
+            if self.sampled(doc['page']['id']):
+                yield doc
+
+    @classmethod
+    def from_options(cls, rate, seed):
+        """
+        Constructs a sampler from `--sample-pages` and `--sample-seed`
+        options.  Returns `None` if all pages are selected.
+        """
+        rate = float(rate)
+        if rate >= 1:
+            return None
+        return cls(rate, int(seed))
@@ -0,0 +1,131 @@
+"""
+An on-disk store of per-page processing state.  This allows utilities to run
+incrementally -- picking up where the last run left off for each page rather
+than re-processing a page's entire history.
+
+States are JSON-serializable documents stored (zlib compressed) in a local
+SQLite database.  Each utility keeps its states under its own `kind` so that a
+single database can be shared.
+
+.. code-block:: python
+
+    store = StateStore("states.db", "diffs")
+    state = store.get(page_id)
+    ...
+    store.put(page_id, {'id': rev_id, 'text': text})
+    store.close()
+"""
+import json
+import sqlite3
+import time
+import zlib
+
+from .records import to_json
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS page_state (
+    kind      TEXT NOT NULL,
+    page_id   INTEGER NOT NULL,
+    updated   REAL NOT NULL,
+    state     BLOB NOT NULL,
+    PRIMARY KEY (kind, page_id)
+)
+"""
+
+
+class StateStore:
+    """
+    Stores per-page state documents for one `kind` of processing.
+
+    :Parameters:
+        path : str
+            The path of the SQLite database file.  Created if it doesn't exist.
+        kind : str
+            The kind of state (e.g. "diffs" or "persistence")
+        commit_every : int
+            The number of `put()`s between commits
+    """
+    def __init__(self, path, kind, commit_every=1000):
+        self.path = path
+        self.kind = kind
+        self.commit_every = commit_every
+        self.uncommitted = 0
+
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(SCHEMA)
+        self.db.commit()
+
+    def get(self, page_id):
+        """
+        Returns the stored state for `page_id` or `None`.
+        """
+        row = self.db.execute(
+            "SELECT state FROM page_state WHERE kind = ? AND page_id = ?",
+            (self.kind, page_id)).fetchone()
+        if row is None:
+            return None
+        else:
+            return decode(row[0])
+
+    def put(self, page_id, state):
+        """
+        Stores `state` for `page_id`, replacing any prior state.
+        """
+        self.db.execute(
+            "INSERT OR REPLACE INTO page_state VALUES (?, ?, ?, ?)",
+            (self.kind, page_id, time.time(), encode(state)))
+
+        self.uncommitted += 1
+        if self.uncommitted >= self.commit_every:
+            self.commit()
+
+    def commit(self):
+        self.db.commit()
+        self.uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+
+def compact(path, kind=None, before=None):
+    """
+    Removes states (optionally only of `kind`) that were last updated before
+    the unix time `before` and reclaims unused space.  Returns the number of
+    states removed.
+    """
+    db = sqlite3.connect(path)
+    db.execute(SCHEMA)
+
+    removed = 0
+    if before is not None:
+        if kind is None:
+            cursor = db.execute("DELETE FROM page_state WHERE updated < ?",
+                                (before,))
+        else:
+            cursor = db.execute("DELETE FROM page_state " +
+                                "WHERE kind = ? AND updated < ?",
+                                (kind, before))
+        removed = cursor.rowcount
+        db.commit()
+
+    db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    db.execute("VACUUM")
+    db.close()
+
+    return removed
+
+def encode(state):
+    return zlib.compress(json.dumps(state, default=to_json).encode('utf-8'))
+
+def decode(blob):
+    return json.loads(str(zlib.decompress(blob), 'utf-8'))
+
+def is_newer(doc, state):
+    """
+    Checks if a revision document was saved after the revision that `state`
+    was last updated with.
+    """
+    return (doc['timestamp'], doc['id']) > (state['timestamp'], state['id'])
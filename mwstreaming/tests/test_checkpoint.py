@@ -0,0 +1,63 @@
+import io
+import json
+import os
+import tempfile
+
+from nose.tools import eq_
+
+from ..checkpoint import Checkpoint, InputPosition
+from ..utilities.util import read_docs
+
+
+class FakeStdin:
+    def __init__(self, data):
+        self.buffer = io.BytesIO(data)
+
+def test_input_position():
+    lines = [json.dumps({'id': i, 'page': {'id': i // 2}}) + "\n"
+             for i in range(4)]
+    stdin = FakeStdin("".join(lines).encode('utf-8'))
+    position = InputPosition()
+
+    docs = read_docs(stdin, position=position)
+    next(docs)
+    next(docs)
+    next(docs) # Read-ahead into the second page
+    eq_(position.boundary(), (len(lines[0]) + len(lines[1]), 2))
+
+    eq_(len(list(docs)), 1)
+    eq_(position.boundary(), (sum(len(l) for l in lines), 4))
+
+def test_resume():
+    lines = [json.dumps({'id': i}) + "\n" for i in range(4)]
+    data = "".join(lines).encode('utf-8')
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "test.ckpt")
+
+    checkpoint = Checkpoint(path, position=InputPosition(), interval=0)
+    docs = read_docs(FakeStdin(data), position=checkpoint.position)
+    next(docs)
+    next(docs)
+    next(docs)
+    checkpoint.page_done(10)
+
+    stdin = FakeStdin(data)
+    checkpoint = Checkpoint.start(path, resume=True, input=stdin)
+    eq_(checkpoint.resumed_pages, 1)
+    eq_(checkpoint.page_id, 10)
+    eq_([d['id'] for d in read_docs(stdin, position=checkpoint.position)],
+        [2, 3])
+
+def test_resume_without_checkpoint():
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "test.ckpt")
+
+    with open(os.path.join(directory, "output.json"), "a+") as output:
+        output.write("Written before the first checkpoint\n")
+        output.flush()
+
+        checkpoint = Checkpoint.start(path, resume=True, output=output)
+        eq_(checkpoint.resumed_pages, 0)
+        output.write("Resumed\n")
+        output.seek(0)
+        eq_(output.read(), "Resumed\n")
@@ -0,0 +1,48 @@
+import io
+import json
+
+from nose.tools import eq_
+
+from ..compact_persistence import CompactWriter, group_revisions
+
+
+def token_stats(*tokens):
+    return [{'token': token, 'persisted': 1, 'processed': 2,
+             'non_self_persisted': 0, 'non_self_processed': 1,
+             'seconds_visible': 10, 'seconds_possible': 20}
+            for token in tokens]
+
+REVISIONS = [
+    ({'id': 1, 'page': {'id': 1}}, token_stats("foo", " ", "bar")),
+    ({'id': 2, 'page': {'id': 1}}, []),
+    ({'id': 3, 'page': {'id': 1}}, token_stats("bar", "baz")),
+    ({'id': 4, 'page': {'id': 2}}, token_stats("foo"))
+]
+
+def read(lines):
+    return [(revision_doc, list(token_docs)) for revision_doc, token_docs
+            in group_revisions(json.loads(line) for line in lines)]
+
+def test_compact():
+    expected = [(doc, stats) for doc, stats in REVISIONS if len(stats) > 0]
+
+    for token_dictionary in (False, True):
+        f = io.StringIO()
+        writer = CompactWriter(f, token_dictionary=token_dictionary)
+        for revision_doc, stats in REVISIONS:
+            writer.write(revision_doc, stats)
+
+        lines = f.getvalue().splitlines()
+        eq_(len(lines), 3 + 6)
+        eq_(read(lines), expected)
+
+    # The last page's dictionary starts over
+    eq_(json.loads(lines[-2])['token_offset'], 0)
+
+def test_tokens():
+    lines = [json.dumps(dict(ts, revision=revision_doc))
+             for revision_doc, stats in REVISIONS for ts in stats]
+    eq_([(revision_doc, [{k: v for k, v in ts.items() if k != 'revision'}
+                         for ts in token_docs])
+         for revision_doc, token_docs in read(lines)],
+        [(doc, stats) for doc, stats in REVISIONS if len(stats) > 0])
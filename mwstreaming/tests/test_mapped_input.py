@@ -0,0 +1,56 @@
+import json
+import os
+import tempfile
+
+from nose.tools import eq_
+
+from ..checkpoint import InputPosition
+from ..mapped_input import chunk_boundaries, read_docs
+
+
+def write_lines(lines):
+    f = tempfile.NamedTemporaryFile("w", suffix=".json", delete=False)
+    for line in lines:
+        f.write(json.dumps(line) + "\n")
+    f.close()
+    return f.name
+
+def test_read_docs():
+    docs = [{'id': i, 'page': {'id': i // 3}, 'text': "é ☃ " * i}
+            for i in range(50)]
+    path = write_lines(docs)
+    try:
+        with open(path) as f:
+            position = InputPosition()
+            read = list(read_docs(f, 2, position=position, chunk_size=100))
+
+        eq_(read, docs)
+        eq_(position.offset, os.path.getsize(path))
+        eq_(position.records, len(docs))
+    finally:
+        os.remove(path)
+
+def test_page_aligned_chunks():
+    lines = []
+    for page_id in range(1, 6):
+        for rev_id in range(page_id * 10, page_id * 10 + page_id):
+            lines.append({'revision': {'id': rev_id, 'page': {'id': page_id}}})
+            lines.extend([rev_id, "token", 1, 1, 1, 1, 0, 0]
+                         for _ in range(3))
+    data = "".join(json.dumps(line) + "\n" for line in lines).encode('utf-8')
+
+    for chunk_size in range(1, len(data) + 2, 17):
+        boundaries = list(chunk_boundaries(data, 0, chunk_size,
+                                           align_pages=True))
+        eq_(boundaries[0][0], 0)
+        eq_(boundaries[-1][1], len(data))
+
+        pages = []
+        for start, end in boundaries:
+            chunk = [json.loads(line)
+                     for line in data[start:end].splitlines()]
+            # Chunks start with a revision and hold whole pages
+            eq_(isinstance(chunk[0], dict), True)
+            pages.append({line['revision']['page']['id']
+                          for line in chunk if isinstance(line, dict)})
+        eq_(sum(len(chunk_pages) for chunk_pages in pages), 5)
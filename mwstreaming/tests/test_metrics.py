@@ -0,0 +1,43 @@
+import io
+import json
+
+from nose.tools import eq_
+
+from ..checkpoint import InputPosition
+from ..metrics import Metrics, from_verbose, percentiles
+
+
+def test_percentiles():
+    eq_(percentiles([]), None)
+    eq_(percentiles([3, 1, 2, 4]), {'p50': 3, 'p90': 4, 'p99': 4, 'max': 4})
+
+def test_from_verbose():
+    metrics = Metrics()
+    eq_(from_verbose(False), None)
+    eq_(from_verbose(True, metrics), metrics)
+    eq_(from_verbose(False, metrics), metrics)
+    eq_(from_verbose(True).text_output is not None, True)
+
+def test_report():
+    json_output = io.StringIO()
+    position = InputPosition()
+    metrics = Metrics(json_output=json_output, interval=3600,
+                      position=position)
+
+    for i in range(3):
+        position.advance(10)
+        metrics.diff_time(i, {'id': i, 'page': {'title': "Foo"}})
+        metrics.wrote(5)
+        metrics.revision()
+    metrics.page()
+    metrics.count('timeouts')
+    metrics.gauge('answer', lambda: 42)
+    metrics.report()
+
+    doc = json.loads(json_output.getvalue())
+    eq_((doc['revisions'], doc['pages']), (3, 1))
+    eq_((doc['bytes_in'], doc['bytes_out']), (30, 15))
+    eq_(doc['diff_time']['max'], 2)
+    eq_(doc['slowest'], {'page': "Foo", 'revision': 2, 'time': 2})
+    eq_(doc['counts'], {'timeouts': 1})
+    eq_(doc['gauges'], {'answer': 42})
@@ -0,0 +1,108 @@
+import io
+import json
+import os
+import subprocess
+import sys
+import threading
+
+from nose.tools import eq_
+
+from ..pipeline import READERS, ReadAheadStream, Writer, read_ahead
+
+
+def test_read_ahead():
+    eq_(list(read_ahead(range(1000), depth=2, batch_size=7)),
+        list(range(1000)))
+    eq_(list(read_ahead(range(10), depth=0)), list(range(10)))
+
+    def fail():
+        yield 1
+        raise ValueError("Broken input")
+
+    try:
+        list(read_ahead(fail(), depth=2))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Expected a ValueError")
+
+def test_read_ahead_close():
+    produced = []
+    def items():
+        for i in range(10000):
+            produced.append(i)
+            yield i
+
+    threads = threading.active_count()
+    items_ = read_ahead(items(), depth=2, batch_size=10)
+    next(items_)
+    items_.close()
+
+    # The reader was stopped rather than left blocked on a full queue
+    eq_(threading.active_count(), threads)
+    eq_(len(READERS), 0)
+    eq_(len(produced) < 100, True)
+
+def test_read_ahead_error():
+    # The reader is still running when the first line fails to parse
+    lines = ["not json\n"] + \
+            [json.dumps({'id': i, 'page': {'id': i}, 'text': "Foo"}) + "\n"
+             for i in range(5000)]
+
+    root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [root] + ([env['PYTHONPATH']] if 'PYTHONPATH' in env else []))
+
+    process = subprocess.run(
+        [sys.executable, "-m", "mwstreaming.mwstream", "truncate_text"],
+        input="".join(lines).encode('utf-8'), stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE, env=env)
+
+    eq_(process.returncode, 1)
+    eq_(b"JSONDecodeError" in process.stderr, True)
+
+def test_read_ahead_stream():
+    data = "".join("{0} é ☃\n".format(i) for i in range(5000)).encode('utf-8')
+    stream = io.TextIOWrapper(
+        io.BufferedReader(ReadAheadStream(io.BytesIO(data), depth=2,
+                                          block_size=1000)),
+        encoding='utf-8')
+
+    eq_(stream.read(), str(data, 'utf-8'))
+
+def test_writer():
+    docs = [{'id': i, 'text': "é" * i} for i in range(1000)]
+    expected = "".join(json.dumps(doc) + "\n" for doc in docs)
+
+    for depth in (0, 2):
+        f = io.StringIO()
+        with Writer(f, depth=depth, batch_size=10) as output:
+            for doc in docs[:500]:
+                output.write_doc(doc)
+            # Everything written so far is in `f` after a flush
+            output.flush()
+            eq_(f.getvalue(), expected[:len(f.getvalue())])
+            eq_(len(f.getvalue().splitlines()), 500)
+            for doc in docs[500:]:
+                output.write(json.dumps(doc) + "\n")
+
+        eq_(f.getvalue(), expected)
+
+def test_writer_error():
+    class BrokenFile:
+        def write(self, text):
+            raise BrokenPipeError()
+
+        def flush(self):
+            pass
+
+    output = Writer(BrokenFile(), depth=2)
+    output.write_doc({'id': 1})
+    try:
+        output.close()
+    except BrokenPipeError:
+        pass
+    else:
+        raise AssertionError("Expected a BrokenPipeError")
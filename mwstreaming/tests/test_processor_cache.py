@@ -0,0 +1,36 @@
+from nose.tools import eq_
+
+from ..processor_cache import BYTES_PER_CHAR, ProcessorCache
+
+
+class FakeDiffEngine:
+    def processor(self, last_text=''):
+        return FakeProcessor(last_text)
+
+class FakeProcessor:
+    def __init__(self, last_text):
+        self.last_text = last_text
+
+def revision_doc(id, text):
+    return {'id': id, 'timestamp': "2015-01-01T00:00:00Z", 'text': text}
+
+def test_eviction():
+    cache = ProcessorCache(FakeDiffEngine(), BYTES_PER_CHAR * 10)
+
+    processor, state = cache.get(1)
+    eq_(state, None)
+    cache.put(1, processor, revision_doc(10, "12345"))
+
+    processor, state = cache.get(2)
+    cache.put(2, processor, revision_doc(20, "123456"))  # Evicts page 1
+    eq_(cache.stats()['evictions'], 1)
+    eq_(list(cache.entries), [2])
+
+    processor, state = cache.get(1)
+    eq_(state['id'], 10)
+    eq_(processor.last_text, "12345")
+
+    stats = cache.stats()
+    eq_((stats['hits'], stats['misses'], stats['reloads']), (0, 3, 1))
+
+    cache.close()
@@ -0,0 +1,82 @@
+import io
+import os
+import pstats
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+from nose.tools import eq_
+
+from .. import profiling
+from ..utilities import json2tsv
+from ..utilities.util import read_docs, write_doc
+
+
+class FakeStdin:
+    def __init__(self, data):
+        self.buffer = io.BytesIO(data)
+
+def busy():
+    return sum(i * i for i in range(200000))
+
+def test_profile():
+    for mode in ('cprofile', 'sample'):
+        path = os.path.join(tempfile.mkdtemp(), "out.prof")
+        profile = profiling.start(path, mode=mode, records=2,
+                                  interval=0.001)
+
+        output = io.StringIO()
+        for doc in read_docs(FakeStdin(b'{"id": 1}\n{"id": 2}\n{"id": 3}\n')):
+            busy()
+            write_doc(doc, output)
+
+        # The window closed after two records
+        eq_(profile.active, False)
+        eq_(profiling.STAGES.records, 3)
+
+        messages = io.StringIO()
+        profiling.finish(profile, messages)
+        eq_(profiling.STAGES, None)
+        assert messages.getvalue().startswith("Stages: decode=")
+
+        stats = pstats.Stats(path)
+        assert any(func[2] == "busy" for func in stats.stats), mode
+
+def test_profile_text():
+    # json2tsv reads lines and writes text rather than documents
+    data = "".join('{{"id": {0}, "page": {{"id": 1}}}}\n'.format(i)
+                   for i in range(200)).encode('utf-8')
+    path = os.path.join(tempfile.mkdtemp(), "out.prof")
+    profile = profiling.start(path, records=5)
+
+    stdin = sys.stdin
+    sys.stdin = FakeStdin(data)
+    try:
+        output = io.StringIO()
+        with redirect_stdout(output):
+            json2tsv.main(["id", "page.id"])
+    finally:
+        sys.stdin = stdin
+
+    eq_(profile.active, False)
+    eq_(profiling.STAGES.read, 200)
+    eq_(profiling.STAGES.written, 200)
+    eq_(len(output.getvalue().splitlines()), 200)
+    profiling.finish(profile, io.StringIO())
+
+    # Only the first records were profiled
+    stats = pstats.Stats(path)
+    calls = sum(n for func, (_, n, *rest) in stats.stats.items()
+                if func[2] == "extract")
+    eq_(calls, 5)
+
+def test_profile_seconds():
+    path = os.path.join(tempfile.mkdtemp(), "out.prof")
+    profile = profiling.start(path, seconds=0.05)
+
+    # No records arrive, but the window closes anyway
+    time.sleep(0.2)
+    eq_(profile.active, False)
+    eq_(os.path.exists(path), True)
+    profiling.finish(profile, io.StringIO())
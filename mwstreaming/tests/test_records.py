@@ -0,0 +1,57 @@
+import json
+
+from nose.tools import eq_, raises
+
+from ..records import ContributorRecord, RevisionRecord, from_docs, to_json
+
+
+def test_from_docs():
+    revision_docs = [
+        {'page': {'id': 1, 'title': "Foo"}, 'id': 1,
+         'contributor': {'id': 10, 'user_text': "Bar"}, 'text': "Foo"},
+        {'page': {'id': 1, 'title': "Foo"}, 'id': 2,
+         'contributor': {'id': 10, 'user_text': "Bar"}, 'text': "Foo bar",
+         'persistence_stats': {'tokens_added': 1}},
+        {'page': {'id': 2, 'title': "Baz"}, 'id': 3, 'contributor': None}
+    ]
+    records = list(from_docs(json.loads(json.dumps(doc))
+                             for doc in revision_docs))
+
+    # Sub-records are shared within a page
+    eq_(records[0]['page'] is records[1]['page'], True)
+    eq_(records[0]['contributor'] is records[1]['contributor'], True)
+    eq_(records[1]['page'] is records[2]['page'], False)
+
+    eq_([r.to_doc() for r in records], revision_docs)
+    eq_(json.loads(json.dumps(records, default=to_json)), revision_docs)
+    eq_(records[1]['persistence_stats'], {'tokens_added': 1})
+    eq_(records[2]['contributor'], None)
+    eq_(records[0]['contributor'] != revision_docs[0]['contributor'], False)
+
+def test_mapping():
+    record = RevisionRecord()
+    record['id'] = 1
+    record['diff'] = {'ops': []}
+    eq_('diff' in record, True)
+    eq_(record.pop('diff'), {'ops': []})
+    eq_(record.pop('diff', None), None)
+    eq_('diff' in record, False)
+    eq_(record.get('text'), None)
+    eq_(list(record.keys()), ['id'])
+
+@raises(KeyError)
+def test_missing():
+    ContributorRecord()['user_text']
+
+def test_hash():
+    records = list(from_docs([
+        {'page': {'id': 1, 'title': "Foo"}, 'id': 1,
+         'contributor': {'id': 10, 'user_text': "Bar"}},
+        {'page': {'id': 1, 'title': "Foo"}, 'id': 1,
+         'contributor': {'id': 10, 'user_text': "Bar"}},
+        {'page': {'id': 1, 'title': "Foo"}, 'id': 2, 'contributor': None}
+    ]))
+
+    eq_(len({records[0], records[1], records[2]}), 2)
+    eq_({records[0]['page']: "Foo"}[records[2]['page']], "Foo")
+    eq_(hash(records[0]) == hash(RevisionRecord.from_doc({'id': 1})), True)
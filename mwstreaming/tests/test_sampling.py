@@ -0,0 +1,61 @@
+import io
+import json
+
+from mw import xml_dump
+from nose.tools import eq_
+
+from ..benchmarks.synthetic import SyntheticWiki, write_xml
+from ..checkpoint import InputPosition
+from ..sampling import PageSampler
+from ..utilities.dump2json import dump2json
+from ..utilities.util import read_docs
+
+
+def test_sampled():
+    sampler = PageSampler(0.25, seed=1)
+    sampled = [page_id for page_id in range(4000) if sampler.sampled(page_id)]
+
+    eq_(900 < len(sampled) < 1100, True)
+    # Page ids are hashed the same way whether they are read as strings
+    eq_(sampled, [page_id for page_id in range(4000)
+                  if PageSampler(0.25, seed=1).sampled(str(page_id))])
+    eq_(sampled == [page_id for page_id in range(4000)
+                    if PageSampler(0.25, seed=2).sampled(page_id)], False)
+
+    # Smaller samples are subsets of larger samples with the same seed
+    eq_(set(page_id for page_id in range(4000)
+            if PageSampler(0.1, seed=1).sampled(page_id)) <= set(sampled),
+        True)
+
+    eq_(PageSampler.from_options("1", "0"), None)
+    eq_(all(PageSampler(0).sampled(page_id) is False
+            for page_id in range(100)), True)
+
+def test_sample_stages():
+    xml = io.StringIO()
+    write_xml(SyntheticWiki(pages=40, seed=3, large_text_rate=0), xml)
+    sampler = PageSampler(0.5, seed=7)
+
+    xml.seek(0)
+    all_docs = list(dump2json(xml_dump.Iterator.from_file(xml)))
+    xml.seek(0)
+    sampled_docs = list(dump2json(xml_dump.Iterator.from_file(xml),
+                                  sampler=sampler))
+
+    eq_(sampled_docs, [doc for doc in all_docs
+                       if sampler.sampled(doc['page']['id'])])
+    eq_(0 < len(sampled_docs) < len(all_docs), True)
+
+    # A later stage with the same seed keeps all of a sampled stage's output
+    data = "".join(json.dumps(doc) + "\n" for doc in all_docs).encode('utf-8')
+    position = InputPosition()
+    eq_(list(read_docs(io.TextIOWrapper(io.BytesIO(data)), position=position,
+                       sampler=sampler)),
+        sampled_docs)
+    eq_(position.offset, len(data))
+    eq_(position.records, len(all_docs))
+
+    data = "".join(json.dumps(doc) + "\n"
+                   for doc in sampled_docs).encode('utf-8')
+    eq_(list(read_docs(io.TextIOWrapper(io.BytesIO(data)), sampler=sampler)),
+        sampled_docs)
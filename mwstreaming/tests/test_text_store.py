@@ -0,0 +1,96 @@
+import copy
+import io
+import json
+import os
+import tempfile
+import tracemalloc
+
+from nose.tools import eq_
+
+from .. import pipeline
+from ..text_store import TextDeduplicator, TextStore, hydrate_texts
+from ..utilities.util import read_docs
+
+
+class FakeStdin:
+    def __init__(self, data):
+        self.buffer = io.BytesIO(data)
+
+def revision_docs():
+    texts = ["Foo", "Bar", "Foo", "Baz", "Bar", None, "Foo"]
+    docs = []
+    for i, text in enumerate(texts):
+        docs.append({'id': i + 1, 'page': {'id': 1}, 'text': text})
+        # An interleaved page with the same texts
+        docs.append({'id': i + 101, 'page': {'id': 2}, 'text': text})
+    return docs
+
+def test_dedupe():
+    docs = revision_docs()
+    deduplicator = TextDeduplicator(window=3)
+    deduped = [deduplicator.dedupe(doc) for doc in copy.deepcopy(docs)]
+
+    eq_([doc.get('text_ref') for doc in deduped if doc['page']['id'] == 1],
+        [None, None, 1, None, 2, None, 3])
+    eq_([doc['text'] for doc in deduped if 'text_ref' in doc], [None] * 6)
+
+    eq_(list(hydrate_texts(deduped, window=3)), docs)
+
+def test_store():
+    docs = revision_docs()
+    path = os.path.join(tempfile.mkdtemp(), "texts.db")
+
+    deduplicator = TextDeduplicator(store=TextStore(path))
+    deduped = [deduplicator.dedupe(doc) for doc in copy.deepcopy(docs)]
+    deduplicator.close()
+
+    eq_(all(doc['text'] is None for doc in deduped), True)
+    eq_(len({doc['text_sha1'] for doc in deduped if 'text_sha1' in doc}), 3)
+
+    store = TextStore(path)
+    eq_(list(hydrate_texts(copy.deepcopy(deduped), store)), docs)
+    store.close()
+
+    try:
+        list(hydrate_texts(deduped))
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("Expected a RuntimeError")
+
+def test_read_docs():
+    docs = revision_docs()
+    deduplicator = TextDeduplicator()
+    deduped = [deduplicator.dedupe(doc) for doc in copy.deepcopy(docs)]
+    data = "".join(json.dumps(doc) + "\n" for doc in deduped).encode('utf-8')
+
+    eq_(list(read_docs(FakeStdin(data), hydrate=True)), docs)
+    # Only readers that need texts restore them
+    eq_(list(read_docs(FakeStdin(data))), deduped)
+
+def test_read_docs_keeps_no_texts():
+    # Distinct 100KB texts that hydrating would remember
+    data = "".join(json.dumps({'id': i, 'page': {'id': 1},
+                               'text': str(i % 10) * 100000}) + "\n"
+                   for i in range(30)).encode('utf-8')
+
+    def retained(**kwargs):
+        stdin = FakeStdin(data)
+        tracemalloc.start()
+        try:
+            docs = read_docs(stdin, **kwargs)
+            # Stop short of the end so that the reader is still alive
+            for _ in range(29):
+                next(docs)
+            return tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+
+    # Without read-ahead, so that only texts are retained
+    queue_depth = pipeline.QUEUE_DEPTH
+    pipeline.QUEUE_DEPTH = 0
+    try:
+        eq_(retained(hydrate=True) > 1000000, True)
+        eq_(retained() < 500000, True)
+    finally:
+        pipeline.QUEUE_DEPTH = queue_depth
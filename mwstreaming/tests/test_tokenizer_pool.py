@@ -0,0 +1,30 @@
+import os
+
+from nose.tools import eq_
+
+from ..benchmarks.synthetic import SyntheticWiki
+from ..tokenizer_pool import TokenizerPool
+from ..utilities.json2diffs import json2diffs
+from ..utilities.util import load_diff_engine
+
+CONFIG = os.path.join(os.path.dirname(__file__), "..", "..", "config",
+                      "western.diffs.yaml")
+
+
+def test_prepare():
+    diff_engine = load_diff_engine(CONFIG)
+    assert TokenizerPool.supports(diff_engine)
+    wiki = SyntheticWiki(pages=5, seed=3, large_text_chars=10000)
+
+    expected = [doc['diff']['ops']
+                for doc in json2diffs(wiki.revision_docs(), diff_engine)]
+
+    tokenizer_pool = TokenizerPool(CONFIG, 2, 3)
+    try:
+        ops = [doc['diff']['ops']
+               for doc in json2diffs(wiki.revision_docs(), diff_engine,
+                                     tokenizer_pool=tokenizer_pool)]
+    finally:
+        tokenizer_pool.close()
+
+    eq_(ops, expected)
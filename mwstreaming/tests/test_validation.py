@@ -0,0 +1,54 @@
+import json
+import os
+
+from jsonschema import Draft4Validator
+from nose.tools import eq_, ok_
+
+from ..validation import SchemaValidator, compile_schema, format_error
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "docs",
+                           "schemas", "revision_document-0.0.3.json")
+
+SCHEMA = {
+    'type': "object",
+    'required': ["id", "page"],
+    'properties': {
+        'id': {'type': "integer"},
+        'minor': {'type': "boolean"},
+        'model': {'enum': ["wikitext", "css"]},
+        'page': {
+            'type': ["object", "null"],
+            'properties': {'restrictions': {'type': "array",
+                                            'items': {'type': "string"}}}
+        }
+    }
+}
+
+def test_compile_schema():
+    check = compile_schema(SCHEMA)
+    docs = [
+        {'id': 1, 'page': None},
+        {'id': 1, 'page': {'restrictions': ["edit"]}, 'minor': False,
+         'model': "css"},
+        {'id': True, 'page': None},
+        {'id': 1.5, 'page': None},
+        {'id': 1},
+        {'id': 1, 'page': {'restrictions': ["edit", 1]}},
+        {'id': 1, 'page': None, 'minor': 0},
+        {'id': 1, 'page': None, 'model': "javascript"},
+        [1, 2]
+    ]
+    validator = Draft4Validator(SCHEMA)
+    for doc in docs:
+        eq_(check(doc), validator.is_valid(doc))
+
+def test_uncompilable_schema():
+    eq_(compile_schema({'type': "string", 'minLength': 2}), None)
+
+    validator = SchemaValidator({'type': "string", 'minLength': 2})
+    eq_(validator.error("foo"), None)
+    eq_(format_error(validator.error("f")), "<root>: 'f' is too short")
+
+def test_revision_document():
+    validator = SchemaValidator(json.load(open(SCHEMA_PATH)))
+    ok_(validator.check is not None)
@@ -0,0 +1,243 @@
+"""
+Removes repeated texts from RevisionDocuments and puts them back.
+
+In full history dumps, many revisions (e.g. reverts) have exactly the same
+text as an earlier revision of the same page.  A :class:`TextDeduplicator`
+replaces such a text with a 'text_ref' to the id of the most recent of the
+last `TEXT_WINDOW` revisions of the page that had the same text.  With a
+:class:`TextStore`, all (remaining) texts are moved to the store and replaced
+with a 'text_sha1' that they can be looked up by.  In both cases, 'text' is
+set to `None`.
+
+.. code-block:: javascript
+
+    {"id": 12, "text": null, "text_ref": 10, ...}
+    {"id": 13, "text": null, "text_sha1": "0beec7b5ea3f...", ...}
+
+:func:`hydrate_texts` restores the texts as documents are read.  Pages may be
+interleaved, but each page's revisions must be read in the order they were
+written.
+"""
+import hashlib
+import sqlite3
+import zlib
+from collections import OrderedDict, deque
+
+TEXT_WINDOW = 20
+"""
+The number of recent revisions of a page whose texts can be referenced.
+"""
+
+MAX_PAGES = 1024
+"""
+The number of pages to remember recent texts of when pages are interleaved.
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS text (
+    sha1  TEXT NOT NULL PRIMARY KEY,
+    text  BLOB NOT NULL
+)
+"""
+
+
+class TextStore:
+    """
+    Stores texts (zlib compressed) by their SHA1 in a local SQLite database.
+
+    :Parameters:
+        path : str
+            The path of the SQLite database file.  Created if it doesn't exist.
+        commit_every : int
+            The number of `put()`s between commits
+    """
+    def __init__(self, path, commit_every=1000):
+        self.path = path
+        self.commit_every = commit_every
+        self.uncommitted = 0
+
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(SCHEMA)
+        self.db.commit()
+
+    def get(self, sha1):
+        """
+        Returns the text stored for `sha1` or `None`.
+        """
+        row = self.db.execute("SELECT text FROM text WHERE sha1 = ?",
+                              (sha1,)).fetchone()
+        if row is None:
+            return None
+        else:
+            return str(zlib.decompress(row[0]), 'utf-8')
+
+    def put(self, text):
+        """
+        Stores `text` (unless it is already stored) and returns its SHA1.
+        """
+        sha1 = text_sha1(text)
+        self.db.execute("INSERT OR IGNORE INTO text VALUES (?, ?)",
+                        (sha1, zlib.compress(text.encode('utf-8'))))
+
+        self.uncommitted += 1
+        if self.uncommitted >= self.commit_every:
+            self.commit()
+
+        return sha1
+
+    def commit(self):
+        self.db.commit()
+        self.uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+
+class RecentTexts:
+    """
+    Remembers the texts of the last `window` revisions of each of up to
+    `max_pages` pages.  If `index_texts` is True, the most recent revision
+    that had a text can be looked up with `find()`.
+    """
+    def __init__(self, window=TEXT_WINDOW, max_pages=MAX_PAGES,
+                 index_texts=False):
+        self.window = window
+        self.max_pages = max_pages
+        self.index_texts = index_texts
+        self.pages = OrderedDict()
+
+    def page(self, page_id):
+        """
+        Returns the recent texts of `page_id`: a deque of (`rev_id`, `text`)
+        pairs and a dict of the most recent `rev_id` of each text.
+        """
+        recent = self.pages.get(page_id)
+        if recent is None:
+            recent = (deque(), {})
+            self.pages[page_id] = recent
+            if len(self.pages) > self.max_pages:
+                self.pages.popitem(last=False)
+        else:
+            self.pages.move_to_end(page_id)
+        return recent
+
+    def add(self, recent, rev_id, text):
+        revisions, by_text = recent
+        revisions.append((rev_id, text))
+        if self.index_texts: by_text[text] = rev_id
+        if len(revisions) > self.window:
+            old_id, old_text = revisions.popleft()
+            if self.index_texts and by_text.get(old_text) == old_id:
+                del by_text[old_text]
+
+    @staticmethod
+    def get(recent, rev_id):
+        for recent_id, text in recent[0]:
+            if recent_id == rev_id:
+                return text
+        return None
+
+    @staticmethod
+    def find(recent, text):
+        return recent[1].get(text)
+
+
+class TextDeduplicator:
+    """
+    Replaces the texts of RevisionDocuments that repeat a recent text of their
+    page with a 'text_ref' and/or moves them to a :class:`TextStore`.
+
+    :Parameters:
+        dedupe : bool
+            Replace repeated texts within a page with a 'text_ref'
+        store : :class:`TextStore`
+            Where to move (remaining) texts to
+    """
+    def __init__(self, dedupe=True, store=None, window=TEXT_WINDOW):
+        self.recent = RecentTexts(window, index_texts=True) \
+                      if dedupe else None
+        self.store = store
+
+    def dedupe(self, revision_doc):
+        """
+        Removes the text of `revision_doc` (in place) if it can be restored.
+        """
+        text = revision_doc['text']
+        if text is None:
+            return revision_doc
+
+        if self.recent is not None:
+            recent = self.recent.page(revision_doc['page']['id'])
+            text_ref = self.recent.find(recent, text)
+            self.recent.add(recent, revision_doc['id'], text)
+            if text_ref is not None:
+                revision_doc['text'] = None
+                revision_doc['text_ref'] = text_ref
+                return revision_doc
+
+        if self.store is not None:
+            revision_doc['text'] = None
+            revision_doc['text_sha1'] = self.store.put(text)
+
+        return revision_doc
+
+    def close(self):
+        if self.store is not None: self.store.close()
+
+    @classmethod
+    def from_options(cls, dedupe, store_path):
+        """
+        Constructs a deduplicator from `--dedupe-text` and `--text-store`
+        options.  Returns `None` if neither is set.
+        """
+        if not dedupe and store_path is None:
+            return None
+
+        store = TextStore(store_path) if store_path is not None else None
+        return cls(dedupe=dedupe, store=store)
+
+
+def hydrate_texts(docs, store=None, window=TEXT_WINDOW):
+    """
+    Restores the texts of documents that were removed by a
+    :class:`TextDeduplicator`.  Documents without a 'text' and a 'page' are
+    passed through.  `store` is required if any texts were moved to a
+    :class:`TextStore`.
+    """
+    recent = RecentTexts(window)
+    for doc in docs:
+        if isinstance(doc, list) or 'text' not in doc or 'page' not in doc:
+            yield doc
+            continue
+
+        # Pages are looked up just like the deduplicator did so that the same
+        # pages are remembered.
+        page_recent = None
+        if 'text_ref' in doc:
+            page_recent = recent.page(doc['page']['id'])
+            text = recent.get(page_recent, doc['text_ref'])
+            if text is None:
+                raise RuntimeError("Revision {0} references the text of {1}, "
+                                   .format(doc['id'], doc['text_ref']) +
+                                   "which was not read shortly before it.")
+            doc['text'] = text
+            del doc['text_ref']
+        elif 'text_sha1' in doc:
+            if store is None:
+                raise RuntimeError("Texts were moved to a text store.  " +
+                                   "Provide it with --text-store.")
+            doc['text'] = store.get(doc['text_sha1'])
+            del doc['text_sha1']
+
+        if doc['text'] is not None:
+            if page_recent is None:
+                page_recent = recent.page(doc['page']['id'])
+            recent.add(page_recent, doc['id'], doc['text'])
+
+        yield doc
+
+def text_sha1(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
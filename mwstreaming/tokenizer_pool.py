@@ -0,0 +1,76 @@
+"""
+Tokenizes and segments revision texts in a pool of processes ahead of diffing.
+The revisions of a page must be diffed in order, but tokenizing and segmenting
+a revision's text doesn't depend on the previous diff.  So while one process
+matches segments sequentially, the pool prepares the next revisions of the
+page.
+
+Only diff engines whose processors can process pre-segmented text (e.g.
+:class:`deltas.SegmentMatcher`) are supported.
+"""
+from collections import deque
+
+from .utilities.util import load_diff_engine
+
+DIFF_ENGINE = None
+
+
+class TokenizerPool:
+    """
+    Prepares revision texts for diffing in `threads` processes.
+
+    :Parameters:
+        config_path : str
+            The path of the diff engine configuration
+        threads : int
+            The number of processes to tokenize with
+        ahead : int
+            The maximum number of revisions to prepare ahead of diffing
+    """
+    def __init__(self, config_path, threads, ahead):
+        from concurrent.futures import ProcessPoolExecutor
+        from multiprocessing import get_context
+
+        self.executor = ProcessPoolExecutor(threads, get_context("spawn"),
+                                            initializer=init_worker,
+                                            initargs=(config_path,))
+        self.ahead = ahead
+
+    def prepare(self, revision_docs):
+        """
+        Generates (`revision_doc`, (`tokens`, `segments`)) pairs in the order
+        of `revision_docs`.  Reads up to `ahead` revisions ahead.
+        """
+        pending = deque()
+        for revision_doc in revision_docs:
+            pending.append((revision_doc,
+                            self.executor.submit(prepare_text,
+                                                 revision_doc['text'] or "")))
+            if len(pending) > self.ahead:
+                revision_doc, future = pending.popleft()
+                yield revision_doc, future.result()
+
+        while len(pending) > 0:
+            revision_doc, future = pending.popleft()
+            yield revision_doc, future.result()
+
+    def close(self):
+        self.executor.shutdown()
+
+    @staticmethod
+    def supports(diff_engine):
+        """
+        Returns True if `diff_engine`'s processors can process pre-segmented
+        text.
+        """
+        return hasattr(diff_engine, 'segmenter') and \
+               hasattr(diff_engine.processor(), 'process_segments')
+
+
+def init_worker(config_path):
+    global DIFF_ENGINE
+    DIFF_ENGINE = load_diff_engine(config_path)
+
+def prepare_text(text):
+    tokens = DIFF_ENGINE.tokenizer.tokenize(text)
+    return tokens, DIFF_ENGINE.segmenter.segment(tokens)
@@ -0,0 +1,298 @@
+"""
+Aggregates revision statistics (e.g. the output of persistence2stats) by one
+or more dotted <key>s such as `contributor.user_text` or `page.id`.  For each
+group, the number of 'revisions' and the sums of the `--fields` are written
+as a JSON blob that nests the keys and fields just like the input.  Boolean
+fields (e.g. 'censored') are summed as counts of True.
+
+Groups are aggregated in a hash table.  When its estimated size exceeds
+`--max-memory`, the partial aggregates are sorted and spilled to a file in
+`--spill-dir`.  Spilled files are merged in tiers of similar size (so each
+group is only rewritten a few times) and in the end, so there can be many more
+groups than fit in memory.  Groups are written in the order of their keys (as
+JSON).
+
+$ persistence2stats < persistence.json | \\
+  aggregate contributor.user_text --max-memory=4096 > user_stats.json
+
+Usage:
+    aggregate (-h|--help)
+    aggregate <key>... [--fields=<paths>] [--max-memory=<mb>]
+                       [--spill-dir=<path>]
+                       [--index=<path>] [--pages=<ids>] [--revisions=<ids>]
+                       [--metrics=<path>] [--metrics-interval=<secs>]
+                       [--verbose]
+
+Options:
+    -h|--help           Print this documentation
+    <key>               A dotted path of a field to group by
+    --fields=<paths>    A comma separated list of the dotted paths of numeric
+                        fields to sum [default: <persistence_stats>]
+    --max-memory=<mb>   The approximate number of megabytes of groups to hold
+                        in memory before spilling to disk [default: 1024]
+    --spill-dir=<path>  The directory to spill partial aggregates to
+                        [default: <tmp>]
+    --index=<path>      Read the documents of the file indexed at this path
+                        (see `index`) rather than <stdin>
+    --pages=<ids>       A comma separated list of page ids to read from
+                        `--index` [default: <all>]
+    --revisions=<ids>   A comma separated list of revision ids to read from
+                        `--index` [default: <all>]
+    --metrics=<path>    Write periodic throughput metrics to this file as
+                        JSON lines
+    --metrics-interval=<secs>  The number of seconds between metrics reports
+                               [default: 60]
+    --verbose           Print periodic metrics reports to <stderr>
+"""
+import heapq
+import json
+import os
+import sys
+import tempfile
+
+import docopt
+
+from ..checkpoint import InputPosition
+from ..metrics import Metrics
+from ..pipeline import Writer
+from .index import open_input
+from .json2parquet import truncate
+from .json2tsv import apply_keys
+from .util import read_docs
+
+STATS_FIELDS = ("tokens_added", "tokens_persisted", "tokens_non_self_persisted",
+                "sum_log_persisted", "sum_log_non_self_persisted", "censored",
+                "non_self_censored")
+"""
+The 'persistence_stats' fields written by persistence2stats.
+"""
+
+GROUP_BYTES = 200
+"""
+The approximate number of bytes of memory a group takes in addition to its
+key and its sums.
+"""
+
+SUM_BYTES = 32
+"""
+The approximate number of bytes of memory a sum takes.
+"""
+
+MAX_MERGE = 64
+"""
+The maximum number of spilled files to merge at once.  Also the number of files
+of a tier that are merged into a file of the next tier.
+"""
+
+
+def main(argv=None):
+    args = docopt.docopt(__doc__, argv=argv)
+
+    input_file = open_input(args['--index'], args['--pages'],
+                            args['--revisions'])
+
+    keys = args['<key>']
+
+    if args['--fields'] == "<persistence_stats>":
+        fields = ["persistence_stats." + field for field in STATS_FIELDS]
+    else:
+        fields = args['--fields'].split(",")
+
+    max_memory = float(args['--max-memory']) * 1024 * 1024
+
+    if args['--spill-dir'] == "<tmp>":
+        spill_dir = None
+    else:
+        spill_dir = args['--spill-dir']
+
+    verbose = bool(args['--verbose'])
+
+    position = InputPosition()
+    metrics = Metrics.from_options(args['--metrics'],
+                                   float(args['--metrics-interval']), verbose,
+                                   position=position)
+
+    run(read_docs(input_file, position=position), keys, fields, max_memory,
+        spill_dir, metrics)
+
+def run(docs, keys, fields, max_memory, spill_dir, metrics):
+
+    group_docs = aggregate(docs, keys, fields, max_memory, spill_dir,
+                           metrics=metrics)
+
+    with Writer(sys.stdout, metrics) as output:
+        for group_doc in group_docs:
+            output.write_doc(group_doc)
+
+    if metrics is not None: metrics.close()
+
+def aggregate(docs, keys, fields, max_memory=2 ** 30, spill_dir=None,
+              metrics=None):
+    """
+    Generates a group document for each distinct combination of the values of
+    `keys` in `docs` with the number of 'revisions' and the sums of `fields`.
+    """
+    key_paths = [key.split(".") for key in keys]
+    field_paths = [field.split(".") for field in fields]
+
+    with tempfile.TemporaryDirectory(dir=spill_dir) as directory:
+        aggregator = SpillingAggregator(len(fields), max_memory, directory)
+        for n, doc in enumerate(docs, 1):
+            key = json.dumps([apply_keys(doc, path) for path in key_paths])
+            values = [apply_keys(doc, path) for path in field_paths]
+            try:
+                aggregator.add(key, values)
+            except TypeError:
+                raise RuntimeError(describe_invalid(n, fields, values)) \
+                      from None
+            if metrics is not None: metrics.revision()
+
+        if metrics is not None: metrics.count('spills', aggregator.spilled)
+
+        for key, sums in aggregator.groups():
+            group_doc = {}
+            for path, value in zip(key_paths, json.loads(key)):
+                nest(group_doc, path, value)
+            group_doc['revisions'] = sums[0]
+            for path, value in zip(field_paths, sums[1:]):
+                nest(group_doc, path, value)
+
+            yield group_doc
+
+def describe_invalid(n, fields, values):
+    for field, value in zip(fields, values):
+        if value is not None and not isinstance(value, (int, float)):
+            return ("Document {0}: {1} in field {2} is not a number.  " +
+                    "--fields must be numeric or boolean.") \
+                   .format(n, truncate(repr(value)), repr(field))
+    return "Document {0}: Could not sum --fields.".format(n)
+
+def nest(doc, path, value):
+    for key in path[:-1]:
+        doc = doc.setdefault(key, {})
+    doc[path[-1]] = value
+
+
+class SpillingAggregator:
+    """
+    Sums values by key in a hash table that is spilled to sorted files in
+    `directory` whenever its estimated size exceeds `max_memory` bytes.
+
+    :Parameters:
+        fields : int
+            The number of values to sum per key
+        max_memory : int
+            The approximate number of bytes of groups to hold in memory
+        directory : str
+            Where to write spilled files
+    """
+    def __init__(self, fields, max_memory, directory):
+        self.fields = fields
+        self.max_memory = max_memory
+        self.directory = directory
+
+        self.table = {}
+        self.memory = 0
+        self.tiers = []
+        self.spilled = 0
+        self.written = 0
+
+    def add(self, key, values):
+        """
+        Counts a record with `key` and adds its `values` (`None` counts as 0).
+        """
+        sums = self.table.get(key)
+        if sums is None:
+            sums = [0] * (self.fields + 1)
+            self.table[key] = sums
+            self.memory += len(key) + GROUP_BYTES + SUM_BYTES * len(sums)
+
+        sums[0] += 1
+        for i, value in enumerate(values, 1):
+            if value is not None: sums[i] += value
+
+        if self.memory > self.max_memory:
+            self.spill()
+
+    def spill(self):
+        path = self.write(sorted(self.table.items()))
+        self.table = {}
+        self.memory = 0
+        self.spilled += 1
+
+        # Files are only merged with files of the same tier (i.e. of a
+        # similar size), so groups are rewritten once per tier rather than
+        # once per merge.
+        tier = 0
+        while True:
+            if tier == len(self.tiers):
+                self.tiers.append([])
+            self.tiers[tier].append(path)
+            if len(self.tiers[tier]) < MAX_MERGE:
+                break
+
+            path = self.merge(self.tiers[tier])
+            self.tiers[tier] = []
+            tier += 1
+
+    def merge(self, paths):
+        merged_path = self.write(merge_groups(paths))
+        for path in paths:
+            os.remove(path)
+        return merged_path
+
+    def write(self, groups):
+        path = os.path.join(self.directory,
+                            "spill-{0}.json".format(self.written))
+        self.written += 1
+        with open(path, "w") as f:
+            for key, sums in groups:
+                f.write(json.dumps([key, sums]) + "\n")
+        return path
+
+    def groups(self):
+        """
+        Generates (`key`, `sums`) pairs for all groups in the order of their
+        keys.  `sums` starts with the number of records.
+        """
+        # Smallest first
+        paths = [path for files in self.tiers for path in files]
+
+        # Merge the smallest files until the rest can be merged at once
+        while len(paths) > MAX_MERGE:
+            merging = min(len(paths) - MAX_MERGE + 1, MAX_MERGE)
+            paths = [self.merge(paths[:merging])] + paths[merging:]
+        self.tiers = [paths]
+
+        if len(paths) == 0:
+            yield from sorted(self.table.items())
+        else:
+            yield from merge_groups(paths, sorted(self.table.items()))
+
+
+def merge_groups(paths, groups=()):
+    """
+    Merges sorted (`key`, `sums`) pairs from the spilled files at `paths` and
+    `groups` and adds up the sums of equal keys.
+    """
+    files = [open(path) for path in paths]
+    try:
+        runs = [(json.loads(line) for line in f) for f in files]
+        merged = heapq.merge(*runs, iter(groups), key=lambda g: g[0])
+
+        last_key, last_sums = None, None
+        for key, sums in merged:
+            if key == last_key:
+                for i, value in enumerate(sums):
+                    last_sums[i] += value
+            else:
+                if last_key is not None: yield last_key, last_sums
+                last_key, last_sums = key, list(sums)
+
+        if last_key is not None: yield last_key, last_sums
+    finally:
+        for f in files:
+            f.close()
+
+
+if __name__ == "__main__": main()
@@ -0,0 +1,57 @@
+"""
+Compacts a per-page state database produced by the `--incremental` modes of
+json2diffs and diffs2persistence.  The states of pages that have not been
+updated since `--before` are removed and unused space is reclaimed.
+
+$ compact_state states.db --before=2015-01-01T00:00:00Z
+
+Usage:
+    compact_state (-h|--help)
+    compact_state <path> [--kind=<kind>] [--before=<date>] [--verbose]
+
+Options:
+    -h|--help        Print this documentation
+    <path>           The path of the state database
+    --kind=<kind>    Only remove states of this kind (e.g. "diffs" or
+                     "persistence") [default: <all>]
+    --before=<date>  Remove the states of pages that were last updated before
+                     this date.  Expects %Y-%m-%dT%H:%M:%SZ
+                     [default: <never>]
+    --verbose        Print out progress information
+"""
+import os
+import sys
+
+import docopt
+
+from ..state import compact
+
+
+def main(argv=None):
+    args = docopt.docopt(__doc__, argv=argv)
+
+    if args['--kind'] == "<all>":
+        kind = None
+    else:
+        kind = args['--kind']
+
+    if args['--before'] == "<never>":
+        before = None
+    else:
+        from mw import Timestamp
+        before = Timestamp(args['--before']).unix()
+
+    verbose = bool(args['--verbose'])
+
+    run(args['<path>'], kind, before, verbose)
+
+def run(path, kind, before, verbose):
+
+    size = os.path.getsize(path)
+    removed = compact(path, kind=kind, before=before)
+
+    if verbose:
+        sys.stderr.write("Removed {0} states.  {1} bytes --> {2} bytes\n"
+                         .format(removed, size, os.path.getsize(path)))
+
+if __name__ == "__main__": main()
@@ -19,12 +19,61 @@ the window.
                     /                \
                 [tail]              [head]
 
+Long runs can record their progress with `--checkpoint` and pick up where they
+left off with `--resume`.  When resuming, output must be appended to the
+partial output file.
+
+With `--incremental`, each page's token state, window and revert history is
+kept in a local state database so that later runs only process revisions that
+are newer than the stored state.  Stats for revisions that were still in the
+window at the end of a run are generated again (with more information) once
+they leave the window in a later run, so consumers should keep the most
+recent stats for a revision.  Pages without new revisions produce no output.
+Use the same `--window` and `--revert-radius` for every run.
+
+With `--max-memory`, the approximate size of the token state held by the
+window is tracked for the current page and the window shrinks (by generating
+stats for its oldest revisions early) while the state is larger than <mb>.
+The window grows back towards `--window` once the state fits again, but it
+never shrinks below `--revert-radius` revisions.  Each revision gets a
+'window' field with the number of revisions the window could hold when the
+revision left it, so stats with fewer 'processed' revisions than `--window`
+can be told apart from stats censored by the end of a page.  The peak size of
+the token state is reported to <stderr> at the end of the run.
+
+With `--format=compact`, each revision is written once followed by a compact
+row per token instead of once per token (see
+:mod:`mwstreaming.compact_persistence`).  `--token-dictionary` also writes
+each distinct token string of a page once.  persistence2stats reads either
+format.
+
+With `--chunk-size`, pages with more than <revs> + `--window` revisions are
+split into chunks of <revs> revisions that are processed in parallel by
+`--threads` processes.  Each chunk also processes the `--window` revisions
+that follow it, starting from a token state that is planned by applying the
+page's diffs in order without persisting tokens through every revision.  The
+output is stitched back together in order and is the same as without chunks.
+Chunks can't be combined with `--incremental` or `--max-memory`.
+
+`--sample-pages` processes only a fraction of the pages.  Pages are selected
+by a stable hash of their id and `--sample-seed`, and the diffs of other pages
+are skipped before they are decoded, so sampling the output of a sampled
+`dump2diffs` or `json2diffs` run with the same rate and seed keeps all of it
+(see :mod:`mwstreaming.sampling`).
 
 Usage:
     diffs2persistence (-h|--help)
     diffs2persistence --sunset=<date>
                       [--window=<revs>] [--revert-radius=<revs>]
-                      [--keep-diff] [--verbose]
+                      [--max-memory=<mb>] [--keep-diff] [--format=<format>]
+                      [--token-dictionary] [--incremental=<path>]
+                      [--chunk-size=<revs>] [--threads=<num>]
+                      [--sample-pages=<rate>] [--sample-seed=<n>]
+                      [--checkpoint=<path>] [--resume]
+                      [--checkpoint-interval=<secs>]
+                      [--metrics=<path>] [--metrics-interval=<secs>]
+                      [--verbose]
+                      [--index=<path>] [--pages=<ids>] [--revisions=<ids>]
 
 Options:
     -h|--help                Prints this documentation
@@ -37,105 +86,592 @@ Options:
     --revert-radius=<revs>   The number of revisions back that a revert can
                              reference. [default: 15]
                              [default: <now>]
+    --max-memory=<mb>        The approximate number of megabytes of token
+                             state the window may hold [default: <none>]
     --keep-diff              Do not drop 'diff' field data from the json blobs.
-    --verbose                Print out progress information
+    --format=<format>        "tokens" for a JSON blob per token or "compact"
+                             for a revision header and compact token rows
+                             [default: tokens]
+    --token-dictionary       In the "compact" format, reference tokens by
+                             index into a per-page dictionary
+    --incremental=<path>     The path of a per-page state database.  Only
+                             revisions newer than the stored state are
+                             processed.
+    --chunk-size=<revs>      The number of revisions of a long page to
+                             process per chunk [default: <none>]
+    --threads=<num>          The number of processes to process chunks with
+                             [default: <cpu_count>]
+    --sample-pages=<rate>    The fraction of pages to process [default: 1]
+    --sample-seed=<n>        Selects a different sample of pages [default: 0]
+    --checkpoint=<path>      The path of a file to periodically record
+                             progress to at page boundaries
+    --resume                 Continue from the progress recorded in
+                             `--checkpoint`
+    --checkpoint-interval=<secs>  The minimum number of seconds between
+                                  checkpoints [default: 60]
+    --index=<path>           Read the documents of the file indexed at this
+                             path (see `index`) rather than <stdin>
+    --pages=<ids>            A comma separated list of page ids to read from
+                             `--index` [default: <all>]
+    --revisions=<ids>        A comma separated list of revision ids to read
+                             from `--index` [default: <all>]
+    --metrics=<path>         Write periodic throughput metrics to this file
+                             as JSON lines
+    --metrics-interval=<secs>  The number of seconds between metrics reports
+                               [default: 60]
+    --verbose                Print periodic metrics reports to <stderr>
 """
 import json
 import sys
 import time
-from collections import deque
-from itertools import groupby
+from bisect import bisect_left
+from collections import defaultdict, deque
+from contextlib import nullcontext
+from itertools import chain, groupby
+from multiprocessing import cpu_count
 
 import docopt
 from mw import Timestamp
 from mw.lib import reverts
 
+from ..checkpoint import Checkpoint, InputPosition
+from ..compact_persistence import CompactWriter
+from ..metrics import Metrics, from_verbose
+from ..pipeline import Writer
+from ..sampling import PageSampler
+from ..state import StateStore, is_newer
+from .index import open_input
 from .util import read_docs
 
 
 def main(argv=None):
     args = docopt.docopt(__doc__, argv=argv)
 
+    input_file = open_input(args['--index'], args['--pages'],
+                            args['--revisions'])
+
     window_size = int(args['--window'])
 
     revert_radius = int(args['--revert-radius'])
 
+    if args['--max-memory'] == "<none>":
+        window_budget = WindowBudget(window_size)
+    else:
+        window_budget = WindowBudget(window_size,
+                                     min_size=min(revert_radius, window_size),
+                                     max_bytes=float(args['--max-memory']) *
+                                               2**20)
+
     if args['--sunset'] == "<now>":
         sunset = Timestamp(time.time())
     else:
         sunset = Timestamp(args['--sunset'])
 
     keep_diff = bool(args['--keep-diff'])
+
+    if args['--format'] == "compact":
+        token_dictionary = bool(args['--token-dictionary'])
+        writer = CompactWriter(sys.stdout, token_dictionary=token_dictionary)
+    elif args['--format'] == "tokens":
+        writer = None
+    else:
+        raise RuntimeError("Unknown format {0}.  Expected \"tokens\" or "
+                           .format(repr(args['--format'])) + "\"compact\".")
     verbose = bool(args['--verbose'])
 
-    run(read_docs(sys.stdin), window_size, revert_radius, sunset, keep_diff, verbose)
+    if args['--checkpoint'] is not None:
+        checkpoint = Checkpoint.start(
+            args['--checkpoint'],
+            interval=float(args['--checkpoint-interval']),
+            resume=bool(args['--resume']),
+            input=input_file, output=sys.stdout)
+        position = checkpoint.position
+    else:
+        checkpoint = None
+        position = InputPosition()
 
-def run(diff_docs, window_size, revert_radius, sunset, keep_diff, verbose):
+    if args['--incremental'] is not None:
+        state_store = StateStore(args['--incremental'], "persistence")
+    else:
+        state_store = None
+
+    if args['--chunk-size'] == "<none>":
+        chunk_size = None
+    elif state_store is not None or window_budget.max_bytes is not None:
+        raise RuntimeError("--chunk-size can't be combined with " +
+                           "--incremental or --max-memory.")
+    else:
+        chunk_size = int(args['--chunk-size'])
 
-    for doc, token_stats in token_persistence(diff_docs, window_size,
-                                              revert_radius, sunset, verbose):
-        for ts in token_stats:
+    if args['--threads'] == "<cpu_count>":
+        threads = cpu_count()
+    else:
+        threads = int(args['--threads'])
+
+    metrics = Metrics.from_options(args['--metrics'],
+                                   float(args['--metrics-interval']), verbose,
+                                   position=position)
+    if metrics is not None:
+        metrics.gauge('window', window_budget.stats)
+
+    sampler = PageSampler.from_options(args['--sample-pages'],
+                                       args['--sample-seed'])
+
+    run(read_docs(input_file, position=position, sampler=sampler),
+        window_size, revert_radius, sunset, keep_diff, verbose,
+        checkpoint=checkpoint, state_store=state_store, writer=writer,
+        window_budget=window_budget, chunk_size=chunk_size, threads=threads,
+        metrics=metrics)
+
+def run(diff_docs, window_size, revert_radius, sunset, keep_diff,
+        verbose=False, checkpoint=None, state_store=None, writer=None,
+        window_budget=None, chunk_size=None, threads=1, metrics=None):
+
+    metrics = from_verbose(verbose, metrics)
+
+    output = Writer(sys.stdout, metrics)
+    # Checkpoints record the output offset once queued output is written
+    if checkpoint is not None: checkpoint.output = output
+    if writer is not None: writer.f = output
+
+    with output:
+        for doc, token_stats in token_persistence(
+                diff_docs, window_size, revert_radius, sunset,
+                checkpoint=checkpoint, state_store=state_store,
+                window_budget=window_budget, chunk_size=chunk_size,
+                threads=threads, metrics=metrics):
             if not keep_diff: doc.pop("diff", None)
-            ts['revision'] = doc
-            json.dump(ts, sys.stdout)
-            sys.stdout.write("\n")
+            if writer is not None:
+                writer.write(doc, token_stats)
+                continue
+
+            for ts in token_stats:
+                ts['revision'] = doc
+                output.write_doc(ts)
+
+    if window_budget is not None and window_budget.max_bytes is not None:
+        stats = window_budget.stats()
+        sys.stderr.write("Peak token state: {0:.1f}MB.  Window size: {1}-{2} "
+                         .format(stats['peak_bytes'] / 2**20,
+                                 stats['smallest'], window_size) +
+                         "revisions ({0} shrink(s)).\n"
+                         .format(stats['shrinks']))
+
+    if state_store is not None: state_store.close()
+    if checkpoint is not None: checkpoint.write()
+    if metrics is not None: metrics.close()
+
+def token_persistence(diff_docs, window_size, revert_radius, sunset,
+                      verbose=False, checkpoint=None, state_store=None,
+                      window_budget=None, chunk_size=None, threads=1,
+                      metrics=None):
+    """
+    Generates (`revision_doc`, `token_stats`) pairs.  If a `window_budget` is
+    provided, it decides how many revisions the window holds.  If a
+    `chunk_size` is provided, pages with more than `chunk_size` +
+    `window_size` revisions are processed in chunks by `threads` processes
+    (see :func:`chunked_revisions`).  Chunks can't be combined with a
+    `state_store` or a `window_budget` with `max_bytes`.
+    """
+    metrics = from_verbose(verbose, metrics)
+
+    if window_budget is None:
+        window_budget = WindowBudget(window_size)
+    recording = window_budget.max_bytes is not None
+
+    if chunk_size is None:
+        executor = nullcontext()
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        from multiprocessing import get_context
+        executor = ProcessPoolExecutor(threads, get_context("spawn"))
 
-def token_persistence(diff_docs, window_size, revert_radius, sunset, verbose):
     page_diff_docs = groupby(diff_docs, key=lambda d: d['page']['title'])
 
-    for page_title, diff_docs in page_diff_docs:
-
-        if verbose: sys.stderr.write(page_title + ": ")
-
-        revert_detector = reverts.Detector(revert_radius)
-        last_tokens = Tokens()
-        window = deque(maxlen=window_size)
-
-        for doc in diff_docs:
-            if verbose: sys.stderr.write(".")
-
-            # Check for revert
-            revert = revert_detector.process(doc['sha1'], doc)
-            if revert is None:
-                tokens, tokens_added, tokens_removed = \
-                        last_tokens.apply(doc['diff']['ops'])
-
+    with executor:
+        for page_title, diff_docs in page_diff_docs:
+
+            if chunk_size is not None:
+                from more_itertools import peekable
+                diff_docs = peekable(diff_docs)
+                if has_more(diff_docs, chunk_size + window_size):
+                    doc = yield from chunked_revisions(
+                        diff_docs, executor, threads, chunk_size, window_size,
+                        revert_radius, sunset, metrics=metrics)
+                    if checkpoint is not None:
+                        checkpoint.page_done(doc['page'].get('id'))
+                    if metrics is not None: metrics.page()
+                    continue
+
+            if state_store is None:
+                state = None
             else:
-                _, _, revert_to = revert
-                #sys.stderr.write(str(revert_to) + "\n")
-                tokens = revert_to['tokens']
-                tokens_added = Tokens(set(tokens) - set(last_tokens))
-                tokens_removed = Tokens(set(last_tokens) - set(tokens))
-
+                from more_itertools import peekable
+                diff_docs = peekable(diff_docs)
+                page_id = diff_docs.peek()['page']['id']
+                state = state_store.get(page_id)
+
+            if state is None:
+                revert_detector = reverts.Detector(revert_radius)
+                last_tokens = Tokens()
+                window = deque()
+            else:
+                # Pick up where the last run left off
+                last_tokens, window, revert_detector = \
+                        load_state(state, window_size, revert_radius)
+                diff_docs = (d for d in diff_docs if is_newer(d, state))
+            window_budget.start_page(window)
+
+            doc, last_tokens = yield from process_revisions(
+                diff_docs, last_tokens, window, revert_detector,
+                window_budget, metrics=metrics, recording=recording)
+
+            if doc is None:
+                # No new revisions since the stored state
+                continue
+
+            if state_store is not None:
+                state_store.put(page_id, dump_state(doc, last_tokens, window,
+                                                    revert_detector))
+
+            yield from drain_window(window, window_budget, sunset,
+                                    recording=recording)
+
+            if checkpoint is not None:
+                checkpoint.page_done(doc['page'].get('id'))
+            if metrics is not None: metrics.page()
+
+def has_more(docs, n):
+    """
+    Returns True if the peekable `docs` has more than `n` items.
+    """
+    try:
+        docs[n]
+    except IndexError:
+        return False
+    else:
+        return True
+
+def process_revisions(diff_docs, last_tokens, window, revert_detector,
+                      window_budget, metrics=None, recording=False):
+    """
+    Applies the revisions of a page to its token state and generates
+    (`revision_doc`, `token_stats`) pairs for the revisions that leave the
+    `window`.  Returns the last revision processed (or `None`) and its tokens.
+    """
+    doc = None
+    for doc in diff_docs:
+        if metrics is not None: metrics.revision()
+
+        # Check for revert
+        revert = revert_detector.process(doc['sha1'], doc)
+        if revert is None:
+            tokens, tokens_added, tokens_removed = \
+                    last_tokens.apply(doc['diff']['ops'])
 
-            # Makes this available when the revision is reverted back to.
-            doc['tokens'] = tokens
+        else:
+            _, _, revert_to = revert
+            if metrics is not None: metrics.count('reverts')
+            #sys.stderr.write(str(revert_to) + "\n")
+            tokens = revert_to['tokens']
+            tokens_added = tokens.difference(last_tokens)
+            tokens_removed = last_tokens.difference(tokens)
 
-            # Mark the new tokens visible
-            tokens_added.visible_at(doc['timestamp'])
 
-            # Mark the removed tokens as invisible
-            tokens_removed.invisible_at(doc['timestamp'])
+        # Makes this available when the revision is reverted back to.
+        doc['tokens'] = tokens
 
-            tokens.persist(doc['contributor'])
+        # Parsed once rather than once per token
+        timestamp = Timestamp(doc['timestamp'])
 
-            if len(window) == window_size: # Time to start writing some stats
-                old_doc, old_added = window[0]
-                window.append((doc, tokens_added))
-                del old_doc['tokens']
-                yield old_doc, generate_stats(old_doc, old_added, window, None)
-            else:
-                window.append((doc, tokens_added))
+        # Mark the new tokens visible
+        tokens_added.visible_at(timestamp)
 
-            last_tokens = tokens # THIS LINE IS SUPER IMPORTANT.  NOTICE ME!
+        # Mark the removed tokens as invisible
+        tokens_removed.invisible_at(timestamp)
 
+        tokens.persist(doc['contributor'])
 
-        while len(window) > 0:
+        window.append((doc, tokens_added))
+        window_budget.add(doc, tokens_added)
+        while window_budget.full(window): # Time to write some stats
             old_doc, old_added = window.popleft()
+            window_budget.remove(old_doc, old_added)
             del old_doc['tokens']
-            yield old_doc, generate_stats(old_doc, old_added, window, sunset)
+            if recording: old_doc['window'] = len(window)
+            yield old_doc, generate_stats(old_doc, old_added, window, None)
+
+        last_tokens = tokens # THIS LINE IS SUPER IMPORTANT.  NOTICE ME!
+
+    return doc, last_tokens
+
+def drain_window(window, window_budget, sunset, recording=False):
+    """
+    Generates (`revision_doc`, `token_stats`) pairs for all of the revisions
+    left in the `window` at the end of a page.
+    """
+    window_limit = len(window)
+    while len(window) > 0:
+        old_doc, old_added = window.popleft()
+        window_budget.remove(old_doc, old_added)
+        del old_doc['tokens']
+        if recording: old_doc['window'] = window_limit - 1
+        yield old_doc, generate_stats(old_doc, old_added, window, sunset)
+
+def chunked_revisions(diff_docs, executor, threads, chunk_size, window_size,
+                      revert_radius, sunset, metrics=None):
+    """
+    Generates the (`revision_doc`, `token_stats`) pairs of a page by splitting
+    its revisions into chunks of `chunk_size` that are processed in parallel
+    by `executor`.  Each chunk also processes the `window_size` revisions
+    that follow it so that the stats of its last revisions are complete.
+
+    The starting token state of each chunk is planned here, in order, by
+    applying the diffs without persisting tokens through every revision.
+    Instead, the :class:`Presence` of each token is tracked and summarized as
+    a :class:`History`.  Results are stitched back together in order and match
+    :func:`process_revisions` and :func:`drain_window` exactly.  Returns the
+    last revision processed.
+    """
+    revert_detector = reverts.Detector(revert_radius)
+    last_tokens = Tokens()
+    positions = defaultdict(list)
+    chunks = deque() # (state, diff_docs) of chunks that are not submitted
+    pending = deque()
+
+    doc = None
+    for i, doc in enumerate(diff_docs):
+        if i % chunk_size == 0:
+            if i == 0:
+                state = None
+            else:
+                state = dump_chunk_state(last_doc, last_tokens,
+                                         revert_detector, positions, i)
+            chunks.append((state, []))
+        for _, chunk_docs in chunks:
+            chunk_docs.append(dict(doc))
+        if len(chunks[0][1]) == chunk_size + window_size:
+            state, chunk_docs = chunks.popleft()
+            pending.append(executor.submit(persist_chunk, state, chunk_docs,
+                                           window_size, revert_radius, sunset,
+                                           False))
+        # A bounded number of chunks in flight keeps memory bounded.
+        while len(pending) > 0 and \
+              (pending[0].done() or len(pending) >= threads * 2):
+            yield from pending.popleft().result()
+
+        if metrics is not None: metrics.revision()
+        positions[contributor_key(doc['contributor'])].append(i)
+
+        revert = revert_detector.process(doc['sha1'], doc)
+        if revert is None:
+            tokens, tokens_added, tokens_removed = \
+                    last_tokens.apply(doc['diff']['ops'])
+            for token in tokens_added:
+                token.presence = Presence()
+            changes = multiplicity_changes(last_tokens, doc['diff']['ops'],
+                                           tokens_added)
+        else:
+            _, _, revert_to = revert
+            if metrics is not None: metrics.count('reverts')
+            tokens = revert_to['tokens']
+            tokens_added = tokens.difference(last_tokens)
+            tokens_removed = last_tokens.difference(tokens)
+            changes = multiplicity_changes(last_tokens, tokens=tokens)
+
+        doc['tokens'] = tokens
+        timestamp = Timestamp(doc['timestamp'])
+        tokens_added.visible_at(timestamp)
+        tokens_removed.invisible_at(timestamp)
+        for token, delta in changes:
+            token.presence.change(i, delta)
+
+        last_doc, last_tokens = doc, tokens
+
+    if len(chunks) > 0:
+        # The first chunk that is not submitted takes the rest of the page.
+        state, chunk_docs = chunks.popleft()
+        pending.append(executor.submit(persist_chunk, state, chunk_docs,
+                                       window_size, revert_radius, sunset,
+                                       True))
+    while len(pending) > 0:
+        yield from pending.popleft().result()
+
+    return doc
+
+def persist_chunk(state, diff_docs, window_size, revert_radius, sunset, last):
+    """
+    Processes a chunk of a page's revisions starting from a `state` produced
+    by :func:`dump_chunk_state` (or from scratch).  Returns a list of
+    (`revision_doc`, `token_stats`) pairs for all but the last `window_size`
+    revisions, or for all revisions if this is the `last` chunk of the page.
+    """
+    if state is None:
+        revert_detector = reverts.Detector(revert_radius)
+        last_tokens = Tokens()
+        window = deque()
+    else:
+        last_tokens, window, revert_detector = \
+                load_state(state, window_size, revert_radius)
+    window_budget = WindowBudget(window_size)
+    window_budget.start_page(window)
+
+    pairs = process_revisions(diff_docs, last_tokens, window, revert_detector,
+                              window_budget)
+    if last:
+        pairs = chain(pairs, drain_window(window, window_budget, sunset))
+
+    # Stats are generated lazily, so they must be consumed in order.
+    return [(doc, list(token_stats)) for doc, token_stats in pairs]
+
+def multiplicity_changes(last_tokens, operations=None, tokens_added=(),
+                         tokens=None):
+    """
+    Returns (`token`, `delta`) pairs for the tokens whose multiplicity changes
+    from `last_tokens` to the result of applying diff `operations` (that add
+    `tokens_added`) or to `tokens`.  With `operations`, only the tokens in
+    ranges that are not kept exactly once are visited.
+    """
+    changes = {}
+    def change(changed_tokens, delta):
+        for token in changed_tokens:
+            if id(token) in changes:
+                changes[id(token)][1] += delta
+            else:
+                changes[id(token)] = [token, delta]
 
-        if verbose: sys.stderr.write("\n")
+    if tokens is not None:
+        change(last_tokens, -1)
+        change(tokens, 1)
+    else:
+        # The number of 'equal' operations that keep each range of tokens
+        coverage_changes = defaultdict(int)
+        for op in operations:
+            if op['name'] == "equal":
+                coverage_changes[op['a1']] += 1
+                coverage_changes[op['a2']] -= 1
+        boundaries = sorted(set(coverage_changes) | {0, len(last_tokens)})
+
+        coverage = 0
+        for start, end in zip(boundaries, boundaries[1:]):
+            coverage += coverage_changes[start]
+            if coverage != 1:
+                change(last_tokens[start:end], coverage - 1)
+        change(tokens_added, 1)
+
+    return [(token, delta) for token, delta in changes.values() if delta != 0]
+
+
+def dump_state(last_doc, last_tokens, window, revert_detector,
+               token_index=None):
+    """
+    Serializes the token state of a page into a JSON-able document.  Tokens
+    and revision documents that are referenced from several places (e.g. the
+    window and the revert detector) are stored once and referenced by index.
+    If a `token_index` dict is provided, it is filled with the index of each
+    token by `id()`.
+    """
+    tokens = []
+    token_index = token_index if token_index is not None else {}
+    contributors, contributor_index = [], {}
+    docs, doc_index = [], {}
+
+    def index_contributor(contributor):
+        key = contributor_key(contributor)
+        if key not in contributor_index:
+            contributor_index[key] = len(contributors)
+            contributors.append(contributor)
+        return contributor_index[key]
+
+    def index_token(token):
+        if id(token) not in token_index:
+            token_index[id(token)] = len(tokens)
+            visible_since = token.visible_since.long_format() \
+                            if token.visible_since is not None else None
+            tokens.append([str(token),
+                           [index_contributor(c) for c in token.revisions],
+                           token.visible, visible_since])
+        return token_index[id(token)]
+
+    def index_doc(doc):
+        if id(doc) not in doc_index:
+            doc_index[id(doc)] = len(docs)
+            if 'tokens' in doc:
+                doc_tokens = [index_token(t) for t in doc['tokens']]
+            else:
+                doc_tokens = None
+            stored_doc = {k: v for k, v in doc.items() if k != 'tokens'}
+            docs.append({'doc': stored_doc, 'tokens': doc_tokens})
+        return doc_index[id(doc)]
+
+    return {
+        'id': last_doc['id'],
+        'timestamp': last_doc['timestamp'],
+        'last_tokens': [index_token(t) for t in last_tokens],
+        'window': [[index_doc(doc), [index_token(t) for t in added]]
+                   for doc, added in window],
+        'reverts': [[checksum, index_doc(doc)]
+                    for checksum, doc in revert_detector],
+        'docs': docs,
+        'tokens': tokens,
+        'contributors': contributors
+    }
+
+def load_state(state, window_size, revert_radius):
+    """
+    Reconstructs the `last_tokens`, `window` and `revert_detector` of a page
+    from a document produced by :func:`dump_state` (or
+    :func:`dump_chunk_state`).
+    """
+    contributors = state['contributors']
+    tokens = [Token(string, [contributors[i] for i in revisions], visible,
+                    Timestamp(visible_since)
+                    if visible_since is not None else None)
+              for string, revisions, visible, visible_since in state['tokens']]
+
+    for i, spans in state.get('histories', []):
+        tokens[i].revisions = History(spans, state['positions'])
+
+    docs = []
+    for entry in state['docs']:
+        doc = entry['doc']
+        if entry['tokens'] is not None:
+            doc['tokens'] = Tokens(tokens[i] for i in entry['tokens'])
+        docs.append(doc)
+
+    last_tokens = Tokens(tokens[i] for i in state['last_tokens'])
+
+    window = deque((docs[i], Tokens(tokens[j] for j in added))
+                   for i, added in state['window'])
+
+    revert_detector = reverts.Detector(revert_radius)
+    for checksum, i in state['reverts']:
+        revert_detector.insert(checksum, docs[i])
+
+    return last_tokens, window, revert_detector
+
+def dump_chunk_state(last_doc, last_tokens, revert_detector, positions,
+                     start):
+    """
+    Serializes the token state of a page at the `start` of a chunk, as
+    planned by :func:`chunked_revisions`.  The 'histories' of the state
+    summarize the revisions that each token persisted through before `start`
+    (see :class:`History`).
+    """
+    token_index = {}
+    state = dump_state(last_doc, last_tokens, (), revert_detector,
+                       token_index=token_index)
+    tokens = {id(t): t for t in last_tokens}
+    for _, doc in revert_detector:
+        tokens.update((id(t), t) for t in doc['tokens'])
+
+    state['histories'] = [[token_index[i], token.presence.spans_at(start)]
+                          for i, token in tokens.items()]
+    state['positions'] = positions
+    return state
+
+def contributor_key(contributor):
+    return json.dumps(contributor, sort_keys=True)
 
 
 def generate_stats(doc, tokens_added, window, sunset):
@@ -147,14 +683,16 @@ def generate_stats(doc, tokens_added, window, sunset):
     seconds_possible = max(Timestamp(sunset) -
                            Timestamp(doc['timestamp']), 0)
 
+    contributor = doc['contributor']
+    non_self_processed = sum(contributor != d['contributor']
+                             for d, ts in window)
+
     for token in tokens_added:
-        non_self_persisted = sum(doc['contributor'] != c
-                                 for c in token.revisions)
-        non_self_processed = sum(doc['contributor'] != d['contributor']
-                                 for d, ts in window)
+        persisted = len(token.revisions)
+        non_self_persisted = persisted - token.revisions.count(contributor)
         yield {
             "token": str(token),
-            "persisted": len(token.revisions[1:]),
+            "persisted": max(persisted - 1, 0),
             "processed": revisions_processed,
             "non_self_persisted": non_self_persisted,
             "non_self_processed": non_self_processed,
@@ -163,6 +701,85 @@ def generate_stats(doc, tokens_added, window, sunset):
         }
 
 
+class WindowBudget:
+    """
+    Tracks the approximate size of the token state held by the window of a
+    page and decides when the window is full.  The window holds at most
+    `max_size` revisions.  If `max_bytes` is set, it also stops growing beyond
+    `min_size` (at least 1) revisions while the token state is larger than `max_bytes`.
+
+    :Parameters:
+        max_size : int
+            The maximum number of revisions in the window
+        min_size : int
+            The minimum number of revisions in the window
+        max_bytes : float
+            The approximate number of bytes of token state to hold
+    """
+    TOKEN_BYTES = 512
+    """
+    The approximate size of a new :class:`Token`
+    """
+    REFERENCE_BYTES = 16
+    """
+    The approximate size of a token's reference from a revision (in its
+    `tokens` and the token's `revisions`)
+    """
+
+    def __init__(self, max_size, min_size=None, max_bytes=None):
+        self.max_size = max_size
+        # The window always holds the revision that just entered it
+        self.min_size = max(min_size if min_size is not None else max_size, 1)
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.peak_bytes = 0
+        self.size = 0
+        self.smallest = max_size
+        self.shrinks = 0
+
+    def start_page(self, window):
+        self.bytes = 0
+        for doc, tokens_added in window:
+            self.bytes += self.cost(doc, tokens_added)
+        self.size = len(window)
+
+    def cost(self, doc, tokens_added):
+        return len(doc['tokens']) * self.REFERENCE_BYTES + \
+               len(tokens_added) * self.TOKEN_BYTES
+
+    def add(self, doc, tokens_added):
+        self.bytes += self.cost(doc, tokens_added)
+        self.peak_bytes = max(self.peak_bytes, self.bytes)
+        self.size += 1
+
+    def remove(self, doc, tokens_added):
+        self.bytes -= self.cost(doc, tokens_added)
+        self.size -= 1
+
+    def full(self, window):
+        """
+        Returns True if the oldest revision of `window` should leave it.
+        """
+        if len(window) > self.max_size:
+            return True
+        elif self.max_bytes is not None and self.bytes > self.max_bytes and \
+             len(window) > self.min_size:
+            self.shrinks += 1
+            self.smallest = min(self.smallest, len(window) - 1)
+            return True
+        else:
+            return False
+
+    def stats(self):
+        return {
+            'size': self.size,
+            'bytes': self.bytes,
+            'peak_bytes': self.peak_bytes,
+            'smallest': self.smallest,
+            'shrinks': self.shrinks
+        }
+
+
 class Tokens(list):
 
     def persist(self, revision):
@@ -180,6 +797,15 @@ class Tokens(list):
             token.invisible_at(timestamp)
 
 
+    def difference(self, other):
+        """
+        Returns the tokens that are not in `other` in order (and once).
+        """
+        other = set(other)
+        return Tokens(token for token in dict.fromkeys(self)
+                      if token not in other)
+
+
     def apply(self, operations):
         tokens = Tokens()
         tokens_added = Tokens()
@@ -216,6 +842,65 @@ class Tokens(list):
         return (tokens, tokens_added, tokens_removed)
 
 
+class History(list):
+    """
+    The contributors of the revisions that a token persisted through.  The
+    revisions before the start of a chunk of a page are not stored but counted
+    from `spans` of [`start`, `end`, `multiplicity`] revision positions and the
+    `positions` of each contributor's revisions in the page (by
+    :func:`contributor_key`).
+    """
+    def __init__(self, spans, positions, revisions=()):
+        super().__init__(revisions)
+        self.spans = spans
+        self.positions = positions
+        self.total = sum((end - start) * multiplicity
+                         for start, end, multiplicity in spans)
+        self.counts = {}
+
+    def __len__(self):
+        return self.total + super().__len__()
+
+    def count(self, contributor):
+        key = contributor_key(contributor)
+        if key not in self.counts:
+            positions = self.positions.get(key, [])
+            self.counts[key] = sum(
+                multiplicity * (bisect_left(positions, end) -
+                                bisect_left(positions, start))
+                for start, end, multiplicity in self.spans)
+        return self.counts[key] + super().count(contributor)
+
+
+class Presence:
+    """
+    Tracks the `multiplicity` of a token (the number of times it appears in
+    the tokens of a revision) as the revisions of a page are planned.  Changes
+    close [`start`, `end`, `multiplicity`] `spans` of revision positions.
+    """
+    __slots__ = ('spans', 'multiplicity', 'since')
+
+    def __init__(self):
+        self.spans = []
+        self.multiplicity = 0
+        self.since = 0
+
+    def change(self, position, delta):
+        if self.multiplicity > 0 and position > self.since:
+            self.spans.append([self.since, position, self.multiplicity])
+        self.multiplicity += delta
+        self.since = position
+
+    def spans_at(self, position):
+        """
+        Returns a copy of the spans of the revisions before `position`.
+        """
+        if self.multiplicity > 0 and position > self.since:
+            return self.spans + [[self.since, position, self.multiplicity]]
+        else:
+            return list(self.spans)
+
+
 class Token(str):
 
     def __new__(cls, string, revisions=None, visible=0, visible_since=None):
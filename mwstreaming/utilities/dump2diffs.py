@@ -13,9 +13,39 @@ multi-threaded.  You can customize the number of parallel `--threads`.
 
 $ dump2diffs pages-meta-history*.xml.bz2 --config=conf.yaml > diffs.json
 
+The <dump_file>s can also be read from a plan written by `plan`, which orders
+them largest-first so that the longest files don't start last.  `--shard`
+processes only the files that the plan assigned to one worker.
+
+$ plan pages-meta-history*.xml.bz2 --workers=8 > plan.json
+$ dump2diffs --plan=plan.json --config=conf.yaml > diffs.json
+
+When reading from <stdin>, progress can be recorded with `--checkpoint` and
+picked up again with `--resume`.  Pages that were already completed are
+skipped and output must be appended to the partial output file.
+
+$ bzcat dump.xml.bz2 | dump2diffs --config=conf.yaml --checkpoint=diffs.ckpt \
+                                  --resume >> diffs.json
+
+`--sample-pages` processes only a fraction of the pages (e.g. for exploratory
+runs).  Pages are selected by a stable hash of their id and `--sample-seed`
+and skipped before their revisions are read or diffed, so other utilities
+that sample with the same rate and seed select the same pages (see
+:mod:`mwstreaming.sampling`).
+
 Usage:
     dump2diffs (-h|--help)
     dump2diffs [<dump_file>...] --config=<path> [--drop-text] [--threads=<num>]
+                                               [--max-bytes=<num>]
+                                               [--plan=<path>] [--shard=<num>]
+                                               [--dedupe-text]
+                                               [--text-store=<path>]
+                                               [--sample-pages=<rate>]
+                                               [--sample-seed=<n>]
+                                               [--checkpoint=<path>] [--resume]
+                                               [--checkpoint-interval=<secs>]
+                                               [--metrics=<path>]
+                                               [--metrics-interval=<secs>]
                                                [--verbose]
 
 Options:
@@ -24,20 +54,45 @@ Options:
     --drop-text        Drops the 'text' field from the JSON blob
     --threads=<num>    If a collection of files are provided, how many processor
                        threads should be prepare? [default: <cpu_count>]
-    --verbose          Print progress information to stderr.  Kind of a mess
-                       when running multi-threaded.
+    --max-bytes=<num>  The maximum number of bytes (UTF-8) of a revision's
+                       text.  Longer texts are cut down as they are read and
+                       marked 'truncated'. [default: <none>]
+    --plan=<path>      Read the <dump_file>s from a plan written by `plan`
+    --shard=<num>      Only process the files of this shard of `--plan`
+                       [default: <none>]
+    --dedupe-text      Replace texts that repeat one of the recent texts of
+                       their page with a 'text_ref' to the revision that had
+                       it
+    --text-store=<path>  Move texts to a text store (an SQLite database) at
+                         this path and replace them with a 'text_sha1'
+    --sample-pages=<rate>  The fraction of pages to process [default: 1]
+    --sample-seed=<n>  Selects a different sample of pages [default: 0]
+    --checkpoint=<path>  The path of a file to periodically record progress
+                         to at page boundaries.  Only available when reading
+                         from <stdin>.
+    --resume             Continue from the progress recorded in `--checkpoint`
+    --checkpoint-interval=<secs>  The minimum number of seconds between
+                                  checkpoints [default: 60]
+    --metrics=<path>   Write periodic throughput and latency metrics to this
+                       file as JSON lines
+    --metrics-interval=<secs>  The number of seconds between metrics reports
+                               [default: 60]
+    --verbose          Print periodic metrics reports to <stderr>
 """
-import json
 import sys
+import time
 from multiprocessing import cpu_count
 
 import docopt
-from deltas import DiffEngine
-from mw import xml_dump
 
-import yamlconf
-
-from .util import op2doc, revision2doc
+from ..checkpoint import Checkpoint
+from ..metrics import Metrics, from_verbose
+from ..pipeline import Writer, open_read_ahead
+from ..sampling import PageSampler
+from ..text_store import TextDeduplicator
+from .dump2json import count_docs
+from .plan import load_plan
+from .util import load_diff_engine, op2doc, revision2doc
 
 
 def main(argv=None):
@@ -48,8 +103,22 @@ def main(argv=None):
     else:
         dump_files = args['<dump_file>']
 
-    config_doc = yamlconf.load(open(args['--config']))
-    diff_engine = DiffEngine.from_config(config_doc, config_doc['diff_engine'])
+    if args['--plan'] is not None:
+        if len(dump_files) > 0:
+            raise RuntimeError("<dump_file>s can't be specified with --plan")
+        if args['--shard'] == "<none>":
+            shard = None
+        else:
+            shard = int(args['--shard'])
+        dump_files = load_plan(args['--plan'], shard)
+        if len(dump_files) == 0:
+            # Don't fall back on reading <stdin>
+            sys.stderr.write("No files to process in --plan.\n")
+            return
+    elif args['--shard'] != "<none>":
+        raise RuntimeError("--shard requires --plan")
+
+    diff_engine = load_diff_engine(args['--config'])
 
     drop_text = bool(args['--drop-text'])
 
@@ -58,48 +127,114 @@ def main(argv=None):
     else:
         threads = int(args['--threads'])
 
+    if args['--max-bytes'] == "<none>":
+        max_bytes = None
+    else:
+        max_bytes = int(args['--max-bytes'])
+
     verbose = bool(args['--verbose'])
 
-    run(dump_files, diff_engine, threads, drop_text, verbose)
+    if args['--checkpoint'] is not None:
+        if len(dump_files) > 0:
+            raise RuntimeError("--checkpoint is only supported when reading " +
+                               "a dump from <stdin>.")
+        checkpoint = Checkpoint.start(
+            args['--checkpoint'],
+            interval=float(args['--checkpoint-interval']),
+            resume=bool(args['--resume']),
+            output=sys.stdout)
+    else:
+        checkpoint = None
 
-def run(dump_files, diff_engine, threads, drop_text, verbose):
+    metrics = Metrics.from_options(args['--metrics'],
+                                   float(args['--metrics-interval']), verbose)
+
+    if drop_text and (args['--dedupe-text'] or args['--text-store']):
+        raise RuntimeError("--dedupe-text and --text-store have no texts " +
+                           "to remove with --drop-text.")
+    deduplicator = TextDeduplicator.from_options(
+        bool(args['--dedupe-text']), args['--text-store'])
+
+    sampler = PageSampler.from_options(args['--sample-pages'],
+                                       args['--sample-seed'])
+
+    run(dump_files, diff_engine, threads, drop_text, verbose,
+        checkpoint=checkpoint, max_bytes=max_bytes, deduplicator=deduplicator,
+        sampler=sampler, metrics=metrics)
+
+def run(dump_files, diff_engine, threads, drop_text, verbose=False,
+        checkpoint=None, max_bytes=None, deduplicator=None, sampler=None,
+        metrics=None):
+    from mw import xml_dump
+
+    metrics = from_verbose(verbose, metrics)
 
     if len(dump_files) == 0:
-        revision_docs = dump2diffs(xml_dump.Iterator.from_file(sys.stdin),
-                                   diff_engine, verbose=verbose)
+        dump = xml_dump.Iterator.from_file(open_read_ahead(sys.stdin))
+        revision_docs = dump2diffs(dump, diff_engine, checkpoint=checkpoint,
+                                   max_bytes=max_bytes, sampler=sampler,
+                                   metrics=metrics)
 
     else:
+        # Workers run in other processes, so they can't record metrics.
         dump_processor = lambda d, p: dump2diffs(d, diff_engine,
-                                                 verbose=verbose)
-        revision_docs = xml_dump.map(dump_files, dump_processor,
-                                     threads=threads)
+                                                 max_bytes=max_bytes,
+                                                 sampler=sampler)
+        revision_docs = count_docs(
+            xml_dump.map(dump_files, dump_processor, threads=threads),
+            metrics)
+
+    output = Writer(sys.stdout, metrics)
+    # Checkpoints record the output offset once queued output is written
+    if checkpoint is not None: checkpoint.output = output
 
+    with output:
+        for revision_doc in revision_docs:
+            if drop_text:
+                del revision_doc['text']
+            elif deduplicator is not None:
+                deduplicator.dedupe(revision_doc)
 
-    for revision_doc in revision_docs:
-        if drop_text:
-            del revision_doc['text']
+            output.write_doc(revision_doc)
 
-        json.dump(revision_doc, sys.stdout)
-        sys.stdout.write("\n")
+    if deduplicator is not None: deduplicator.close()
+    if checkpoint is not None: checkpoint.write()
+    if metrics is not None: metrics.close()
 
-def dump2diffs(dump, diff_engine, verbose=False):
+def dump2diffs(dump, diff_engine, verbose=False, checkpoint=None,
+               max_bytes=None, sampler=None, metrics=None):
+
+    metrics = from_verbose(verbose, metrics)
+    skip_pages = checkpoint.resumed_pages if checkpoint is not None else 0
 
     for page in dump:
+        if skip_pages > 0:
+            # Completed before the last checkpoint
+            skip_pages -= 1
+            continue
+
+        if sampler is not None and not sampler.sampled(page.id):
+            # Counted as done so that resuming skips the same number of pages
+            if checkpoint is not None: checkpoint.page_done(page.id)
+            continue
 
-        if verbose: sys.stderr.write(page.title + ": ")
+        if metrics is not None: metrics.page()
 
         processor = diff_engine.processor()
         for revision in page:
-            revision_doc = revision2doc(revision, page)
-            if verbose: sys.stderr.write("."); sys.stderr.flush()
+            revision_doc = revision2doc(revision, page, max_bytes)
+            if metrics is not None: metrics.revision()
 
             # Diff processing uses a lot of CPU.
+            start = time.perf_counter()
             operations, a, b = processor.process(revision_doc['text'] or "")
+            if metrics is not None:
+                metrics.diff_time(time.perf_counter() - start, revision_doc)
 
             revision_doc['diff'] = [op2doc(op, a, b) for op in operations]
 
             yield revision_doc
 
-        if verbose: sys.stderr.write("\n")
+        if checkpoint is not None: checkpoint.page_done(page.id)
 
 if __name__ == "__main__": main()
@@ -13,24 +13,67 @@ multi-threaded.  You can customize the number of parallel `--threads`.
 
 $ dump2json pages-meta-history*.xml.bz2 | bzip2 -c > revisions.json.bz2
 
+The <dump_file>s can also be read from a plan written by `plan`, which orders
+them largest-first so that the longest files don't start last.  `--shard`
+processes only the files that the plan assigned to one worker.
+
+$ plan pages-meta-history*.xml.bz2 --workers=8 > plan.json
+$ dump2json --plan=plan.json | bzip2 -c > revisions.json.bz2
+
+Full histories repeat the same texts many times (e.g. in reverts).
+`--dedupe-text` and `--text-store` remove repeated texts from the output (see
+:mod:`mwstreaming.text_store`).  Utilities that need the texts (json2diffs
+and mend_diffs) restore them as they are read.  Others pass the references
+through.
+
+`--sample-pages` processes only a fraction of the pages (e.g. for exploratory
+runs).  Pages are selected by a stable hash of their id and `--sample-seed`
+and skipped before their revisions are read, so other utilities that sample
+with the same rate and seed select the same pages (see
+:mod:`mwstreaming.sampling`).
+
 Usage:
     dump2json (-h|--help)
-    dump2json [--threads=<num>] [--verbose] [<dump_file>...]
+    dump2json [--threads=<num>] [--max-bytes=<num>] [--metrics=<path>]
+              [--metrics-interval=<secs>] [--verbose]
+              [--plan=<path>] [--shard=<num>] [--dedupe-text]
+              [--text-store=<path>] [--sample-pages=<rate>]
+              [--sample-seed=<n>] [<dump_file>...]
 
 Options:
     -h|--help          Print this documentation
     --threads=<num>    If a collection of files are provided, how many processor
                        threads should be prepare? [default: <cpu_count>]
-    --verbose          Print progress information to stderr.  Kind of a mess
-                       when running multi-threaded.
+    --max-bytes=<num>  The maximum number of bytes (UTF-8) of a revision's
+                       text.  Longer texts are cut down as they are read and
+                       marked 'truncated'. [default: <none>]
+    --plan=<path>      Read the <dump_file>s from a plan written by `plan`
+    --shard=<num>      Only process the files of this shard of `--plan`
+                       [default: <none>]
+    --dedupe-text      Replace texts that repeat one of the recent texts of
+                       their page with a 'text_ref' to the revision that had
+                       it
+    --text-store=<path>  Move texts to a text store (an SQLite database) at
+                         this path and replace them with a 'text_sha1'
+    --sample-pages=<rate>  The fraction of pages to process [default: 1]
+    --sample-seed=<n>  Selects a different sample of pages [default: 0]
+    --metrics=<path>   Write periodic throughput metrics to this file as JSON
+                       lines
+    --metrics-interval=<secs>  The number of seconds between metrics reports
+                               [default: 60]
+    --verbose          Print periodic metrics reports to <stderr>
 """
-import json
 import sys
 from multiprocessing import cpu_count
 
 import docopt
-from mw import xml_dump
 
+from ..metrics import Metrics, from_verbose
+from ..pipeline import Writer, open_read_ahead
+from ..records import Interner
+from ..sampling import PageSampler
+from ..text_store import TextDeduplicator
+from .plan import load_plan
 from .util import revision2doc
 
 
@@ -42,43 +85,111 @@ def main(argv=None):
     else:
         dump_files = args['<dump_file>']
     
+    if args['--plan'] is not None:
+        if len(dump_files) > 0:
+            raise RuntimeError("<dump_file>s can't be specified with --plan")
+        if args['--shard'] == "<none>":
+            shard = None
+        else:
+            shard = int(args['--shard'])
+        dump_files = load_plan(args['--plan'], shard)
+        if len(dump_files) == 0:
+            # Don't fall back on reading <stdin>
+            sys.stderr.write("No files to process in --plan.\n")
+            return
+    elif args['--shard'] != "<none>":
+        raise RuntimeError("--shard requires --plan")
+    
     if args['--threads'] == "<cpu_count>":
         threads = cpu_count()
     else:
         threads = int(args['--threads'])
     
+    if args['--max-bytes'] == "<none>":
+        max_bytes = None
+    else:
+        max_bytes = int(args['--max-bytes'])
+    
     verbose = bool(args['--verbose'])
     
-    run(dump_files, threads, verbose)
+    metrics = Metrics.from_options(args['--metrics'],
+                                   float(args['--metrics-interval']), verbose)
+    
+    deduplicator = TextDeduplicator.from_options(
+        bool(args['--dedupe-text']), args['--text-store'])
+    
+    sampler = PageSampler.from_options(args['--sample-pages'],
+                                       args['--sample-seed'])
+    
+    run(dump_files, threads, verbose, max_bytes=max_bytes,
+        deduplicator=deduplicator, sampler=sampler, metrics=metrics)
 
-def run(dump_files, threads, verbose):
+def run(dump_files, threads, verbose=False, max_bytes=None,
+        deduplicator=None, sampler=None, metrics=None):
+    from mw import xml_dump
+    
+    metrics = from_verbose(verbose, metrics)
     
     if len(dump_files) == 0:
-        revision_docs = dump2json(xml_dump.Iterator.from_file(sys.stdin),
-                                  verbose=verbose)
+        dump = xml_dump.Iterator.from_file(open_read_ahead(sys.stdin))
+        revision_docs = dump2json(dump, max_bytes=max_bytes, sampler=sampler,
+                                  metrics=metrics)
         
     else:
-        revision_docs = xml_dump.map(dump_files,
-                                     lambda d, p: dump2json(d, verbose=verbose),
-                                     threads=threads)
+        # Workers run in other processes, so they can't record metrics.
+        dump_processor = lambda d, p: dump2json(d, max_bytes=max_bytes,
+                                                sampler=sampler)
+        revision_docs = count_docs(
+            xml_dump.map(dump_files, dump_processor, threads=threads),
+            metrics)
     
-        
-    for revision_doc in revision_docs:
-        json.dump(revision_doc, sys.stdout)
-        sys.stdout.write("\n")
+    with Writer(sys.stdout, metrics) as output:
+        for revision_doc in revision_docs:
+            if deduplicator is not None: deduplicator.dedupe(revision_doc)
+            output.write_doc(revision_doc)
+    
+    if metrics is not None: metrics.close()
+    if deduplicator is not None: deduplicator.close()
 
-def dump2json(dump, verbose=False):
+def dump2json(dump, verbose=False, max_bytes=None, records=False,
+              sampler=None, metrics=None):
+    """
+    Generates RevisionDocuments from `dump`.  If `records` is True,
+    :class:`~mwstreaming.records.RevisionRecord`s are generated rather than
+    dicts.  If a :class:`~mwstreaming.sampling.PageSampler` is provided, the
+    revisions of pages that aren't sampled are skipped.
+    """
+    metrics = from_verbose(verbose, metrics)
+    interner = Interner() if records else None
     
     for page in dump:
+        if sampler is not None and not sampler.sampled(page.id):
+            continue
         
-        if verbose: sys.stderr.write(page.title + ": ")
+        if metrics is not None: metrics.page()
         
         for revision in page:
             
-            if verbose: sys.stderr.write(".")
+            if metrics is not None: metrics.revision()
             
-            yield revision2doc(revision, page)
+            yield revision2doc(revision, page, max_bytes, interner)
+
+def count_docs(revision_docs, metrics):
+    """
+    Records the pages and revisions of `revision_docs` in `metrics` as they
+    are generated.
+    """
+    if metrics is None:
+        yield from revision_docs
+        return
+    
+    last_page_id = None
+    for revision_doc in revision_docs:
+        if revision_doc['page']['id'] != last_page_id:
+            metrics.page()
+            last_page_id = revision_doc['page']['id']
+        metrics.revision()
         
-        if verbose: sys.stderr.write("\n")
+        yield revision_doc
 
 if __name__ == "__main__": main()
@@ -4,55 +4,77 @@ with diff.ops == null.  This script uses the API to gather text.
 
 Usage:
     add_missing_diffs -h | --help
-    add_missing_diffs --api=<url> --config=<config> [--verbose]
+    add_missing_diffs --api=<url> --config=<config> [--metrics=<path>]
+                      [--metrics-interval=<secs>] [--verbose]
+                      [--index=<path>] [--pages=<ids>] [--revisions=<ids>]
 
 Options:
     -h --help        Prints this documentation
     --api=<url>      URL of a MediaWiki API to request data from
     --config=<path>  The path to difference detection configuration
-    --verbose        Print progress information to stderr
+    --index=<path>   Read the documents of the file indexed at this path (see
+                     `index`) rather than <stdin>
+    --pages=<ids>    A comma separated list of page ids to read from `--index`
+                     [default: <all>]
+    --revisions=<ids>  A comma separated list of revision ids to read from
+                       `--index` [default: <all>]
+    --metrics=<path>  Write periodic throughput and latency metrics to this
+                      file as JSON lines
+    --metrics-interval=<secs>  The number of seconds between metrics reports
+                               [default: 60]
+    --verbose        Print periodic metrics reports to <stderr>
 """
-import json
 import sys
+import time
 
 import docopt
-from deltas import DiffEngine
-from mw import api
 
-import yamlconf
-
-from .util import op2doc, read_docs
+from ..checkpoint import InputPosition
+from ..metrics import Metrics
+from ..pipeline import Writer
+from .index import open_input
+from .util import load_diff_engine, op2doc, read_docs
 
 
 def main(argv=None):
     args = docopt.docopt(__doc__, argv=argv)
 
-    diff_docs = read_docs(sys.stdin)
+    input_file = open_input(args['--index'], args['--pages'],
+                            args['--revisions'])
+
+    position = InputPosition()
+    diff_docs = read_docs(input_file, position=position)
 
+    from mw import api
     session = api.Session(args['--api'])
 
-    config_doc = yamlconf.load(open(args['--config']))
-    diff_engine = DiffEngine.from_config(config_doc, config_doc["diff_engine"])
+    diff_engine = load_diff_engine(args['--config'])
+
+    metrics = Metrics.from_options(args['--metrics'],
+                                   float(args['--metrics-interval']),
+                                   bool(args['--verbose']), position=position)
+
+    run(diff_docs, session, diff_engine, metrics)
 
-    run(diff_docs, session, diff_engine)
+def run(diff_docs, session, diff_engine, metrics=None):
 
-def run(diff_docs, session, diff_engine):
+    with Writer(sys.stdout, metrics) as output:
+        for diff_doc in diff_docs:
+            if 'diff' not in diff_doc:
+                raise Exception("Documents must have a 'diff' field.")
 
-    for diff_doc in diff_docs:
-        if 'diff' not in diff_doc:
-            raise Exception("Documents must have a 'diff' field.")
+            if diff_doc['diff']['ops'] is None:
+                start = time.perf_counter()
+                diff = generate_diff(diff_doc, session, diff_engine)
+                diff_doc['diff'] = diff
+                if metrics is not None:
+                    metrics.diff_time(time.perf_counter() - start, diff_doc)
+                    metrics.count('fetched')
 
-        if diff_doc['diff']['ops'] is None:
-            sys.stderr.write("\nProcessing {0}: ... ".format(diff_doc['id']))
-            sys.stderr.flush()
-            diff = generate_diff(diff_doc, session, diff_engine)
-            diff_doc['diff'] = diff
-            sys.stderr.write("DONE!\n");sys.stderr.flush()
-        else:
-            sys.stderr.write(".");sys.stderr.flush()
+            output.write_doc(diff_doc)
+            if metrics is not None: metrics.revision()
 
-        json.dump(diff_doc, sys.stdout)
-        sys.stdout.write("\n")
+    if metrics is not None: metrics.close()
 
 def generate_diff(diff_doc, session, diff_engine):
     last_id = diff_doc['diff']['last_id']
@@ -0,0 +1,351 @@
+"""
+Builds an offset index of a file of JSON lines (RevisionDocuments, diffs or
+token persistence stats) so that the documents of a few pages or revisions
+can be read without streaming through the whole file.
+
+The index records where each page and each revision starts and how many
+lines it spans.  Plain files are indexed by byte offset.  Compressed files
+(bz2, gz, xz or zst) are indexed by the offset of the compressed stream
+(or frame) that a line starts in and the decompressed offset within it, so
+reading only decompresses from the start of that stream.  Files that are
+compressed as one stream (e.g. by `bzip2` or `zstd`) can only be read from
+their start, so use a parallel compressor that writes many streams (e.g.
+`pbzip2` or `pzstd`) for files that will be read by index.
+
+Writes the index as JSON lines to <stdout>.  Utilities that read JSON lines
+can then read from the indexed file with `--index` and only read the
+documents of `--pages` or `--revisions`.
+
+$ index revisions.json.bz2 > revisions.index
+$ json2diffs --config=conf.yaml --index=revisions.index --pages=12,15
+
+Usage:
+    index (-h|--help)
+    index <input_file>
+
+Options:
+    -h|--help     Print this documentation
+    <input_file>  The path of a JSON lines file to index
+"""
+import bz2
+import io
+import json
+import lzma
+import os
+import sys
+import zlib
+
+import docopt
+
+READ_SIZE = 2 ** 20
+
+ID_FIELDS = ["id", "page.id", "revision.id", "revision.page.id"]
+
+
+def main(argv=None):
+    args = docopt.docopt(__doc__, argv=argv)
+
+    pages = 0
+    revisions = 0
+    for index_doc in build_index(args['<input_file>']):
+        if 'page_id' in index_doc:
+            pages += 1
+            revisions += len(index_doc['revisions'])
+        sys.stdout.write(json.dumps(index_doc) + "\n")
+
+    sys.stderr.write("Indexed {0} page(s) and {1} revision(s).\n"
+                     .format(pages, revisions))
+
+def build_index(path):
+    """
+    Generates the index documents of the file at `path`.  The first is a
+    header that records the file's path and compression.  Each of the rest
+    records the 'page_id', 'block', 'offset' and 'lines' of a page and the
+    [`id`, `block`, `offset`, `lines`] of its 'revisions'.
+    """
+    from .json2tsv import FieldExtractor
+
+    compression = detect_compression(path)
+    yield {'path': os.path.abspath(path), 'compression': compression}
+
+    extractor = FieldExtractor(ID_FIELDS)
+    page = None
+    revision = None
+    for block, offset, line in indexed_lines(path, compression):
+        stripped = line.lstrip()
+        if stripped[:1] != b"{":
+            # Compact rows and blank lines belong to the current revision
+            if revision is not None:
+                revision[3] += 1
+                page['lines'] += 1
+            continue
+
+        rev_id, page_id, token_rev_id, token_page_id = \
+                extractor.extract(str(line, 'utf-8'))
+        if token_rev_id is not None:
+            rev_id, page_id = token_rev_id, token_page_id
+
+        if page is None or page_id != page['page_id']:
+            if page is not None: yield page
+            page = {'page_id': page_id, 'block': block, 'offset': offset,
+                    'lines': 0, 'revisions': []}
+            revision = None
+
+        if revision is None or rev_id != revision[0]:
+            revision = [rev_id, block, offset, 0]
+            page['revisions'].append(revision)
+
+        revision[3] += 1
+        page['lines'] += 1
+
+    if page is not None: yield page
+
+def open_input(index_path, pages="<all>", revisions="<all>"):
+    """
+    Returns <stdin> or, if `index_path` is provided, a text stream of the
+    lines of the indexed file that belong to `pages` or `revisions` (comma
+    separated ids or "<all>").  The stream can be passed to
+    :func:`~mwstreaming.utilities.util.read_docs` in place of <stdin>.
+    """
+    if index_path is None:
+        if pages != "<all>" or revisions != "<all>":
+            raise RuntimeError("--pages and --revisions require --index")
+        return sys.stdin
+
+    page_ids = None if pages == "<all>" else parse_ids(pages)
+    revision_ids = None if revisions == "<all>" else parse_ids(revisions)
+
+    lines = read_indexed(index_path, page_ids, revision_ids)
+    return io.TextIOWrapper(io.BufferedReader(LineStream(lines)),
+                            encoding='utf-8')
+
+def parse_ids(ids):
+    return set(int(id) for id in ids.split(","))
+
+def read_indexed(index_path, page_ids=None, revision_ids=None):
+    """
+    Generates the lines of the file indexed at `index_path` that belong to
+    `page_ids` or `revision_ids` in the order of the file.  If neither are
+    provided, all lines are generated.
+    """
+    with open(index_path) as f:
+        header = json.loads(f.readline())
+        if page_ids is None and revision_ids is None:
+            targets = [(0, 0, None)]
+        else:
+            targets = find_targets((json.loads(line) for line in f),
+                                   page_ids, revision_ids)
+
+    reader = BlockReader(header['path'], header['compression'])
+    try:
+        for block, offset, lines in targets:
+            reader.seek(block, offset)
+            while lines is None or lines > 0:
+                line = reader.readline()
+                if len(line) == 0:
+                    break
+                yield line
+                if lines is not None: lines -= 1
+    finally:
+        reader.close()
+
+def find_targets(index_docs, page_ids=None, revision_ids=None):
+    """
+    Returns a sorted list of the (`block`, `offset`, `lines`) of the pages
+    and revisions to read.
+    """
+    targets = []
+    for index_doc in index_docs:
+        if page_ids is not None and index_doc['page_id'] in page_ids:
+            targets.append((index_doc['block'], index_doc['offset'],
+                            index_doc['lines']))
+        elif revision_ids is not None:
+            for rev_id, block, offset, lines in index_doc['revisions']:
+                if rev_id in revision_ids:
+                    targets.append((block, offset, lines))
+
+    targets.sort()
+    return targets
+
+def indexed_lines(path, compression):
+    """
+    Generates (`block`, `offset`, `line`) triples for the lines of the file at
+    `path` where `block` is the offset of the compressed stream that the line
+    starts in and `offset` is the decompressed offset of the line within it.
+    """
+    current_block = 0
+    block_offset = 0
+    parts = []
+    start = None
+    with open(path, "rb") as f:
+        for block, data in read_blocks(f, compression):
+            if block != current_block:
+                current_block = block
+                block_offset = 0
+
+            idx = 0
+            while idx < len(data):
+                if start is None:
+                    start = (current_block, block_offset + idx)
+                end = data.find(b"\n", idx)
+                if end == -1:
+                    parts.append(data[idx:])
+                    break
+                parts.append(data[idx:end + 1])
+                yield start + (b"".join(parts),)
+                parts = []
+                start = None
+                idx = end + 1
+
+            block_offset += len(data)
+
+    if start is not None:
+        yield start + (b"".join(parts),)
+
+def read_blocks(f, compression, start=0):
+    """
+    Generates (`block`, `data`) pairs of the decompressed data of `f` from
+    the stream that starts at `start`.  For plain files, `block` is always
+    `start`.
+    """
+    f.seek(start)
+    if compression is None:
+        while True:
+            raw = f.read(READ_SIZE)
+            if len(raw) == 0:
+                break
+            yield start, raw
+        return
+
+    new_decompressor = decompressor_type(compression)
+    decompressor = new_decompressor()
+    block = start
+    consumed = start
+    while True:
+        raw = f.read(READ_SIZE)
+        if len(raw) == 0:
+            break
+        consumed += len(raw)
+        while len(raw) > 0:
+            data = decompressor.decompress(raw)
+            if len(data) > 0:
+                yield block, data
+            if decompressor.eof:
+                raw = decompressor.unused_data
+                block = consumed - len(raw)
+                decompressor = new_decompressor()
+            else:
+                raw = b""
+
+def detect_compression(path):
+    for extension, compression in [(".bz2", "bz2"), (".gz", "gz"),
+                                   (".xz", "xz"), (".lzma", "xz"),
+                                   (".zst", "zst"), (".zstd", "zst")]:
+        if path.endswith(extension):
+            return compression
+    return None
+
+def decompressor_type(compression):
+    if compression == "bz2":
+        return bz2.BZ2Decompressor
+    elif compression == "gz":
+        return lambda: zlib.decompressobj(zlib.MAX_WBITS | 32)
+    elif compression == "xz":
+        return lzma.LZMADecompressor
+    elif compression == "zst":
+        zstandard = import_zstandard()
+        return lambda: zstandard.ZstdDecompressor().decompressobj()
+    else:
+        raise ValueError("Unknown compression {0}".format(repr(compression)))
+
+def import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("Reading .zst files requires zstandard.  " +
+                           "Install it with `pip install zstandard`.")
+    return zstandard
+
+
+class BlockReader:
+    """
+    Reads lines from (`block`, `offset`) positions of an indexed file.  Reading
+    continues from the current position when the next position is later in
+    the same block.
+    """
+    def __init__(self, path, compression):
+        self.f = open(path, "rb")
+        self.compression = compression
+        self.block = None
+        self.position = 0
+        self.pending = b""
+        self.blocks = iter(())
+
+    def seek(self, block, offset):
+        if self.compression is None:
+            # Plain files can seek straight to the line
+            block, offset = block + offset, 0
+
+        if block != self.block or offset < self.position:
+            self.blocks = read_blocks(self.f, self.compression, block)
+            self.block = block
+            self.position = 0
+            self.pending = b""
+
+        while self.position + len(self.pending) < offset:
+            self.position += len(self.pending)
+            self.pending = self.read()
+            if len(self.pending) == 0:
+                return
+        self.pending = self.pending[offset - self.position:]
+        self.position = offset
+
+    def readline(self):
+        parts = []
+        while True:
+            end = self.pending.find(b"\n")
+            if end != -1:
+                parts.append(self.pending[:end + 1])
+                self.pending = self.pending[end + 1:]
+                self.position += end + 1
+                break
+            parts.append(self.pending)
+            self.position += len(self.pending)
+            self.pending = self.read()
+            if len(self.pending) == 0:
+                break
+        return b"".join(parts)
+
+    def read(self):
+        for _, data in self.blocks:
+            return data
+        return b""
+
+    def close(self):
+        self.f.close()
+
+
+class LineStream(io.RawIOBase):
+    """
+    A readable binary stream of the concatenation of `lines`.
+    """
+    def __init__(self, lines):
+        self.lines = iter(lines)
+        self.pending = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while len(self.pending) == 0:
+            self.pending = next(self.lines, None)
+            if self.pending is None:
+                self.pending = b""
+                return 0
+        length = min(len(b), len(self.pending))
+        b[:length] = self.pending[:length]
+        self.pending = self.pending[length:]
+        return length
+
+
+if __name__ == "__main__": main()
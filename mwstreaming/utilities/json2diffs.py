@@ -9,43 +9,143 @@ save space with `--drop-text`.
 Note that this utility can be run in a a map-reduce process as the mapper if
 `mend_diffs` is used as a reducer.
 
+Long runs can record their progress with `--checkpoint` and pick up where they
+left off with `--resume`.  When resuming, output must be appended to the
+partial output file.
+
+$ json2diffs --config=conf.yaml --checkpoint=diffs.ckpt < revs.json > diffs.json
+$ json2diffs --config=conf.yaml --checkpoint=diffs.ckpt --resume \
+             < revs.json >> diffs.json
+
+With `--incremental`, the last revision's text for each page is kept in a
+local state database.  Later runs (e.g. over a new dump or a feed of recent
+revisions) only diff revisions that are newer than the stored state.  See
+`compact_state` for keeping the database small.
+
+$ json2diffs --config=conf.yaml --incremental=states.db < new.json > diffs.json
+
+With `--interleaved`, input need not be partitioned by page (but revisions of
+each page must still arrive in order).  A processor is kept per page in an LRU
+cache that is bounded by `--cache-size`.  Evicted processors are spilled to
+disk (to the `--incremental` database if provided) and reconstructed on
+demand.
+
+$ tail -f recent_changes.json | json2diffs --config=conf.yaml --interleaved
+
+With `--tokenizers`, the texts of upcoming revisions of the current page are
+tokenized and segmented in a pool of <num> processes, up to `--tokenize-ahead`
+revisions ahead, while this process only matches them against the previous
+revision.  This lets long pages use more than one core.  The diff engine must
+be able to process pre-segmented text (e.g. deltas.SegmentMatcher).
+
+$ json2diffs --config=conf.yaml --tokenizers=3 < revs.json > diffs.json
+
+`--sample-pages` processes only a fraction of the pages.  Pages are selected
+by a stable hash of their id and `--sample-seed`, and the revisions of other
+pages are skipped before they are decoded, so a stage that samples with the
+same rate and seed selects the same pages (see :mod:`mwstreaming.sampling`).
+
+$ json2diffs --config=conf.yaml --sample-pages=0.01 < revs.json > diffs.json
+
 Usage:
     json2diffs (-h|--help)
-    json2diffs --config=<path> [--drop-text] [--timeout=<secs>]
-                               [--namespaces=<ns>] [--verbose]
+    json2diffs --config=<path> [--drop-text] [--max-bytes=<num>]
+                               [--timeout=<secs>]
+                               [--namespaces=<ns>] [--incremental=<path>]
+                               [--interleaved] [--cache-size=<mb>]
+                               [--tokenizers=<num>] [--tokenize-ahead=<revs>]
+                               [--dedupe-text] [--text-store=<path>]
+                               [--sample-pages=<rate>] [--sample-seed=<n>]
+                               [--checkpoint=<path>] [--resume]
+                               [--checkpoint-interval=<secs>]
+                               [--metrics=<path>] [--metrics-interval=<secs>]
+                               [--verbose]
+                               [--index=<path>] [--pages=<ids>]
+                               [--revisions=<ids>]
 
 Options:
     --config=<path>        The path to difference detection configuration
     --drop-text            Drops the 'text' field from the JSON blob
+    --max-bytes=<num>      The maximum number of bytes of a 'text' field (as
+                           JSON) to read.  Longer texts are cut down as they
+                           are read and marked 'truncated'.  Lines with more
+                           bytes than this outside of 'text' are an error.
+                           [default: <none>]
     --timeout=<secs>       The maximum time a diff can run in seconds before
                            being cancelled.  [default: <infinity>]
     --namespaces=<ns>      A comma separated list of page namespaces to be
                            processed [default: <all>]
-    --verbose              Print out progress information
+    --incremental=<path>   The path of a per-page state database.  Only
+                           revisions newer than the stored state are diffed.
+    --interleaved          Accept input that is not partitioned by page
+    --cache-size=<mb>      The approximate memory budget for cached
+                           processors in `--interleaved` mode (in MB)
+                           [default: 1024]
+    --tokenizers=<num>     The number of processes that tokenize revisions
+                           ahead of diffing.  0 tokenizes while diffing.
+                           [default: 0]
+    --tokenize-ahead=<revs>  The maximum number of revisions of a page to
+                             tokenize ahead of diffing [default: 20]
+    --dedupe-text          Replace texts that repeat one of the recent texts
+                           of their page with a 'text_ref' to the revision
+                           that had it
+    --text-store=<path>    The path of a text store (an SQLite database).
+                           Texts that were moved there are read from it.
+                           Unless `--drop-text`, output texts are moved to it
+                           and replaced with a 'text_sha1'.
+    --sample-pages=<rate>  The fraction of pages to process [default: 1]
+    --sample-seed=<n>      Selects a different sample of pages [default: 0]
+    --checkpoint=<path>    The path of a file to periodically record progress
+                           to at page boundaries
+    --resume               Continue from the progress recorded in
+                           `--checkpoint`
+    --checkpoint-interval=<secs>  The minimum number of seconds between
+                                  checkpoints [default: 60]
+    --index=<path>         Read the documents of the file indexed at this path
+                           (see `index`) rather than <stdin>
+    --pages=<ids>          A comma separated list of page ids to read from
+                           `--index` [default: <all>]
+    --revisions=<ids>      A comma separated list of revision ids to read from
+                           `--index` [default: <all>]
+    --metrics=<path>       Write periodic throughput and latency metrics to
+                           this file as JSON lines
+    --metrics-interval=<secs>  The number of seconds between metrics reports
+                               [default: 60]
+    --verbose              Print periodic metrics reports to <stderr>
 """
-import json
 import sys
 import time
 from itertools import groupby
 
 import docopt
-from deltas import DiffEngine
-from stopit import ThreadingTimeout as Timeout
-from stopit import TimeoutException
 
-import yamlconf
-
-from .util import op2doc, read_docs
+from ..checkpoint import Checkpoint, InputPosition
+from ..metrics import Metrics, from_verbose
+from ..pipeline import Writer
+from ..processor_cache import ProcessorCache
+from ..sampling import PageSampler
+from ..state import StateStore, is_newer
+from ..text_store import TextDeduplicator, TextStore
+from ..tokenizer_pool import TokenizerPool
+from .index import open_input
+from .util import load_diff_engine, op2doc, read_docs
 
 
 def main(argv=None):
     args = docopt.docopt(__doc__, argv=argv)
 
-    config_doc = yamlconf.load(open(args['--config']))
-    diff_engine = DiffEngine.from_config(config_doc, config_doc["diff_engine"])
+    input_file = open_input(args['--index'], args['--pages'],
+                            args['--revisions'])
+
+    diff_engine = load_diff_engine(args['--config'])
 
     drop_text = bool(args['--drop-text'])
 
+    if args['--max-bytes'] == "<none>":
+        max_bytes = None
+    else:
+        max_bytes = int(args['--max-bytes'])
+
     if args['--timeout'] == "<infinity>":
         timeout = None
     else:
@@ -58,21 +158,125 @@ def main(argv=None):
 
     verbose = bool(args['--verbose'])
 
-    run(read_docs(sys.stdin), diff_engine, timeout, namespaces, drop_text, verbose)
+    interleaved = bool(args['--interleaved'])
+    cache_size = float(args['--cache-size']) * 1024 * 1024
+
+    if args['--checkpoint'] is not None:
+        if interleaved:
+            raise RuntimeError("--checkpoint is not supported with " +
+                               "--interleaved input.")
+        checkpoint = Checkpoint.start(
+            args['--checkpoint'],
+            interval=float(args['--checkpoint-interval']),
+            resume=bool(args['--resume']),
+            input=input_file, output=sys.stdout)
+        position = checkpoint.position
+    else:
+        checkpoint = None
+        position = InputPosition()
+
+    metrics = Metrics.from_options(args['--metrics'],
+                                   float(args['--metrics-interval']), verbose,
+                                   position=position)
+
+    if args['--incremental'] is not None:
+        state_store = StateStore(args['--incremental'], "diffs")
+    else:
+        state_store = None
+
+    if interleaved:
+        # The processor cache spills to (and owns) the state store
+        processor_cache = ProcessorCache(diff_engine, cache_size,
+                                         spill=state_store)
+        state_store = None
+    else:
+        processor_cache = None
+
+    if processor_cache is not None and metrics is not None:
+        metrics.gauge('processor_cache', processor_cache.stats)
+
+    tokenizers = int(args['--tokenizers'])
+    if tokenizers > 0:
+        if interleaved:
+            raise RuntimeError("--tokenizers is not supported with " +
+                               "--interleaved input.")
+        if not TokenizerPool.supports(diff_engine):
+            raise RuntimeError("--tokenizers requires a diff engine that " +
+                               "can process pre-segmented text.")
+        tokenizer_pool = TokenizerPool(args['--config'], tokenizers,
+                                       int(args['--tokenize-ahead']))
+    else:
+        tokenizer_pool = None
+
+    dedupe_text = bool(args['--dedupe-text'])
+    if args['--text-store'] is not None:
+        text_store = TextStore(args['--text-store'])
+    else:
+        text_store = None
+
+    if drop_text:
+        if dedupe_text:
+            raise RuntimeError("--dedupe-text has no texts to remove with " +
+                               "--drop-text.")
+        # The text store is only read from
+        deduplicator = None
+    elif dedupe_text or text_store is not None:
+        deduplicator = TextDeduplicator(dedupe=dedupe_text, store=text_store)
+    else:
+        deduplicator = None
+
+    sampler = PageSampler.from_options(args['--sample-pages'],
+                                       args['--sample-seed'])
+
+    run(read_docs(input_file, position=position, max_bytes=max_bytes,
+                  text_store=text_store, sampler=sampler, hydrate=True),
+        diff_engine, timeout, namespaces, drop_text, verbose,
+        checkpoint=checkpoint, state_store=state_store,
+        processor_cache=processor_cache, tokenizer_pool=tokenizer_pool,
+        deduplicator=deduplicator, metrics=metrics)
+
+def run(revision_docs, diff_engine, timeout, namespaces, drop_text,
+        verbose=False, checkpoint=None, state_store=None,
+        processor_cache=None, tokenizer_pool=None, deduplicator=None,
+        metrics=None):
+
+    metrics = from_verbose(verbose, metrics)
+
+    if processor_cache is None:
+        revision_docs = json2diffs(revision_docs, diff_engine, timeout,
+                                   namespaces, checkpoint=checkpoint,
+                                   state_store=state_store,
+                                   tokenizer_pool=tokenizer_pool,
+                                   metrics=metrics)
+    else:
+        revision_docs = interleaved_json2diffs(revision_docs, processor_cache,
+                                               timeout, namespaces, metrics)
+
+    output = Writer(sys.stdout, metrics)
+    # Checkpoints record the output offset once queued output is written
+    if checkpoint is not None: checkpoint.output = output
 
-def run(revision_docs, diff_engine, timeout, namespaces, drop_text, verbose):
+    with output:
+        for revision_doc in revision_docs:
+            if drop_text:
+                del revision_doc['text']
+            elif deduplicator is not None:
+                deduplicator.dedupe(revision_doc)
 
-    revision_docs = json2diffs(revision_docs, diff_engine, timeout, namespaces,
-                               verbose)
-    for revision_doc in revision_docs:
-        if drop_text:
-            del revision_doc['text']
+            output.write_doc(revision_doc)
 
-        json.dump(revision_doc, sys.stdout)
-        sys.stdout.write("\n")
+    if state_store is not None: state_store.close()
+    if checkpoint is not None: checkpoint.write()
+    if metrics is not None: metrics.close()
+    if processor_cache is not None: processor_cache.close()
+    if tokenizer_pool is not None: tokenizer_pool.close()
+    if deduplicator is not None: deduplicator.close()
 
 def json2diffs(revision_docs, diff_engine, timeout=None, namespaces=None,
-               verbose=False):
+               verbose=False, checkpoint=None, state_store=None,
+               tokenizer_pool=None, metrics=None):
+
+    metrics = from_verbose(verbose, metrics)
 
     relevant_revision_doc = \
         (r for r in revision_docs
@@ -81,26 +285,102 @@ def json2diffs(revision_docs, diff_engine, timeout=None, namespaces=None,
                                  key=lambda r:r['page']['title'])
 
     for page_title, revision_docs in page_revision_docs:
-        if verbose: sys.stderr.write(page_title + ": ")
 
-        processor = diff_engine.processor()
+        if state_store is None:
+            processor = diff_engine.processor()
+            last_id = None
+        else:
+            from more_itertools import peekable
+            revision_docs = peekable(revision_docs)
+            page_id = revision_docs.peek()['page']['id']
+            state = state_store.get(page_id)
+            if state is None:
+                processor = diff_engine.processor()
+                last_id = None
+            else:
+                # Pick up where the last run left off
+                processor = diff_engine.processor(last_text=state['text'])
+                last_id = state['id']
+                revision_docs = (r for r in revision_docs
+                                 if is_newer(r, state))
+
+        diff_doc = None
         for diff_doc in diff_revisions(revision_docs, processor,
-                                        timeout=timeout):
+                                       last_id=last_id, timeout=timeout,
+                                       metrics=metrics,
+                                       tokenizer_pool=tokenizer_pool):
+            if metrics is not None: metrics.revision()
 
-            if verbose:
-                if diff_doc['diff']['ops'] is not None:
-                    sys.stderr.write(".")
-                else:
-                    sys.stderr.write("T")
-                sys.stderr.flush()
+            if state_store is not None:
+                state = {'id': diff_doc['id'],
+                         'timestamp': diff_doc['timestamp'],
+                         'text': diff_doc['text']}
 
             yield diff_doc
 
-        if verbose: sys.stderr.write("\n")
+        if diff_doc is not None:
+            if state_store is not None: state_store.put(page_id, state)
+            if checkpoint is not None:
+                checkpoint.page_done(diff_doc['page'].get('id'))
+            if metrics is not None: metrics.page()
 
-def diff_revisions(revision_docs, processor, last_id=None, timeout=None):
+def interleaved_json2diffs(revision_docs, processor_cache, timeout=None,
+                           namespaces=None, metrics=None):
+    """
+    Diffs revisions that are interleaved across pages using a
+    :class:`~mwstreaming.processor_cache.ProcessorCache`.  Revisions that are
+    not newer than the last revision processed for their page are skipped.
+    """
+    relevant_revision_doc = \
+        (r for r in revision_docs
+           if (namespaces is None or r['page']['namespace'] in namespaces))
+
+    for revision_doc in relevant_revision_doc:
+        diff_doc = diff_revision(revision_doc, processor_cache, timeout,
+                                 metrics=metrics)
+        if diff_doc is None:
+            continue
 
-    for revision_doc in revision_docs:
+        if metrics is not None: metrics.revision()
+        yield diff_doc
+
+def diff_revision(revision_doc, processor_cache, timeout=None, metrics=None):
+    """
+    Diffs a single revision against the last revision processed for its page
+    in `processor_cache`.  Returns `None` if the revision is not newer than
+    the last one processed.
+    """
+    page_id = revision_doc['page']['id']
+    processor, state = processor_cache.get(page_id)
+    if state is not None and not is_newer(revision_doc, state):
+        return None
+
+    last_id = state['id'] if state is not None else None
+    diff_doc, = diff_revisions([revision_doc], processor, last_id=last_id,
+                               timeout=timeout, metrics=metrics)
+    processor_cache.put(page_id, processor, diff_doc)
+
+    return diff_doc
+
+def diff_revisions(revision_docs, processor, last_id=None, timeout=None,
+                   metrics=None, tokenizer_pool=None):
+    """
+    Diffs a page's `revision_docs` in order.  If a
+    :class:`~mwstreaming.tokenizer_pool.TokenizerPool` is provided, it
+    tokenizes and segments the texts ahead of time.
+    """
+    if timeout is not None:
+        # stopit is slow to import, so only load it when it will be used.
+        from stopit import ThreadingTimeout as Timeout
+        from stopit import TimeoutException
+
+    if tokenizer_pool is None:
+        prepared_docs = ((revision_doc, None)
+                         for revision_doc in revision_docs)
+    else:
+        prepared_docs = tokenizer_pool.prepare(revision_docs)
+
+    for revision_doc, prepared in prepared_docs:
         diff = {'last_id': last_id}
         text = revision_doc['text'] or ""
 
@@ -109,13 +389,14 @@ def diff_revisions(revision_docs, processor, last_id=None, timeout=None):
         with Timer() as t:
             if timeout is None:
                 # Just process the text
-                operations, a, b = processor.process(text)
+                operations, a, b = process_text(processor, text, prepared)
                 diff['ops'] = [op2doc(op, a, b) for op in operations]
             else:
                 # Try processing with a timeout
                 try:
                     with Timeout(timeout) as ctx:
-                        operations, a, b = processor.process(text)
+                        operations, a, b = process_text(processor, text,
+                                                        prepared)
                 except TimeoutException:
                     pass
 
@@ -146,13 +427,27 @@ def diff_revisions(revision_docs, processor, last_id=None, timeout=None):
                     # Make sure that the processor state is right
                     processor.update(last_text=(revision_doc['text'] or ""))
 
+                    if metrics is not None: metrics.count('timeouts')
+
         # All done.  Record how much time it all took
         diff['time'] = t.interval
+        if metrics is not None: metrics.diff_time(t.interval, revision_doc)
 
         revision_doc['diff'] = diff
         yield revision_doc
         last_id = revision_doc['id']
 
+def process_text(processor, text, prepared=None):
+    """
+    Processes `text` with `processor` or its `prepared` (`tokens`,
+    `segments`).
+    """
+    if prepared is None:
+        return processor.process(text)
+    else:
+        tokens, segments = prepared
+        return processor.process_segments(segments, tokens=tokens)
+
 
 class Timer:
     """
@@ -160,12 +455,14 @@ class Timer:
     http://preshing.com/20110924/timing-your-code-using-pythons-with-statement/
     """
     def __enter__(self):
-        self.start = time.clock()
+        # CPU time of this thread only, so that reading and writing in other
+        # threads (see mwstreaming.pipeline) isn't counted
+        self.start = time.thread_time()
         self.interval = None
         return self
 
     def __exit__(self, *args):
-        self.end = time.clock()
+        self.end = time.thread_time()
         self.interval = self.end - self.start
 
 
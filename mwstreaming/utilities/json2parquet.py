@@ -0,0 +1,269 @@
+"""
+Writes fields from a stream of JSON blobs to a Parquet file as typed columns.
+Fieldnames reference nested blobs with a "." just like json2tsv and can be
+followed by a ":" and a type.  For example, "persistence_stats.censored:bool".
+Fields without a type have their type inferred from the first row group.
+Values that don't fit a field's type (e.g. 2.5 or "5" in an int field) are
+an error rather than being converted.
+
+Types:
+    int        64 bit integers (or floats without a fractional part)
+    float      64 bit floats
+    bool       Booleans
+    str        Strings
+    timestamp  MediaWiki timestamps ("2015-01-01T00:00:00Z") as UTC seconds
+    json       Any value, encoded as a JSON string
+
+`--persistence-stats` adds the fields of persistence2stats output:
+
+    $ mwstream persistence2stats < persistence.json | \\
+      mwstream json2parquet --persistence-stats stats.parquet
+
+Requires pyarrow (`pip install pyarrow`).
+
+Usage:
+    json2parquet (-h|--help)
+    json2parquet <path> [<fieldname>...] [--persistence-stats]
+                        [--row-group-size=<rows>] [--compression=<codec>]
+
+Options:
+    -h|--help                Print this documentation
+    <path>                   The path of the Parquet file to write
+    <fieldname>...           Fields from the JSON blob to write as columns
+    --persistence-stats      Write the revision and `persistence_stats` fields
+                             of persistence2stats output
+    --row-group-size=<rows>  The number of rows per row group
+                             [default: 100000]
+    --compression=<codec>    "snappy", "gzip", "zstd", "brotli", "lz4" or
+                             "none" [default: snappy]
+"""
+import io
+import json
+import sys
+from datetime import datetime, timezone
+
+import docopt
+
+from ..pipeline import read_ahead
+from ..profiling import timed_decode
+from .json2tsv import FieldExtractor
+
+PERSISTENCE_STATS_FIELDS = [
+    "id:int", "page.id:int", "page.title:str", "page.namespace:int",
+    "contributor.id:int", "contributor.user_text:str", "timestamp:timestamp",
+    "persistence_stats.tokens_added:int",
+    "persistence_stats.tokens_persisted:int",
+    "persistence_stats.tokens_non_self_persisted:int",
+    "persistence_stats.sum_log_persisted:float",
+    "persistence_stats.sum_log_non_self_persisted:float",
+    "persistence_stats.censored:bool",
+    "persistence_stats.non_self_censored:bool"
+]
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def main(argv=None):
+    args = docopt.docopt(__doc__, argv=argv)
+
+    fields = [parse_field(spec) for spec in args['<fieldname>']]
+    if args['--persistence-stats']:
+        fields = [parse_field(spec) for spec in PERSISTENCE_STATS_FIELDS] + \
+                 fields
+    if len(fields) == 0:
+        raise RuntimeError("No fields to write.  Provide <fieldname>s or " +
+                           "--persistence-stats.")
+
+    row_group_size = int(args['--row-group-size'])
+    compression = args['--compression']
+
+    lines = timed_decode(read_ahead(
+        io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8')))
+
+    run(lines, args['<path>'], fields, row_group_size, compression)
+
+def run(lines, path, fields, row_group_size, compression):
+
+    pa, pq = import_pyarrow()
+
+    writer = None
+    for table in json2parquet(lines, fields, row_group_size):
+        if writer is None:
+            writer = pq.ParquetWriter(path, table.schema,
+                                      compression=compression)
+        writer.write_table(table, row_group_size=row_group_size)
+
+    if writer is None:
+        # No input.  Still write a (typed) empty file.
+        types = {name: type or "str" for name, type in fields}
+        table = arrow_table({name: [] for name, _ in fields}, types, pa)
+        writer = pq.ParquetWriter(path, table.schema, compression=compression)
+
+    writer.close()
+
+def json2parquet(lines, fields, row_group_size):
+    """
+    Generates a :class:`pyarrow.Table` per row group of `lines`.
+    """
+    pa, pq = import_pyarrow()
+
+    for columns, types in column_batches(lines, fields, row_group_size):
+        yield arrow_table(columns, types, pa)
+
+def column_batches(lines, fields, batch_size):
+    """
+    Generates (`columns`, `types`) pairs for batches of `batch_size` lines.
+    `columns` maps field names to lists of converted values and `types` maps
+    field names to type names.  Types of untyped fields are inferred from the
+    first batch and then fixed, since the file's schema can't change.
+    """
+    fieldnames = [name for name, _ in fields]
+    extractor = FieldExtractor(fieldnames)
+    types = dict(fields)
+    inferred = {name for name, type in fields if type is None}
+
+    batch = []
+    first_row = 1
+    for line in lines:
+        batch.append(extractor.extract(line))
+        if len(batch) >= batch_size:
+            yield convert_batch(batch, fieldnames, types, first_row, inferred)
+            first_row += len(batch)
+            batch = []
+
+    if len(batch) > 0:
+        yield convert_batch(batch, fieldnames, types, first_row, inferred)
+
+def convert_batch(batch, fieldnames, types, first_row=1, inferred=()):
+    """
+    Converts the values of `batch` to the `types` of their fields.  Raises a
+    `ValueError` that names the field and the row (counting from
+    `first_row`) of the first value that doesn't fit its type.
+    """
+    columns = {}
+    for i, name in enumerate(fieldnames):
+        values = [row[i] for row in batch]
+        if types[name] is None:
+            types[name] = infer_type(values)
+        columns[name] = convert_values(values, name, types[name],
+                                       first_row, name in inferred)
+
+    return columns, dict(types)
+
+def convert_values(values, name, type, first_row, inferred):
+    convert = CONVERTERS[type]
+    converted = []
+    for row, val in enumerate(values, first_row):
+        try:
+            converted.append(None if val is None else convert(val))
+        except (TypeError, ValueError) as e:
+            message = "Row {0}: {1} in field {2} is not a valid {3} ({4})." \
+                      .format(row, truncate(repr(val)), repr(name), type, e)
+            if inferred:
+                message += "  The type was inferred from the first row " + \
+                           "group.  Declare a type (e.g. {0}:json) to " \
+                           .format(name) + "write other values."
+            raise ValueError(message) from e
+
+    return converted
+
+def truncate(s, length=100):
+    return s if len(s) <= length else s[:length] + "..."
+
+def infer_type(values):
+    """
+    Infers a type name from a set of decoded JSON values.  Columns of mixed
+    types are written as JSON and columns of only nulls as strings.
+    """
+    seen = {type(val) for val in values if val is not None}
+    if len(seen) == 0:
+        return "str"
+    elif seen == {bool}:
+        return "bool"
+    elif seen == {int}:
+        return "int"
+    elif seen <= {int, float}:
+        return "float"
+    elif seen == {str}:
+        return "str"
+    else:
+        return "json"
+
+def parse_field(spec):
+    """
+    Parses "<fieldname>[:<type>]" into (`fieldname`, `type`).  `type` is
+    `None` when not specified.
+    """
+    if ":" in spec:
+        name, type = spec.rsplit(":", 1)
+        if type not in CONVERTERS:
+            raise ValueError("Unknown type {0} for field {1}.  Expected one "
+                             .format(repr(type), repr(name)) +
+                             "of {0}.".format(", ".join(sorted(CONVERTERS))))
+        return name, type
+    else:
+        return spec, None
+
+def to_int(val):
+    if type(val) is int:
+        return val
+    elif type(val) is float and val.is_integer():
+        return int(val)
+    else:
+        raise TypeError("expected an integer")
+
+def to_float(val):
+    if type(val) in (int, float):
+        return float(val)
+    else:
+        raise TypeError("expected a number")
+
+def to_bool(val):
+    if type(val) is bool:
+        return val
+    else:
+        raise TypeError("expected true or false")
+
+def parse_timestamp(val):
+    if not isinstance(val, str):
+        raise TypeError("expected a string")
+    return datetime.strptime(val, TIMESTAMP_FORMAT) \
+                   .replace(tzinfo=timezone.utc)
+
+def encode_str(val):
+    return val if isinstance(val, str) else json.dumps(val)
+
+CONVERTERS = {
+    'int': to_int,
+    'float': to_float,
+    'bool': to_bool,
+    'str': encode_str,
+    'timestamp': parse_timestamp,
+    'json': json.dumps
+}
+
+def arrow_table(columns, types, pa):
+    arrow_types = {
+        'int': pa.int64(),
+        'float': pa.float64(),
+        'bool': pa.bool_(),
+        'str': pa.string(),
+        'timestamp': pa.timestamp('s', tz="UTC"),
+        'json': pa.string()
+    }
+    schema = pa.schema([(name, arrow_types[types[name]]) for name in columns])
+    return pa.Table.from_arrays(
+        [pa.array(values, type=schema.field(name).type)
+         for name, values in columns.items()], schema=schema)
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("json2parquet requires pyarrow.  Install it " +
+                           "with `pip install pyarrow`.")
+
+    return pyarrow, pyarrow.parquet
+
+if __name__ == "__main__": main()
@@ -5,39 +5,282 @@ a "-" to print out the JSON blob itself as a column.
 
 Usage:
     json2tsv (-h|--help)
-    json2tsv [--header] <fieldname>...
+    json2tsv [--header] [--index=<path>] [--pages=<ids>]
+             [--revisions=<ids>] [--threads=<num>] <fieldname>...
 
 Options:
     -h|--help       Print this documentation
     --header        Print out a header row
     <fieldname>...  Fields from the JSON blob to extract
+    --index=<path>  Read the documents of the file indexed at this path (see
+                    `index`) rather than <stdin>
+    --pages=<ids>   A comma separated list of page ids to read from `--index`
+                    [default: <all>]
+    --revisions=<ids>  A comma separated list of revision ids to read from
+                       `--index` [default: <all>]
+    --threads=<num>  The number of processes to extract fields with.  More
+                     than 1 requires an uncompressed regular file as input.
+                     [default: 1]
 """
+import io
 import json
+import re
 import sys
+from functools import partial
+from itertools import chain
+from json.decoder import scanstring
 
 import docopt
 
+from ..mapped_input import chunk_lines, map_chunks
+from ..pipeline import Writer, read_ahead
+from ..profiling import timed_decode
+from .index import open_input
 from .util import read_docs
 
+BATCH_SIZE = 1000
+"""
+The number of rows to write to <stdout> at a time.
+"""
+
+PARTIAL_DECODE_MIN = 10000
+"""
+Lines shorter than this (in characters) are decoded in full.  Short lines
+decode faster with :func:`json.loads` than with partial decoding.
+"""
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+KEY = re.compile(r'"([^"\\]*)"[ \t\n\r]*:[ \t\n\r]*')
+SEPARATOR = re.compile(r'[ \t\n\r]*([,}])[ \t\n\r]*')
+UNSTRUCTURED = re.compile(r'[^"{}\[\]]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"{}\[\]]*)*')
+"""
+Matches up to the next bracket that isn't in a string.
+"""
+
 
 def main(argv=None):
     args = docopt.docopt(__doc__, argv=argv)
     
+    input_file = open_input(args['--index'], args['--pages'],
+                            args['--revisions'])
+    
     header = bool(args['--header'])
+    fieldnames = args['<fieldname>']
+    threads = int(args['--threads'])
+    
+    if threads > 1:
+        chunk_rows = map_chunks(input_file, partial(tsv_chunk, fieldnames),
+                                threads)
+        rows = chain.from_iterable(chunk_rows)
+    elif "-" in fieldnames:
+        # The whole blob is needed, so there's nothing to skip.
+        rows = json2tsv(read_docs(input_file), fieldnames)
+    else:
+        lines = io.TextIOWrapper(input_file.buffer, encoding='utf-8')
+        rows = lines2tsv(timed_decode(read_ahead(lines)), fieldnames)
     
-    run(read_docs(sys.stdin), args['<fieldname>'], header)
+    run(rows, fieldnames, header)
 
-def run(json_docs, fieldnames, header):
+def run(rows, fieldnames, header):
     
-    if header:
-        print("\t".join(encode(fn) for fn in fieldnames))
+    with Writer(sys.stdout) as output:
+        if header:
+            output.write("\t".join(encode(fn) for fn in fieldnames) + "\n")
+        
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= BATCH_SIZE:
+                output.write("".join(batch))
+                batch = []
+        
+        output.write("".join(batch))
+
+def json2tsv(json_docs, fieldnames):
     
     field_keys = [fn.split('.') for fn in fieldnames]
     
     for doc in json_docs:
-        sys.stdout.write("\t".join(encode(apply_keys(doc, keys))
-                                   for keys in field_keys))
-        sys.stdout.write("\n")
+        yield "\t".join(encode(apply_keys(doc, keys))
+                        for keys in field_keys) + "\n"
+
+def lines2tsv(lines, fieldnames):
+    """
+    Like :func:`json2tsv`, but reads JSON lines and only decodes the parts of
+    each blob that contain the requested fields.
+    """
+    extractor = FieldExtractor(fieldnames)
+    
+    for line in lines:
+        yield "\t".join(encode(val) for val in extractor.extract(line)) + "\n"
+
+def tsv_chunk(fieldnames, chunk):
+    """
+    Returns the rows of the lines of a chunk of input.
+    """
+    lines = chunk_lines(chunk)
+    if "-" in fieldnames:
+        docs = (json.loads(line.strip().split("\t")[0]) for line in lines)
+        return list(json2tsv(docs, fieldnames))
+    else:
+        return list(lines2tsv(lines, fieldnames))
+
+
+class FieldExtractor:
+    """
+    Extracts the values of dotted field paths from a line of JSON without
+    decoding the subtrees that don't contain them.  Values that are not
+    reachable are `None`, just like :func:`apply_keys`.  Decoding stops as
+    soon as all of the fields have been found, so if a key is repeated in an
+    object, the first value is used.
+    """
+    def __init__(self, fieldnames):
+        self.fieldnames = fieldnames
+        self.field_keys = [fn.split('.') for fn in fieldnames]
+        self.decoder = json.JSONDecoder()
+        
+        # A tree of {key: (field indexes, subtree, subtree field indexes)}
+        self.tree = {}
+        for i, keys in enumerate(self.field_keys):
+            node = self.tree
+            for depth, key in enumerate(keys):
+                if key not in node:
+                    node[key] = ([], {}, [])
+                indexes, children, _ = node[key]
+                if depth == len(keys) - 1:
+                    indexes.append(i)
+                node = children
+        index_subtrees(self.tree)
+    
+    def extract(self, line):
+        values = [None] * len(self.field_keys)
+        if len(line) < PARTIAL_DECODE_MIN:
+            doc = json.loads(line.strip().split("\t")[0])
+            return [apply_keys(doc, keys) for keys in self.field_keys]
+        
+        try:
+            start = WHITESPACE.match(line, 0).end()
+            if line[start] != "{":
+                raise ValueError("Expected a JSON object")
+            self.extract_object(line, start, self.tree, values,
+                                [len(values)], 0)
+        except (ValueError, IndexError):
+            # Let the full decoder sort it out (or complain properly)
+            doc = json.loads(line.strip().split("\t")[0])
+            values = [apply_keys(doc, keys) for keys in self.field_keys]
+        
+        return values
+    
+    def extract_object(self, s, idx, tree, values, remaining, depth):
+        """
+        Reads the object that starts at `idx` and fills in `values` for the
+        fields in `tree` (whose keys are at `depth` in the field paths).
+        `remaining` holds the number of fields left to find.  Returns the
+        index after the object or `None` if all fields were found before the
+        end.
+        """
+        idx = WHITESPACE.match(s, idx + 1).end()
+        if s[idx] == "}":
+            return idx + 1
+        
+        while True:
+            match = KEY.match(s, idx)
+            if match is not None:
+                key, idx = match.group(1), match.end()
+            else:
+                # Escapes in the key
+                if s[idx] != '"':
+                    raise ValueError("Expected a key")
+                key, idx = scanstring(s, idx + 1)
+                idx = WHITESPACE.match(s, idx).end()
+                if s[idx] != ":":
+                    raise ValueError("Expected ':'")
+                idx = WHITESPACE.match(s, idx + 1).end()
+            
+            if key not in tree:
+                idx = self.skip_value(s, idx)
+            else:
+                indexes, children, children_indexes = tree[key]
+                if len(indexes) > 0:
+                    # The value itself is wanted, so decode all of it
+                    value, idx = self.decoder.raw_decode(s, idx)
+                    for i in indexes:
+                        values[i] = value
+                    for i in children_indexes:
+                        values[i] = apply_keys(value,
+                                               self.field_keys[i][depth + 1:])
+                    remaining[0] -= len(indexes) + len(children_indexes)
+                elif s[idx] == "{":
+                    idx = self.extract_object(s, idx, children, values,
+                                              remaining, depth + 1)
+                else:
+                    # Not an object, so none of the fields below it exist
+                    idx = self.skip_value(s, idx)
+                    remaining[0] -= len(children_indexes)
+                
+                if idx is None or remaining[0] <= 0:
+                    return None
+            
+            match = SEPARATOR.match(s, idx)
+            if match is None:
+                raise ValueError("Expected ',' or '}'")
+            elif match.group(1) == "}":
+                return match.end()
+            else:
+                idx = match.end()
+    
+    def skip_value(self, s, idx):
+        if s[idx] == '"':
+            # Find the closing quote without decoding the string.  This is
+            # much faster than decoding for long strings like 'text'.
+            return skip_string(s, idx + 1)
+        elif s[idx] in "{[":
+            # Match brackets (outside of strings) without building the
+            # objects and arrays, e.g. of a 'diff'.
+            depth = 0
+            while True:
+                idx = UNSTRUCTURED.match(s, idx).end()
+                if idx >= len(s):
+                    raise ValueError("Unterminated object or array")
+                elif s[idx] in "{[":
+                    depth += 1
+                elif s[idx] in "}]":
+                    depth -= 1
+                    if depth == 0:
+                        return idx + 1
+                else:
+                    raise ValueError("Unterminated string")
+                idx += 1
+        else:
+            value, idx = self.decoder.raw_decode(s, idx)
+            return idx
+
+
+def skip_string(s, idx):
+    """
+    Returns the index after the closing quote of the string whose contents
+    start at `idx`.
+    """
+    while True:
+        end = s.index('"', idx)
+        backslashes = 0
+        while s[end - backslashes - 1] == "\\":
+            backslashes += 1
+        if backslashes % 2 == 0:
+            return end + 1
+        idx = end + 1
+
+def index_subtrees(tree):
+    """
+    Fills in the field indexes below each node of a :class:`FieldExtractor`
+    tree and returns all field indexes in `tree`.
+    """
+    indexes = []
+    for key, (key_indexes, children, children_indexes) in tree.items():
+        children_indexes.extend(index_subtrees(children))
+        indexes.extend(key_indexes)
+        indexes.extend(children_indexes)
+    return indexes
 
 def apply_keys(doc, keys):
     
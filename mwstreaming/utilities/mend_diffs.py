@@ -8,7 +8,11 @@ as the reducer.
 Usage:
     mend_diffs (-h|--help)
     mend_diffs --config=<path> [--drop-text] [--timeout=<secs>]
+                               [--metrics=<path>] [--metrics-interval=<secs>]
                                [--verbose]
+                               [--text-store=<path>]
+                               [--index=<path>] [--pages=<ids>]
+                               [--revisions=<ids>]
 
 Options:
     --config=<path>        The path to difference detection configuration
@@ -17,27 +21,42 @@ Options:
                            being cancelled.  [default: <infinity>]
     --namespaces=<ns>      A comma separated list of page namespaces to be
                            processed [default: <all>]
-    --verbose              Print out progress information
+    --text-store=<path>    The path of a text store (an SQLite database) to
+                           read texts that were moved there from
+    --index=<path>         Read the documents of the file indexed at this path
+                           (see `index`) rather than <stdin>
+    --pages=<ids>          A comma separated list of page ids to read from
+                           `--index` [default: <all>]
+    --revisions=<ids>      A comma separated list of revision ids to read from
+                           `--index` [default: <all>]
+    --metrics=<path>       Write periodic throughput and latency metrics to
+                           this file as JSON lines
+    --metrics-interval=<secs>  The number of seconds between metrics reports
+                               [default: 60]
+    --verbose              Print periodic metrics reports to <stderr>
 """
-import json
 import sys
 from itertools import groupby
 
 import docopt
-from deltas import DiffEngine
 from more_itertools import peekable
 
-import yamlconf
-
+from ..checkpoint import InputPosition
+from ..metrics import Metrics, from_verbose
+from ..pipeline import Writer
+from ..text_store import TextStore
+from .index import open_input
 from .json2diffs import diff_revisions
-from .util import read_docs
+from .util import load_diff_engine, read_docs
 
 
 def main(argv=None):
     args = docopt.docopt(__doc__, argv=argv)
 
-    config_doc = yamlconf.load(open(args['--config']))
-    diff_engine = DiffEngine.from_config(config_doc, config_doc["diff_engine"])
+    input_file = open_input(args['--index'], args['--pages'],
+                            args['--revisions'])
+
+    diff_engine = load_diff_engine(args['--config'])
 
     drop_text = bool(args['--drop-text'])
 
@@ -48,23 +67,44 @@ def main(argv=None):
 
     verbose = bool(args['--verbose'])
 
-    run(read_docs(sys.stdin), diff_engine, timeout, drop_text, verbose)
+    position = InputPosition()
+    metrics = Metrics.from_options(args['--metrics'],
+                                   float(args['--metrics-interval']), verbose,
+                                   position=position)
+
+    if args['--text-store'] is not None:
+        text_store = TextStore(args['--text-store'])
+    else:
+        text_store = None
+
+    run(read_docs(input_file, position=position, text_store=text_store,
+                  hydrate=True),
+        diff_engine, timeout, drop_text, verbose, metrics=metrics)
+
+def run(diff_docs, diff_engine, timeout, drop_text, verbose=False,
+        metrics=None):
 
-def run(diff_docs, diff_engine, timeout, drop_text, verbose):
+    metrics = from_verbose(verbose, metrics)
 
-    for mended_doc in mend_diffs(diff_docs, diff_engine, timeout, verbose):
-        if drop_text:
-            del mended_doc['text']
+    with Writer(sys.stdout, metrics) as output:
+        for mended_doc in mend_diffs(diff_docs, diff_engine, timeout,
+                                     metrics=metrics):
+            if drop_text:
+                del mended_doc['text']
 
-        json.dump(mended_doc, sys.stdout)
-        sys.stdout.write("\n")
+            output.write_doc(mended_doc)
 
-def mend_diffs(diff_docs, diff_engine, timeout=None, verbose=False):
+    if metrics is not None: metrics.close()
+
+def mend_diffs(diff_docs, diff_engine, timeout=None, verbose=False,
+               metrics=None):
+
+    metrics = from_verbose(verbose, metrics)
 
     page_diff_docs = groupby(diff_docs, key=lambda r:r['page']['title'])
 
     for page_title, page_docs in page_diff_docs:
-        if verbose: sys.stderr.write(page_title + ": ")
+        if metrics is not None: metrics.page()
 
         page_docs = peekable(page_docs)
 
@@ -80,8 +120,8 @@ def mend_diffs(diff_docs, diff_engine, timeout=None, verbose=False):
                                    "field for mending.")
 
             last_text = diff_doc['text']
+            if metrics is not None: metrics.revision()
             yield diff_doc
-            if verbose: sys.stderr.write(".");sys.stderr.flush()
 
             # Check if we're going to need to mend the next revision
             if page_docs.peek(None) is not None and \
@@ -90,16 +130,13 @@ def mend_diffs(diff_docs, diff_engine, timeout=None, verbose=False):
                 broken_docs = read_broken_docs(page_docs)
                 mended_docs = diff_revisions(broken_docs, processor,
                                              last_id=diff_doc['id'],
-                                             timeout=timeout)
+                                             timeout=timeout, metrics=metrics)
 
                 for mended_doc in mended_docs:
+                    if metrics is not None:
+                        metrics.revision()
+                        metrics.count('mends')
                     yield mended_doc
-                    if verbose: sys.stderr.write("M");sys.stderr.flush()
-
-
-        if verbose: sys.stderr.write("\n")
-
-    if verbose: sys.stderr.write("\n")
 
 
 def read_broken_docs(page_docs):
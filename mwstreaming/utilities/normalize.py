@@ -1,47 +1,115 @@
 """
 Converts a stream of RevisionDocument JSON blobs to JSON blobs that will
-validate against the latest schema (v0.0.2).
+validate against the latest schema (v0.0.3).  The schema version of each blob
+is detected and the blob is upgraded through each later version.
 
 Usage:
     normalize (-h | --help)
-    normalize
+    normalize [--index=<path>] [--pages=<ids>] [--revisions=<ids>]
 
 Options:
     -h|--help          Prints this documentation
+    --index=<path>     Read the documents of the file indexed at this path (see
+                       `index`) rather than <stdin>
+    --pages=<ids>      A comma separated list of page ids to read from
+                       `--index` [default: <all>]
+    --revisions=<ids>  A comma separated list of revision ids to read from
+                       `--index` [default: <all>]
 """
-import json
 import sys
 
 import docopt
 
+from ..pipeline import Writer
+from .index import open_input
 from .util import read_docs
 
 
 def main(argv=None):
     args = docopt.docopt(__doc__, argv=argv)
     
-    run(read_docs(sys.stdin), schema)
+    input_file = open_input(args['--index'], args['--pages'],
+                            args['--revisions'])
+    
+    run(read_docs(input_file))
     
 
 def run(revision_docs):
     
-    for revision_doc in normalize(revision_docs):
-        json.dump(revision_doc, sys.stdout)
-        sys.stdout.write("\n")
+    with Writer(sys.stdout) as output:
+        for revision_doc in normalize(revision_docs):
+            output.write_doc(revision_doc)
 
 def normalize(revision_docs):
     
     for revision_doc in revision_docs:
-        
-        # Converts page.redirect.title to page.redirect_title
-        if 'redirect' in revision_doc['page']:
-            if revision_doc['page']['redirect'] is not None:
-                redirect_title = revision_doc['page']['redirect']['title']
-            else:
-                redirect_title = None
-            
-            del revision_doc['page']['redirect']
-            
-            revision_doc['page']['redirect_title'] = redirect_title
-        
-        yield revision_doc
+        yield upgrade(revision_doc)
+
+def detect_version(revision_doc):
+    if 'redirect' in revision_doc['page']:
+        return "0.0.1"
+    elif 'truncated' in revision_doc:
+        return "0.0.3"
+    else:
+        # v0.0.3 only added the optional 'truncated' field, so a v0.0.3
+        # blob without it is also a valid v0.0.2 blob.
+        return "0.0.2"
+
+def upgrade(revision_doc):
+    """
+    Upgrades `revision_doc` (in place) to the latest schema version.
+    """
+    version = detect_version(revision_doc)
+    for from_version, to_version, upgrade_step in UPGRADES:
+        if version == from_version:
+            upgrade_step(revision_doc)
+            version = to_version
+    
+    return revision_doc
+
+def upgrade_0_0_1(revision_doc):
+    # Converts page.redirect.title to page.redirect_title
+    if revision_doc['page']['redirect'] is not None:
+        redirect_title = revision_doc['page']['redirect']['title']
+    else:
+        redirect_title = None
+    
+    del revision_doc['page']['redirect']
+    
+    revision_doc['page']['redirect_title'] = redirect_title
+    
+    # contributor.id and contributor.user_text became required
+    if revision_doc['contributor'] is not None:
+        revision_doc['contributor'].setdefault('id', None)
+        revision_doc['contributor'].setdefault('user_text', None)
+    
+    # The "equals" diff operation was renamed to "equal".  (Operations also
+    # gained an optional 'tokens' field.)
+    for op in diff_ops(revision_doc):
+        if op.get('name') == "equals":
+            op['name'] = "equal"
+
+def upgrade_0_0_2(revision_doc):
+    # v0.0.3 only added the optional 'truncated' field
+    pass
+
+def diff_ops(revision_doc):
+    """
+    Returns the diff operations of `revision_doc`.  The 'diff' is either a
+    list of operations (as in the schemas) or a document with 'ops' (as
+    written by json2diffs).
+    """
+    diff = revision_doc.get('diff')
+    if isinstance(diff, dict):
+        diff = diff.get('ops')
+    return diff or []
+
+UPGRADES = [
+    ("0.0.1", "0.0.2", upgrade_0_0_1),
+    ("0.0.2", "0.0.3", upgrade_0_0_2)
+]
+"""
+(from version, to version, upgrade function) in version order
+"""
+
+if __name__ == "__main__": main()
@@ -1,7 +1,7 @@
 r"""
 Aggregates a stream of token persistence stats into revision statistics.
 RevisionDocument JSON blobs are printed to <stdout> with an additional
-'stats' field.
+'stats' field.  Reads the output of diffs2persistence in either `--format`.
 
 TODO: Include time visible cutoff
 
@@ -9,7 +9,10 @@ Usage:
     persistence2stats (-h | --help)
     persistence2stats [--min-persisted=<num>] [--min-visible=<days>]
                          [--include=<regex>] [--exclude=<regex>]
+                         [--metrics=<path>] [--metrics-interval=<secs>]
                          [--verbose]
+                         [--index=<path>] [--pages=<ids>] [--revisions=<ids>]
+                         [--threads=<num>]
 
 Options:
     -h|--help              Print this documentation
@@ -23,51 +26,116 @@ Options:
                            [default: <all>]
     --exclude=<regex>      A regex matching tokens to exclude
                            [default: <none>]
-    --verbose              Print out progress information
+    --index=<path>         Read the documents of the file indexed at this path
+                           (see `index`) rather than <stdin>
+    --pages=<ids>          A comma separated list of page ids to read from
+                           `--index` [default: <all>]
+    --revisions=<ids>      A comma separated list of revision ids to read from
+                           `--index` [default: <all>]
+    --threads=<num>        The number of processes to aggregate with.  More
+                           than 1 requires an uncompressed regular file as
+                           input. [default: 1]
+    --metrics=<path>       Write periodic throughput metrics to this file
+                           as JSON lines
+    --metrics-interval=<secs>  The number of seconds between metrics reports
+                               [default: 60]
+    --verbose              Print periodic metrics reports to <stderr>
 """
 import json
+import re
 import sys
-from itertools import groupby
+from functools import partial
+from itertools import chain
 from math import log
 
 import docopt
 
+from ..checkpoint import InputPosition
+from ..compact_persistence import group_revisions
+from ..mapped_input import chunk_lines, map_chunks
+from ..metrics import Metrics
+from ..pipeline import Writer
+from .index import open_input
 from .util import read_docs
 
 
 def main(argv=None):
     args = docopt.docopt(__doc__, argv=argv)
     
+    input_file = open_input(args['--index'], args['--pages'],
+                            args['--revisions'])
+    
     verbose = bool(args['--verbose'])
     
     min_persisted = int(args['--min-persisted'])
     min_visible = float(args['--min-visible'])
     min_visible_secs = min_visible * (60*60*24)
     
-    if args['--include'] == "<all>":
+    threads = int(args['--threads'])
+    
+    position = InputPosition()
+    metrics = Metrics.from_options(args['--metrics'],
+                                   float(args['--metrics-interval']), verbose,
+                                   position=position)
+    
+    if threads > 1:
+        # Chunks hold whole pages, so they can be aggregated independently.
+        process = partial(stats_chunk, min_persisted, min_visible_secs,
+                          args['--include'], args['--exclude'])
+        revision_docs = chain.from_iterable(
+            map_chunks(input_file, process, threads, align_pages=True,
+                       position=position))
+    else:
+        include, exclude = token_filters(args['--include'],
+                                         args['--exclude'])
+        revision_docs = persistence2stats(
+            read_docs(input_file, position=position), min_persisted,
+            min_visible_secs, include, exclude)
+    
+    run(revision_docs, metrics)
+
+def token_filters(include_pattern, exclude_pattern):
+    """
+    Returns `include` and `exclude` functions for the `--include` and
+    `--exclude` options.
+    """
+    if include_pattern == "<all>":
         include = lambda t: True
     else:
-        include_re = re.compile(args['--include'], re.UNICODE)
+        include_re = re.compile(include_pattern, re.UNICODE)
         include = lambda t: bool(include_re.search(t))
         
-    if args['--exclude'] == "<none>":
+    if exclude_pattern == "<none>":
         exclude = lambda t: False
     else:
-        exclude_re = re.compile(args['--exclude'], re.UNICODE)
+        exclude_re = re.compile(exclude_pattern, re.UNICODE)
         exclude = lambda t: bool(exclude_re.search(t))
     
-    run(read_docs(sys.stdin), min_persisted, min_visible_secs, include, exclude, verbose)
+    return include, exclude
 
-def run(persistence_docs, min_persisted, min_visible_secs, include, exclude, verbose):
+def stats_chunk(min_persisted, min_visible_secs, include_pattern,
+                exclude_pattern, chunk):
+    include, exclude = token_filters(include_pattern, exclude_pattern)
+    persistence_docs = (json.loads(line.split("\t")[0])
+                        for line in chunk_lines(chunk))
+    return list(persistence2stats(persistence_docs, min_persisted,
+                                  min_visible_secs, include, exclude))
+
+def run(revision_docs, metrics):
+    
+    with Writer(sys.stdout, metrics) as output:
+        for revision_doc in revision_docs:
+            output.write_doc(revision_doc)
+            if metrics is not None: metrics.revision()
     
-    revision_persistence_docs = groupby(persistence_docs,
-                                        key=lambda p:p['revision'])
+    if metrics is not None: metrics.close()
+
+def persistence2stats(persistence_docs, min_persisted, min_visible_secs,
+                      include=lambda t: True, exclude=lambda t: False):
+    
+    revision_persistence_docs = group_revisions(persistence_docs)
     
     for revision_doc, persistence_docs in revision_persistence_docs:
-        if verbose:
-            sys.stderr.write("{0} ({1}): " \
-                             .format(revision_doc['page']['title']),
-                                     revision_doc['id'])
         stats_doc = {
             'tokens_added': 0,
             'tokens_persisted': 0,
@@ -81,7 +149,6 @@ def run(persistence_docs, min_persisted, min_visible_secs, include, exclude, ver
         filtered_docs = (p for p in persistence_docs
                          if include(p['token']) and not exclude(p['token']))
         for persistence_doc in filtered_docs:
-            if verbose: sys.stderr.write(".")
             
             stats_doc['tokens_added'] += 1
             stats_doc['sum_log_persisted'] += log(persistence_doc['persisted']+1)
@@ -112,9 +179,6 @@ def run(persistence_docs, min_persisted, min_visible_secs, include, exclude, ver
                     if persistence_doc['non_self_processed'] < min_persisted:
                         stats_doc['non_self_censored'] = True
             
-        if verbose: sys.stderr.write("\n")
-        
         revision_doc['persistence_stats'] = stats_doc
         
-        json.dump(revision_doc, sys.stdout)
-        sys.stdout.write("\n")
+        yield revision_doc
@@ -0,0 +1,271 @@
+"""
+Plans a multi-file run.  Quickly estimates the cost of processing each input
+file (an XML dump or a file of RevisionDocument JSON lines, either of which
+may be compressed) and assigns files to workers so that the largest files
+start first and every worker gets a similar amount of work.
+
+Only the first `--sample-bytes` of each file (after decompression) are read.
+The numbers of pages and revisions and the bytes of text seen in the sample
+are scaled up by the proportion of the (compressed) file that the sample
+covers.  7z files can't be sampled, so their cost is estimated from their
+size alone.  The cost of a page is its text bytes plus a fixed cost per
+revision.  The largest pages in each sample are reported, since a file can't
+finish before its largest page does.
+
+Writes a JSON plan document to <stdout>.  The files of the plan are ordered
+largest-first and bin-packed into `--workers` shards.  `dump2json` and
+`dump2diffs` can read their <dump_file>s from a plan with `--plan` (and only
+process one of its shards with `--shard`).  A summary is written to <stderr>.
+
+$ plan pages-meta-history*.xml.bz2 --workers=16 > plan.json
+$ dump2diffs --plan=plan.json --config=conf.yaml --threads=16 > diffs.json
+
+Usage:
+    plan (-h|--help)
+    plan <input_file>... [--workers=<num>] [--sample-bytes=<num>]
+                         [--revision-cost=<bytes>] [--largest-pages=<num>]
+
+Options:
+    -h|--help                Print this documentation
+    <input_file>             The path of an XML dump or JSON lines file
+    --workers=<num>          The number of workers to plan for
+                             [default: <cpu_count>]
+    --sample-bytes=<num>     The number of (decompressed) bytes of each file
+                             to read [default: 16777216]
+    --revision-cost=<bytes>  The cost of a revision in addition to its text
+                             (in bytes of text) [default: 2048]
+    --largest-pages=<num>    The number of the largest sampled pages to report
+                             per file [default: 5]
+"""
+import heapq
+import json
+import os
+import re
+import sys
+from multiprocessing import cpu_count
+
+import docopt
+
+READ_SIZE = 2 ** 20
+
+SEVEN_ZIP_RATIO = 50
+"""
+The approximate ratio of decompressed to compressed bytes of a 7z history
+dump.
+"""
+
+PAGE_RE = re.compile(rb"<page>")
+REVISION_RE = re.compile(rb"<revision>")
+ID_RE = re.compile(rb"<id>(\d+)</id>")
+TITLE_RE = re.compile(rb"<title>([^<]*)</title>")
+
+
+def main(argv=None):
+    args = docopt.docopt(__doc__, argv=argv)
+
+    if args['--workers'] == "<cpu_count>":
+        workers = cpu_count()
+    else:
+        workers = int(args['--workers'])
+
+    plan = plan_files(args['<input_file>'], workers,
+                      sample_bytes=int(args['--sample-bytes']),
+                      revision_cost=float(args['--revision-cost']),
+                      largest_pages=int(args['--largest-pages']))
+
+    json.dump(plan, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+    sys.stderr.write(("Planned {0} file(s) for {1} worker(s).  " +
+                      "Estimated makespan: {2:.1%} of total cost / workers.\n")
+                     .format(len(plan['files']), workers,
+                             plan['makespan'] /
+                             max(plan['total_cost'] / workers, 1)))
+
+def plan_files(paths, workers, sample_bytes=2 ** 24, revision_cost=2048,
+               largest_pages=5):
+    """
+    Estimates the cost of each file in `paths` and plans a run with
+    `workers`.
+    """
+    files = [estimate_file(path, sample_bytes, revision_cost, largest_pages)
+             for path in paths]
+    files.sort(key=lambda f: f['cost'], reverse=True)
+
+    shards = pack(files, workers)
+
+    return {
+        'workers': workers,
+        'total_cost': sum(f['cost'] for f in files),
+        'makespan': max((s['cost'] for s in shards), default=0),
+        'order': [f['path'] for f in files],
+        'shards': shards,
+        'files': files
+    }
+
+def pack(files, workers):
+    """
+    Assigns `files` (in the order given) to the least loaded of `workers`
+    shards.  Files are expected to be ordered largest-first.
+    """
+    shards = [{'worker': i, 'cost': 0, 'files': []} for i in range(workers)]
+    loads = [(0, i) for i in range(workers)]
+    for f in files:
+        cost, i = heapq.heappop(loads)
+        shards[i]['cost'] += f['cost']
+        shards[i]['files'].append(f['path'])
+        heapq.heappush(loads, (shards[i]['cost'], i))
+
+    return shards
+
+def estimate_file(path, sample_bytes, revision_cost, largest_pages):
+    """
+    Estimates the pages, revisions, text bytes and cost of the file at `path`
+    from a sample of its head.
+    """
+    size = os.path.getsize(path)
+    if path.endswith(".7z"):
+        # Can't be decompressed incrementally.  Assume a typical ratio.
+        sample, consumed = None, 0
+    else:
+        sample, consumed = read_sample(path, sample_bytes)
+
+    if sample is None or consumed == 0:
+        pages, revisions, text_bytes = [], 0, size * SEVEN_ZIP_RATIO
+        scale = 1
+    else:
+        pages = sample_pages(sample)
+        revisions = sum(p['revisions'] for p in pages)
+        text_bytes = len(sample)
+        scale = size / consumed
+
+    for page in pages:
+        page['cost'] = page['bytes'] + revision_cost * page['revisions']
+    pages.sort(key=lambda p: p['cost'], reverse=True)
+
+    return {
+        'path': path,
+        'bytes': size,
+        'sampled': consumed / size if size > 0 else 1,
+        'pages': round(len(pages) * scale),
+        'revisions': round(revisions * scale),
+        'text_bytes': round(text_bytes * scale),
+        'cost': round((text_bytes + revision_cost * revisions) * scale),
+        'largest_pages': pages[:largest_pages]
+    }
+
+def read_sample(path, sample_bytes):
+    """
+    Reads at least `sample_bytes` of decompressed data (if available) from the
+    head of the file at `path`.  Returns the sample and the number of
+    (compressed) bytes of the file that it covers.
+    """
+    decompressor = open_decompressor(path)
+    chunks = []
+    length = 0
+    consumed = 0
+    with open(path, "rb") as f:
+        while length < sample_bytes:
+            raw = f.read(READ_SIZE)
+            if len(raw) == 0:
+                break
+            consumed += len(raw)
+            chunk = decompressor(raw)
+            chunks.append(chunk)
+            length += len(chunk)
+
+    return b"".join(chunks), consumed
+
+def open_decompressor(path):
+    """
+    Returns a function that decompresses successive raw chunks of the file at
+    `path` based on its extension.
+    """
+    if path.endswith(".bz2"):
+        import bz2
+        new_decompressor = bz2.BZ2Decompressor
+    elif path.endswith(".gz"):
+        import zlib
+        new_decompressor = lambda: zlib.decompressobj(zlib.MAX_WBITS | 32)
+    elif path.endswith(".lzma") or path.endswith(".xz"):
+        import lzma
+        new_decompressor = lzma.LZMADecompressor
+    else:
+        return lambda raw: raw
+
+    decompressors = [new_decompressor()]
+    def decompress(raw):
+        chunks = []
+        while len(raw) > 0:
+            decompressor = decompressors[0]
+            chunks.append(decompressor.decompress(raw))
+            if decompressor.eof:
+                # Files that are compressed in parallel have several streams
+                raw = decompressor.unused_data
+                decompressors[0] = new_decompressor()
+            else:
+                raw = b""
+        return b"".join(chunks)
+
+    return decompress
+
+def sample_pages(sample):
+    """
+    Returns a dict of the `id`, `title`, `revisions` and `bytes` of each page
+    in a sample of an XML dump or of JSON lines.
+    """
+    if sample.lstrip()[:1] == b"{":
+        return json_pages(sample)
+    else:
+        return xml_pages(sample)
+
+def xml_pages(sample):
+    pages = []
+    starts = [m.start() for m in PAGE_RE.finditer(sample)]
+    for start, end in zip(starts, starts[1:] + [len(sample)]):
+        page_xml = sample[start:end]
+        id_match = ID_RE.search(page_xml)
+        title_match = TITLE_RE.search(page_xml)
+        pages.append({
+            'id': int(id_match.group(1)) if id_match else None,
+            'title': str(title_match.group(1), 'utf-8', 'replace')
+                     if title_match else None,
+            'revisions': len(REVISION_RE.findall(page_xml)),
+            'bytes': len(page_xml)
+        })
+    return pages
+
+def json_pages(sample):
+    pages = []
+    page = None
+    # The last line is likely to be cut off.
+    for line in sample.split(b"\n")[:-1]:
+        if len(line.strip()) == 0:
+            continue
+        doc_page = json.loads(str(line, 'utf-8'))['page']
+        if page is None or page['id'] != doc_page['id']:
+            page = {'id': doc_page['id'], 'title': doc_page.get('title'),
+                    'revisions': 0, 'bytes': 0}
+            pages.append(page)
+        page['revisions'] += 1
+        page['bytes'] += len(line)
+    return pages
+
+def load_plan(path, shard=None):
+    """
+    Returns the files of a plan written by this utility, largest-first, or
+    only the files of a `shard`.  A shard can have no files when there are
+    fewer files than workers.
+    """
+    plan = json.load(open(path))
+    if shard is None:
+        return plan['order']
+    elif not 0 <= shard < len(plan['shards']):
+        raise RuntimeError("--shard={0} is not a shard of the plan.  "
+                           .format(shard) +
+                           "Expected 0 to {0}.".format(len(plan['shards']) - 1))
+    else:
+        return plan['shards'][shard]['files']
+
+
+if __name__ == "__main__": main()
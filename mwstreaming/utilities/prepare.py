@@ -0,0 +1,119 @@
+"""
+Prepares a stream of RevisionDocument JSON blobs for diffing in a single pass.
+Each blob is decoded once, upgraded to the latest schema (see normalize), has
+its 'text' truncated to `--max-chars` (see truncate_text) and, if a `--schema`
+is provided, is validated (see validate) before it is encoded once.
+
+$ bzcat old_revisions.json.bz2 | \\
+  prepare --schema=revision_document-0.0.3.json | \\
+  json2diffs --config=conf.yaml | bzip2 -c > diffs.json.bz2
+
+Usage:
+    prepare (-h|--help)
+    prepare [--max-chars=<num>] [--max-bytes=<num>] [--schema=<path>]
+            [--max-errors=<num>] [--metrics=<path>]
+            [--metrics-interval=<secs>] [--verbose]
+            [--index=<path>] [--pages=<ids>] [--revisions=<ids>]
+
+Options:
+    -h|--help          Print this documentation
+    --max-chars=<num>  The maximum number of characters that are allowed in a
+                       'text' field. [default: 2097152]
+    --max-bytes=<num>  The maximum number of bytes of a 'text' field (as
+                       JSON) to read.  Longer texts are cut down as they are
+                       read.  Lines with more bytes than this outside of
+                       'text' are an error. [default: <none>]
+    --schema=<path>    The path of a JSON schema to validate against
+    --max-errors=<num>  The number of invalid documents to report and drop
+                        before stopping [default: 0]
+    --index=<path>     Read the documents of the file indexed at this path (see
+                       `index`) rather than <stdin>
+    --pages=<ids>      A comma separated list of page ids to read from
+                       `--index` [default: <all>]
+    --revisions=<ids>  A comma separated list of revision ids to read from
+                       `--index` [default: <all>]
+    --metrics=<path>   Write periodic throughput metrics to this file as JSON
+                       lines
+    --metrics-interval=<secs>  The number of seconds between metrics reports
+                               [default: 60]
+    --verbose          Print periodic metrics reports to <stderr>
+"""
+import json
+import sys
+
+import docopt
+
+from ..checkpoint import InputPosition
+from ..metrics import Metrics
+from ..pipeline import Writer
+from ..validation import SchemaValidator, format_error
+from .index import open_input
+from .normalize import normalize
+from .truncate_text import truncate_text
+from .util import read_docs
+
+
+def main(argv=None):
+    args = docopt.docopt(__doc__, argv=argv)
+
+    input_file = open_input(args['--index'], args['--pages'],
+                            args['--revisions'])
+
+    max_chars = int(args['--max-chars'])
+
+    if args['--max-bytes'] == "<none>":
+        max_bytes = None
+    else:
+        max_bytes = int(args['--max-bytes'])
+
+    if args['--schema'] is not None:
+        validator = SchemaValidator(json.load(open(args['--schema'])))
+    else:
+        validator = None
+
+    max_errors = int(args['--max-errors'])
+    verbose = bool(args['--verbose'])
+
+    position = InputPosition()
+    metrics = Metrics.from_options(args['--metrics'],
+                                   float(args['--metrics-interval']), verbose,
+                                   position=position)
+
+    run(read_docs(input_file, position=position, max_bytes=max_bytes),
+        max_chars, validator, max_errors, metrics)
+
+def run(revision_docs, max_chars, validator, max_errors, metrics):
+
+    errors = 0
+    last_page_id = None
+    with Writer(sys.stdout, metrics) as output:
+        for revision_doc in prepare(revision_docs, max_chars):
+            if validator is not None:
+                error = validator.error(revision_doc)
+                if error is not None:
+                    errors += 1
+                    if metrics is not None: metrics.count('invalid')
+                    sys.stderr.write("Invalid document {0}: {1}\n"
+                                     .format(revision_doc.get('id'),
+                                             format_error(error)))
+                    if errors > max_errors:
+                        raise RuntimeError(
+                            "Stopping after {0} invalid document(s)."
+                            .format(errors))
+                    continue
+
+            output.write_doc(revision_doc)
+            if metrics is not None:
+                if revision_doc['page']['id'] != last_page_id:
+                    metrics.page()
+                    last_page_id = revision_doc['page']['id']
+                if revision_doc['truncated']: metrics.count('truncated')
+                metrics.revision()
+
+    if metrics is not None: metrics.close()
+
+def prepare(revision_docs, max_chars):
+
+    return truncate_text(normalize(revision_docs), max_chars)
+
+if __name__ == "__main__": main()
@@ -0,0 +1,413 @@
+"""
+Runs a local diff service.  RevisionDocument JSON blobs are accepted one per
+line over TCP (the default), a unix socket (`--unix`) or HTTP (`--http`) and
+returned in order with an additional 'diff' field.  Processors are kept per
+page (see `json2diffs --interleaved`), so the revisions of a page must be sent
+in the order they were saved.  Revisions that are not newer than the last
+revision processed for their page are returned with a null 'diff'.
+
+Diffing is done in a pool of `--workers` processes.  Pages are assigned to
+workers by page id so that each worker keeps the processors of its pages.  In
+`--http` mode, revisions are POSTed as a body of JSON lines and throughput and
+latency counters are available from `GET /stats`.
+
+$ mwstream serve --config=conf.yaml --port=8910 --verbose &
+$ nc localhost 8910 < revisions.json > diffs.json
+
+Usage:
+    serve (-h|--help)
+    serve --config=<path> [--host=<host>] [--port=<num>] [--unix=<path>]
+                          [--http] [--workers=<num>] [--cache-size=<mb>]
+                          [--timeout=<secs>] [--drop-text]
+                          [--stats-interval=<secs>] [--verbose]
+
+Options:
+    -h|--help               Print this documentation
+    --config=<path>         The path to difference detection configuration
+    --host=<host>           The interface to listen on [default: 127.0.0.1]
+    --port=<num>            The TCP port to listen on [default: 8910]
+    --unix=<path>           Listen on a unix socket at this path instead of a
+                            TCP port
+    --http                  Speak HTTP rather than plain JSON lines
+    --workers=<num>         The number of diffing processes.  0 diffs in the
+                            serving process.  [default: <cpu_count>]
+    --cache-size=<mb>       The approximate memory budget for cached
+                            processors per worker (in MB) [default: 1024]
+    --timeout=<secs>        The maximum time a diff can run in seconds before
+                            being cancelled.  [default: <infinity>]
+    --drop-text             Drops the 'text' field from the JSON blob
+    --stats-interval=<secs>  How often to write counters to <stderr> when
+                             `--verbose` [default: 60]
+    --verbose               Print out progress information
+"""
+import asyncio
+import json
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import cpu_count, get_context
+from multiprocessing.util import Finalize
+
+import docopt
+
+from ..processor_cache import ProcessorCache
+from .json2diffs import diff_revision
+from .util import load_diff_engine
+
+MAX_LINE = 2 ** 30
+"""
+The largest JSON line that will be accepted (in bytes).  Longer lines are
+skipped and answered with an error.
+"""
+
+TOO_LONG = object()
+
+WORKER = None
+
+
+def main(argv=None):
+    args = docopt.docopt(__doc__, argv=argv)
+
+    diff_engine = load_diff_engine(args['--config'])
+
+    host = args['--host']
+    port = int(args['--port'])
+    unix_path = args['--unix']
+    http = bool(args['--http'])
+
+    if args['--workers'] == "<cpu_count>":
+        workers = cpu_count()
+    else:
+        workers = int(args['--workers'])
+
+    cache_size = float(args['--cache-size']) * 1024 * 1024
+
+    if args['--timeout'] == "<infinity>":
+        timeout = None
+    else:
+        timeout = float(args['--timeout'])
+
+    drop_text = bool(args['--drop-text'])
+    stats_interval = float(args['--stats-interval'])
+    verbose = bool(args['--verbose'])
+
+    run(diff_engine, host, port, unix_path, http, workers, cache_size,
+        timeout, drop_text, stats_interval, verbose)
+
+def run(diff_engine, host, port, unix_path, http, workers, cache_size,
+        timeout, drop_text, stats_interval, verbose):
+
+    service = DiffService(diff_engine, workers, cache_size, timeout, drop_text)
+    try:
+        asyncio.run(serve(service, host, port, unix_path, http,
+                          stats_interval, verbose))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+async def serve(service, host, port, unix_path, http, stats_interval,
+                verbose):
+    handler = service.handle_http if http else service.handle_lines
+
+    if unix_path is not None:
+        server = await asyncio.start_unix_server(handler, unix_path,
+                                                 limit=MAX_LINE)
+    else:
+        server = await asyncio.start_server(handler, host, port,
+                                            limit=MAX_LINE)
+
+    if verbose:
+        sys.stderr.write("Listening on {0}\n".format(
+            unix_path or ", ".join(str(s.getsockname())
+                                   for s in server.sockets)))
+        asyncio.ensure_future(log_stats(service.stats, stats_interval))
+
+    async with server:
+        await server.serve_forever()
+
+async def log_stats(stats, interval):
+    while True:
+        await asyncio.sleep(interval)
+        sys.stderr.write(json.dumps(stats.report()) + "\n")
+        sys.stderr.flush()
+
+
+class DiffService:
+    """
+    Diffs revision documents in a set of single-process executors.  Each page
+    is always routed to the same executor so that its processor can be
+    re-used and its revisions are processed in the order they arrived.
+    """
+    def __init__(self, diff_engine, workers, cache_size, timeout=None,
+                 drop_text=False):
+        initargs = (diff_engine, cache_size, timeout, drop_text)
+        if workers == 0:
+            init_worker(*initargs)
+            self.executors = None
+        else:
+            # Workers are spawned rather than forked so that they don't
+            # inherit (and hold open) client connections.
+            self.executors = [ProcessPoolExecutor(1, get_context("spawn"),
+                                                  initializer=init_worker,
+                                                  initargs=initargs)
+                              for _ in range(workers)]
+
+        self.stats = ServiceStats()
+
+    async def process_line(self, line):
+        start = time.perf_counter()
+        try:
+            revision_doc = json.loads(str(line, 'utf-8'))
+            if self.executors is None:
+                diff_line = process_revision(revision_doc)
+            else:
+                executor = self.executors[
+                    hash(revision_doc['page']['id']) % len(self.executors)]
+                loop = asyncio.get_running_loop()
+                diff_line = await loop.run_in_executor(
+                    executor, process_revision, revision_doc)
+        except Exception as e:
+            self.stats.errors += 1
+            diff_line = json.dumps({'error': "{0}: {1}".format(
+                                        e.__class__.__name__, e)})
+
+        self.stats.record(len(line), len(diff_line),
+                          time.perf_counter() - start)
+        return diff_line
+
+    async def reject_line(self):
+        self.stats.errors += 1
+        return json.dumps({'error': "ValueError: Line is too long"})
+
+    async def handle_lines(self, reader, writer):
+        pending = asyncio.Queue(maxsize=1000)
+
+        async def respond():
+            while True:
+                task = await pending.get()
+                if task is None:
+                    break
+                writer.write((await task).encode('utf-8') + b"\n")
+                await writer.drain()
+
+        responder = asyncio.ensure_future(respond())
+        while True:
+            line = await read_line(reader)
+            if line is TOO_LONG:
+                await pending.put(asyncio.ensure_future(self.reject_line()))
+            elif not line:
+                break
+            elif line.strip():
+                # Tasks are created in order, so responses will be too
+                await pending.put(asyncio.ensure_future(
+                    self.process_line(line)))
+
+        await pending.put(None)
+        await responder
+        writer.close()
+
+    async def handle_http(self, reader, writer):
+        while True:
+            try:
+                request = await read_request(reader)
+            except HTTPError as e:
+                # The rest of the stream can't be trusted to be in sync
+                await write_response(writer, e.status,
+                                     json.dumps({'error': str(e)}) + "\n",
+                                     close=True)
+                break
+            if request is None:
+                break
+            method, path, version, headers, body = request
+
+            if method == "GET" and path == "/stats":
+                status = "200 OK"
+                payload = json.dumps(self.stats.report()) + "\n"
+            elif method == "POST":
+                status = "200 OK"
+                diff_lines = await asyncio.gather(
+                    *(self.process_line(line) for line in body.split(b"\n")
+                      if line.strip()))
+                payload = "".join(l + "\n" for l in diff_lines)
+            else:
+                status = "404 Not Found"
+                payload = json.dumps({'error': "Not found"}) + "\n"
+
+            await write_response(writer, status, payload)
+
+            if version == "HTTP/1.0" or \
+               headers.get('connection', "").lower() == "close":
+                break
+
+        writer.close()
+
+    def close(self):
+        if self.executors is not None:
+            for executor in self.executors:
+                executor.shutdown()
+
+
+async def read_line(reader):
+    """
+    Reads a line from `reader`.  Returns `TOO_LONG` (having skipped the line)
+    if the line doesn't fit in the reader's limit and an empty `bytes` at the
+    end of the stream.
+    """
+    try:
+        return await reader.readuntil(b"\n")
+    except asyncio.IncompleteReadError as e:
+        return e.partial
+    except asyncio.LimitOverrunError as e:
+        consumed = e.consumed
+
+    # Skip the rest of the line
+    while True:
+        await reader.read(consumed)
+        try:
+            await reader.readuntil(b"\n")
+        except asyncio.IncompleteReadError:
+            pass
+        except asyncio.LimitOverrunError as e:
+            consumed = e.consumed
+            continue
+        return TOO_LONG
+
+
+class HTTPError(Exception):
+    """
+    A malformed request that is answered with `status`.
+    """
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+async def read_request(reader):
+    """
+    Reads an HTTP request from `reader` and returns (`method`, `path`,
+    `version`, `headers`, `body`) or `None` at the end of the stream.  Raises
+    :class:`HTTPError` for malformed requests and bodies longer than
+    `MAX_LINE`.
+    """
+    try:
+        request_line = await reader.readline()
+        if not request_line.strip():
+            return None
+        try:
+            method, path, version = str(request_line, 'latin-1').split()
+        except ValueError:
+            raise HTTPError("400 Bad Request", "Malformed request line")
+
+        headers = {}
+        while True:
+            header = await reader.readline()
+            if not header.strip():
+                break
+            if b":" not in header:
+                raise HTTPError("400 Bad Request", "Malformed header")
+            key, value = str(header, 'latin-1').split(":", 1)
+            headers[key.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise HTTPError("400 Bad Request", "Malformed Content-Length")
+        if length < 0:
+            raise HTTPError("400 Bad Request", "Malformed Content-Length")
+        elif length > MAX_LINE:
+            raise HTTPError("413 Payload Too Large",
+                            "Bodies are limited to {0} bytes"
+                            .format(MAX_LINE))
+
+        body = await reader.readexactly(length)
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+            ValueError):
+        # Truncated or longer than the reader's limit
+        raise HTTPError("400 Bad Request", "Malformed request")
+
+    return method, path, version, headers, body
+
+async def write_response(writer, status, payload, close=False):
+    payload = payload.encode('utf-8')
+    writer.write("HTTP/1.1 {0}\r\n".format(status).encode('latin-1') +
+                 b"Content-Type: application/x-ndjson\r\n" +
+                 (b"Connection: close\r\n" if close else b"") +
+                 "Content-Length: {0}\r\n\r\n"
+                 .format(len(payload)).encode('latin-1') +
+                 payload)
+    await writer.drain()
+
+
+class ServiceStats:
+    """
+    Counts revisions, bytes, errors and latency.  Latency percentiles are
+    computed over the last `sample_size` revisions.
+    """
+    def __init__(self, sample_size=10000):
+        self.start = time.time()
+        self.revisions = 0
+        self.errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.latencies = deque(maxlen=sample_size)
+
+    def record(self, bytes_in, bytes_out, latency):
+        self.revisions += 1
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+        self.latencies.append(latency)
+
+    def report(self):
+        elapsed = time.time() - self.start
+        latencies = sorted(self.latencies)
+        if len(latencies) > 0:
+            latency = {
+                'mean': sum(latencies) / len(latencies),
+                'p50': latencies[int(len(latencies) * 0.50)],
+                'p90': latencies[int(len(latencies) * 0.90)],
+                'p99': latencies[int(len(latencies) * 0.99)],
+                'max': latencies[-1]
+            }
+        else:
+            latency = None
+
+        return {
+            'uptime': elapsed,
+            'revisions': self.revisions,
+            'errors': self.errors,
+            'revisions_per_sec': self.revisions / elapsed if elapsed else 0,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'latency': latency
+        }
+
+
+class Worker:
+    def __init__(self, diff_engine, cache_size, timeout, drop_text):
+        self.processor_cache = ProcessorCache(diff_engine, cache_size)
+        self.timeout = timeout
+        self.drop_text = drop_text
+
+    def process(self, revision_doc):
+        diff_doc = diff_revision(revision_doc, self.processor_cache,
+                                 timeout=self.timeout)
+        if diff_doc is None:
+            # Not newer than the last revision we saw for this page
+            diff_doc = revision_doc
+            diff_doc['diff'] = None
+
+        if self.drop_text:
+            diff_doc.pop('text', None)
+
+        return json.dumps(diff_doc)
+
+def init_worker(diff_engine, cache_size, timeout, drop_text):
+    global WORKER
+    WORKER = Worker(diff_engine, cache_size, timeout, drop_text)
+    Finalize(WORKER, WORKER.processor_cache.close, exitpriority=10)
+
+def process_revision(revision_doc):
+    return WORKER.process(revision_doc)
+
+if __name__ == "__main__": main()
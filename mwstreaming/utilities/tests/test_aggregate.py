@@ -0,0 +1,92 @@
+import random
+import tempfile
+
+from nose.tools import eq_
+
+from .. import aggregate as aggregate_module
+from ..aggregate import SpillingAggregator, aggregate
+
+
+def stats_docs():
+    random_ = random.Random(0)
+    docs = []
+    for i in range(500):
+        docs.append({
+            'id': i,
+            'page': {'id': random_.randint(1, 20)},
+            'contributor': {'user_text': "User{0}".format(
+                                             random_.randint(1, 50))},
+            'persistence_stats': {
+                'tokens_added': random_.randint(0, 10),
+                'tokens_persisted': random_.randint(0, 10),
+                'censored': random_.random() < 0.5
+            }
+        })
+    return docs
+
+def test_aggregate():
+    docs = [
+        {'contributor': {'user_text': "Foo"}, 'page': {'id': 1},
+         'persistence_stats': {'tokens_added': 3, 'censored': True}},
+        {'contributor': {'user_text': "Bar"}, 'page': {'id': 1},
+         'persistence_stats': {'tokens_added': 2, 'censored': False}},
+        {'contributor': {'user_text': "Foo"}, 'page': {'id': 2},
+         'persistence_stats': {'tokens_added': 1, 'censored': False}},
+        {'contributor': {}, 'page': {'id': 2},
+         'persistence_stats': {'tokens_added': 4}}
+    ]
+    fields = ["persistence_stats.tokens_added", "persistence_stats.censored"]
+
+    eq_(list(aggregate(docs, ["contributor.user_text"], fields)),
+        [{'contributor': {'user_text': "Bar"}, 'revisions': 1,
+          'persistence_stats': {'tokens_added': 2, 'censored': 0}},
+         {'contributor': {'user_text': "Foo"}, 'revisions': 2,
+          'persistence_stats': {'tokens_added': 4, 'censored': 1}},
+         {'contributor': {'user_text': None}, 'revisions': 1,
+          'persistence_stats': {'tokens_added': 4, 'censored': 0}}])
+
+    eq_([(d['page']['id'], d['contributor']['user_text'], d['revisions'])
+         for d in aggregate(docs, ["page.id", "contributor.user_text"], [])],
+        [(1, "Bar", 1), (1, "Foo", 1), (2, "Foo", 1), (2, None, 1)])
+
+def test_not_numeric():
+    docs = [{'page': {'id': 1, 'title': "Foo"}},
+            {'page': {'id': 2, 'title': None}}]
+    try:
+        list(aggregate(reversed(docs), ["page.id"], ["page.title"]))
+    except RuntimeError as e:
+        eq_("Document 2" in str(e) and "'page.title'" in str(e) and
+            "'Foo'" in str(e), True)
+    else:
+        raise AssertionError("Expected a RuntimeError")
+
+def test_spill():
+    docs = stats_docs()
+    keys = ["contributor.user_text", "page.id"]
+    fields = ["persistence_stats.tokens_added",
+              "persistence_stats.tokens_persisted",
+              "persistence_stats.censored"]
+
+    expected = list(aggregate(docs, keys, fields))
+
+    max_merge = aggregate_module.MAX_MERGE
+    aggregate_module.MAX_MERGE = 3
+    try:
+        # Small enough to spill every few groups
+        eq_(list(aggregate(docs, keys, fields, max_memory=1000)), expected)
+
+        aggregator = SpillingAggregator(1, 1000, tempfile.mkdtemp())
+        for doc in docs:
+            aggregator.add(str(doc['page']['id']),
+                           [doc['persistence_stats']['tokens_added']])
+        eq_(aggregator.spilled > aggregate_module.MAX_MERGE, True)
+        # Files are merged in tiers
+        eq_(len(aggregator.tiers) > 2, True)
+        eq_(all(len(files) < aggregate_module.MAX_MERGE
+                for files in aggregator.tiers), True)
+        eq_(sum(sums[0] for _, sums in aggregator.groups()), len(docs))
+        eq_(len(aggregator.tiers[0]) <= aggregate_module.MAX_MERGE, True)
+    finally:
+        aggregate_module.MAX_MERGE = max_merge
+
+    eq_(sum(doc['revisions'] for doc in expected), len(docs))
@@ -0,0 +1,111 @@
+import os
+import tempfile
+
+from mw import Timestamp
+from nose.tools import eq_
+
+from ...state import StateStore
+from ..diffs2persistence import WindowBudget, token_persistence
+
+
+def revision_docs():
+    return [
+        {'id': 1, 'sha1': "aaa", 'timestamp': "2015-01-01T00:00:00Z",
+         'page': {'id': 10, 'title': "Foo"}, 'contributor': {'id': 1},
+         'diff': {'ops': [{'name': "insert", 'a1': 0, 'a2': 0, 'b1': 0,
+                           'b2': 2, 'tokens': ["foo", " "]}]}},
+        {'id': 2, 'sha1': "bbb", 'timestamp': "2015-01-02T00:00:00Z",
+         'page': {'id': 10, 'title': "Foo"}, 'contributor': {'id': 2},
+         'diff': {'ops': [{'name': "equal", 'a1': 0, 'a2': 2, 'b1': 0,
+                           'b2': 2},
+                          {'name': "insert", 'a1': 2, 'a2': 2, 'b1': 2,
+                           'b2': 3, 'tokens': ["bar"]}]}},
+        {'id': 3, 'sha1': "aaa", 'timestamp': "2015-01-03T00:00:00Z",
+         'page': {'id': 10, 'title': "Foo"}, 'contributor': {'id': 1},
+         'diff': {'ops': [{'name': "equal", 'a1': 0, 'a2': 2, 'b1': 0,
+                           'b2': 2},
+                          {'name': "delete", 'a1': 2, 'a2': 3, 'b1': 2,
+                           'b2': 2, 'tokens': ["bar"]}]}},
+        {'id': 4, 'sha1': "ccc", 'timestamp': "2015-01-04T00:00:00Z",
+         'page': {'id': 10, 'title': "Foo"}, 'contributor': {'id': 3},
+         'diff': {'ops': [{'name': "equal", 'a1': 0, 'a2': 2, 'b1': 0,
+                           'b2': 2},
+                          {'name': "insert", 'a1': 2, 'a2': 2, 'b1': 2,
+                           'b2': 3, 'tokens': ["baz"]}]}}
+    ]
+
+def stats_by_revision(docs, **kwargs):
+    sunset = Timestamp("2015-02-01T00:00:00Z")
+    return {doc['id']: list(token_stats)
+            for doc, token_stats in token_persistence(docs, 2, 15, sunset,
+                                                      **kwargs)}
+
+def test_verbose():
+    sunset = Timestamp("2015-02-01T00:00:00Z")
+    verbose_stats = {doc['id']: list(token_stats)
+                     for doc, token_stats in token_persistence(
+                         revision_docs(), 2, 15, sunset, True)}
+
+    eq_(verbose_stats, stats_by_revision(revision_docs()))
+
+def test_incremental():
+    expected = stats_by_revision(revision_docs())
+
+    path = os.path.join(tempfile.mkdtemp(), "states.db")
+    state_store = StateStore(path, "persistence")
+    first = stats_by_revision(revision_docs()[:2], state_store=state_store)
+    second = stats_by_revision(revision_docs(), state_store=state_store)
+    state_store.close()
+
+    eq_(set(first), {1, 2})
+    eq_(set(second), {1, 2, 3, 4}) # 1 & 2 were still in the window
+    first.update(second)
+    eq_(first, expected)
+
+def test_max_memory():
+    # The stats of the first revision are generated as soon as the window
+    # holds more than one token's worth of state and `min_size` revisions.
+    window_budget = WindowBudget(3, min_size=2,
+                                 max_bytes=WindowBudget.TOKEN_BYTES)
+    docs = revision_docs()
+    processed = {doc['id']: (doc['window'], [ts['processed'] for ts in stats])
+                 for doc, stats in
+                 token_persistence(docs, 3, 15, "2015-02-01T00:00:00Z",
+                                   window_budget=window_budget)}
+
+    eq_(processed[1], (2, [2, 2]))
+    eq_(window_budget.stats()['shrinks'] > 0, True)
+    eq_(window_budget.stats()['peak_bytes'] > WindowBudget.TOKEN_BYTES, True)
+
+    # Without a memory limit, the window holds `max_size` revisions
+    expected = stats_by_revision(revision_docs())
+    eq_(stats_by_revision(revision_docs(),
+                          window_budget=WindowBudget(2)), expected)
+
+def test_chunks():
+    def doc(id, sha1, user, ops):
+        return {'id': id, 'sha1': sha1,
+                'timestamp': "2015-01-{0}T00:00:00Z".format(id),
+                'page': {'id': 20, 'title': "Bar"}, 'contributor': {'id': user},
+                'diff': {'ops': ops}}
+    def equal(a1, a2): return {'name': "equal", 'a1': a1, 'a2': a2}
+    def insert(a, tokens): return {'name': "insert", 'a1': a, 'a2': a,
+                                   'tokens': tokens}
+    def delete(a1, a2): return {'name': "delete", 'a1': a1, 'a2': a2}
+
+    def docs():
+        return revision_docs() + [
+            doc(11, "a", 1, [insert(0, ["foo", " ", "bar"])]),
+            doc(12, "b", 2, [equal(0, 3), insert(3, ["baz"])]),
+            doc(13, "c", 3, [equal(0, 2), delete(2, 4)]),
+            doc(14, "b", 1, [equal(0, 2), insert(2, ["bar", "baz"])]), # revert
+            doc(15, "d", 4, [equal(0, 4), equal(0, 2)]), # copy
+            doc(16, "e", 2, [equal(0, 6), insert(6, ["qux"])]),
+            doc(17, "d", 3, [equal(0, 6), delete(6, 7)]), # revert
+            doc(18, "f", 1, [equal(0, 3), delete(3, 6)])
+        ]
+
+    expected = list(stats_by_revision(docs()).items())
+    for chunk_size in (1, 2, 3):
+        eq_(list(stats_by_revision(docs(), chunk_size=chunk_size,
+                                   threads=2).items()), expected)
@@ -0,0 +1,74 @@
+import bz2
+import json
+import os
+import tempfile
+
+from nose.tools import eq_
+
+from ..index import build_index, open_input
+from ..util import read_docs
+
+
+def write_index(path):
+    index_path = path + ".index"
+    with open(index_path, "w") as f:
+        for index_doc in build_index(path):
+            f.write(json.dumps(index_doc) + "\n")
+    return index_path
+
+def revision_docs():
+    rev_id = 1
+    for page_id in range(1, 6):
+        for _ in range(4):
+            yield {'id': rev_id, 'page': {'id': page_id},
+                   'text': "Text of revision {0} ".format(rev_id) * rev_id}
+            rev_id += 1
+
+def test_index():
+    directory = tempfile.mkdtemp()
+    docs = list(revision_docs())
+    data = "".join(json.dumps(doc) + "\n" for doc in docs).encode('utf-8')
+
+    plain_path = os.path.join(directory, "revisions.json")
+    with open(plain_path, "wb") as f:
+        f.write(data)
+
+    # Several streams that break in the middle of lines
+    bz2_path = os.path.join(directory, "revisions.json.bz2")
+    with open(bz2_path, "wb") as f:
+        for start in range(0, len(data), 1000):
+            f.write(bz2.compress(data[start:start + 1000]))
+
+    for path in (plain_path, bz2_path):
+        index_path = write_index(path)
+
+        read = list(read_docs(open_input(index_path, pages="2,4")))
+        eq_(read, [doc for doc in docs if doc['page']['id'] in (2, 4)])
+
+        read = list(read_docs(open_input(index_path, revisions="20,3,7,8")))
+        eq_(read, [doc for doc in docs if doc['id'] in (3, 7, 8, 20)])
+
+        read = list(read_docs(open_input(index_path, pages="1",
+                                         revisions="2,6")))
+        eq_([doc['id'] for doc in read], [1, 2, 3, 4, 6])
+
+        eq_(list(read_docs(open_input(index_path))), docs)
+
+def test_compact_rows():
+    directory = tempfile.mkdtemp()
+    lines = [
+        {"revision": {"id": 1, "page": {"id": 1}}},
+        [1, "foo", 1, 1, 0, 0, 0, 0],
+        [1, "bar", 1, 1, 0, 0, 0, 0],
+        {"revision": {"id": 2, "page": {"id": 2}}},
+        [2, "baz", 1, 1, 0, 0, 0, 0]
+    ]
+    path = os.path.join(directory, "persistence.json")
+    with open(path, "w") as f:
+        for line in lines:
+            f.write(json.dumps(line) + "\n")
+
+    index_path = write_index(path)
+
+    eq_(list(read_docs(open_input(index_path, revisions="1"))), lines[:3])
+    eq_(list(read_docs(open_input(index_path, pages="2"))), lines[3:])
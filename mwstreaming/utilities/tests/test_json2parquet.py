@@ -0,0 +1,96 @@
+import json
+import os
+import tempfile
+from datetime import datetime, timezone
+
+from nose.plugins.skip import SkipTest
+from nose.tools import eq_, raises
+
+from ..json2parquet import column_batches, parse_field, run
+
+
+def test_column_batches():
+    docs = [
+        {'id': 1, 'timestamp': "2015-01-01T00:00:00Z",
+         'persistence_stats': {'tokens_added': 5, 'censored': False}},
+        {'id': 2, 'timestamp': "2015-01-02T00:00:00Z",
+         'persistence_stats': {'tokens_added': 2.5, 'censored': True}},
+        {'id': 3, 'timestamp': None, 'persistence_stats': None}
+    ]
+    fields = [parse_field(spec) for spec in
+              ["id:int", "timestamp:timestamp",
+               "persistence_stats.tokens_added", "persistence_stats.censored",
+               "persistence_stats"]]
+
+    batches = list(column_batches((json.dumps(doc) for doc in docs), fields,
+                                  2))
+
+    eq_(len(batches), 2)
+    columns, types = batches[0]
+    eq_(types, {'id': "int", 'timestamp': "timestamp",
+                'persistence_stats.tokens_added': "float",
+                'persistence_stats.censored': "bool",
+                'persistence_stats': "json"})
+    eq_(columns['timestamp'][1],
+        datetime(2015, 1, 2, tzinfo=timezone.utc))
+    eq_(columns['persistence_stats.tokens_added'], [5.0, 2.5])
+
+    # Types stay fixed after the first batch
+    columns, types = batches[1]
+    eq_(types['persistence_stats.tokens_added'], "float")
+    eq_(columns['persistence_stats.censored'], [None])
+    eq_(columns['persistence_stats'], [None])
+
+@raises(ValueError)
+def test_unknown_type():
+    parse_field("id:integer")
+
+def test_mismatched_types():
+    cases = [
+        # An inferred int isn't truncated
+        (["count"], [{'count': 1}, {'count': 2.5}], "Row 2", "inferred"),
+        (["count:int"], [{'count': 1}, {'count': "5"}], "Row 2", "'count'"),
+        # "false" isn't true
+        (["censored:bool"], [{'censored': True}, {'censored': "false"}],
+         "Row 2", "'censored'"),
+        (["timestamp:timestamp"], [{'timestamp': 5}], "Row 1", "timestamp")
+    ]
+    for specs, docs, row, name in cases:
+        fields = [parse_field(spec) for spec in specs]
+        try:
+            list(column_batches((json.dumps(doc) for doc in docs), fields,
+                                1))
+        except ValueError as e:
+            eq_(row in str(e) and name in str(e), True)
+        else:
+            raise AssertionError("Expected a ValueError for {0}"
+                                 .format(docs))
+
+    # Integral floats fit ints
+    columns, types = next(column_batches(['{"count": 5.0}'],
+                                         [("count", "int")], 1))
+    eq_(columns['count'], [5])
+
+def test_run():
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        raise SkipTest("pyarrow is not installed")
+
+    docs = [{'id': i, 'page': {'title': "Foo"}, 'censored': i % 2 == 0,
+             'timestamp': "2015-01-0{0}T00:00:00Z".format(i + 1)}
+            for i in range(5)]
+    path = os.path.join(tempfile.mkdtemp(), "test.parquet")
+    fields = [parse_field(spec) for spec in
+              ["id", "page.title", "censored:bool", "timestamp:timestamp"]]
+
+    run((json.dumps(doc) for doc in docs), path, fields, 2, "snappy")
+
+    table = pyarrow.parquet.read_table(path)
+    eq_(table.num_rows, 5)
+    eq_(str(table.schema.field("id").type), "int64")
+    eq_(table.column("page.title").to_pylist(), ["Foo"] * 5)
+    eq_(table.column("censored").to_pylist(),
+        [doc['censored'] for doc in docs])
+    eq_(table.column("timestamp").to_pylist()[1],
+        datetime(2015, 1, 2, tzinfo=timezone.utc))
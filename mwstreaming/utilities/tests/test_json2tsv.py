@@ -0,0 +1,44 @@
+import json
+
+from nose.tools import eq_
+
+from ..json2tsv import FieldExtractor, apply_keys
+
+DOCS = [
+    {'id': 1, 'text': "Foo \\\"bar\\\" " * 2000,
+     'page': {'id': 5, 'title': "Foo\t\"bar\"", 'x': [1, {'y': "]}"}]},
+     'diff': {'last_id': None, 'ops': [{'tokens': ["]", "{", "\"\\"]}]}},
+    {'id': [1, 2], 'page': "Foo", 'diff': {}, 'k"ey': "é☃" * 6000},
+    {}
+]
+
+FIELDNAMES = [
+    ["id", "page.id", "page.title"],
+    ["page", "page.x.0", "missing.foo"],
+    ["diff.ops", "diff.last_id", "text", 'k"ey']
+]
+
+def test_field_extractor():
+    for fieldnames in FIELDNAMES:
+        extractor = FieldExtractor(fieldnames)
+        for doc in DOCS:
+            expected = [apply_keys(doc, fn.split(".")) for fn in fieldnames]
+            for line in (json.dumps(doc), json.dumps(doc, indent=1),
+                         json.dumps(doc, separators=(",", ":"),
+                                    ensure_ascii=False)):
+                eq_(extractor.extract(line.replace("\n", " ") + "\n"),
+                    expected)
+
+def test_skip_value():
+    extractor = FieldExtractor(["id"])
+    for value in ({'ops': [{'tokens': ["]", "{", "\"\\", "}}"]}], 'x': {}},
+                  [[], [[1, 2], {"a": "\\\"]"}]], "[", 1.5e3, None, True):
+        s = json.dumps(value) + ', "id": 3}'
+        eq_(extractor.skip_value(s, 0), len(json.dumps(value)))
+
+    try:
+        extractor.skip_value('{"a": [1, 2}', 0)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Expected a ValueError")
@@ -102,6 +102,18 @@ def test_drop_text():
     for doc in mend_diffs(revision_docs, diff_engine):
         del doc['text']
 
+def test_verbose():
+    revision_docs = [
+        {'id': 1, 'text': "Apples are red.", 'page': {'title': "Foo"},
+         'diff': {'last_id': None, 'ops': []}},
+        {'id': 2, 'text': "Apples are blue.", 'page': {'title': "Foo"},
+         'diff': {'last_id': None, 'ops': []}}
+    ]
+
+    # `verbose` is still accepted where `metrics` were added
+    new_docs = list(mend_diffs(revision_docs, FakeDiffEngine(), None, True))
+    eq_(new_docs[1]['diff']['last_id'], 1)
+
 
 @raises(RuntimeError)
 def test_mend_diffs_missing_text():
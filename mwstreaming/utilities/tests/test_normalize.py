@@ -0,0 +1,59 @@
+import json
+import os
+
+from nose.tools import eq_
+
+from ...validation import SchemaValidator
+from ..normalize import detect_version, normalize
+
+SCHEMAS_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "..",
+                           "docs", "schemas")
+
+
+def test_normalize():
+    revision_docs = [
+        {'id': 1, 'page': {'redirect': {'title': "Bar"}}, 'contributor': {}},
+        {'id': 2, 'page': {'redirect': None}, 'contributor': None},
+        {'id': 3, 'page': {'redirect_title': None}, 'truncated': False}
+    ]
+    eq_([detect_version(doc) for doc in revision_docs],
+        ["0.0.1", "0.0.1", "0.0.3"])
+
+    normalized_docs = list(normalize(revision_docs))
+
+    eq_(normalized_docs[0],
+        {'id': 1, 'page': {'redirect_title': "Bar"},
+         'contributor': {'id': None, 'user_text': None}})
+    eq_(normalized_docs[1],
+        {'id': 2, 'page': {'redirect_title': None}, 'contributor': None})
+    eq_(normalized_docs[2],
+        {'id': 3, 'page': {'redirect_title': None}, 'truncated': False})
+
+def test_upgrade_diff():
+    ops = [{'name': "equals", 'a1': 0, 'a2': 2, 'b1': 0, 'b2': 2},
+           {'name': "insert", 'a1': 2, 'a2': 2, 'b1': 2, 'b2': 3}]
+    revision_doc = {
+        'id': 2, 'timestamp': "2015-01-01T00:00:00Z",
+        'page': {'id': 1, 'namespace': 0, 'title': "Foo",
+                 'redirect': None, 'restrictions': []},
+        'contributor': {'user_text': "127.0.0.1"}, 'minor': False,
+        'comment': "", 'text': "Foo bar", 'bytes': 7, 'sha1': "aaa",
+        'parent_id': 1, 'model': "wikitext", 'format': "text/x-wiki",
+        'diff': ops
+    }
+    with open(os.path.join(SCHEMAS_DIR, "revision_document-0.0.1.json")) as f:
+        SchemaValidator(json.load(f)).validate(revision_doc)
+
+    normalized_doc, = normalize([revision_doc])
+
+    eq_([op['name'] for op in normalized_doc['diff']], ["equal", "insert"])
+    with open(os.path.join(SCHEMAS_DIR, "revision_document-0.0.3.json")) as f:
+        SchemaValidator(json.load(f)).validate(normalized_doc)
+
+    # Diffs written by json2diffs
+    diff_doc = {'id': 2, 'page': {'redirect': None}, 'contributor': None,
+                'diff': {'last_id': 1,
+                         'ops': [{'name': "equals", 'a1': 0, 'a2': 2,
+                                  'b1': 0, 'b2': 2}]}}
+    normalized_doc, = normalize([diff_doc])
+    eq_(normalized_doc['diff']['ops'][0]['name'], "equal")
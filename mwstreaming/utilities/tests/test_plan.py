@@ -0,0 +1,102 @@
+import bz2
+import io
+import json
+import os
+import sys
+import tempfile
+
+from nose.tools import eq_, raises
+
+from ...benchmarks.synthetic import SyntheticWiki, write_xml
+from .. import dump2diffs, dump2json
+from ..plan import load_plan, pack, plan_files
+
+
+def test_pack():
+    files = [{'path': path, 'cost': cost}
+             for path, cost in [("a", 7), ("b", 5), ("c", 4), ("d", 3),
+                                ("e", 1)]]
+    shards = pack(files, 2)
+
+    eq_([s['files'] for s in shards], [["a", "d"], ["b", "c", "e"]])
+    eq_([s['cost'] for s in shards], [10, 10])
+
+    eq_([s['files'] for s in pack(files[:1], 3)], [["a"], [], []])
+
+def test_plan_files():
+    directory = tempfile.mkdtemp()
+
+    small = io.StringIO()
+    write_xml(SyntheticWiki(pages=3, seed=1, large_text_rate=0), small)
+    large = io.StringIO()
+    write_xml(SyntheticWiki(pages=10, seed=2, large_text_rate=0), large)
+
+    small_path = os.path.join(directory, "small.xml")
+    with open(small_path, "w") as f:
+        f.write(small.getvalue())
+    large_path = os.path.join(directory, "large.xml.bz2")
+    with open(large_path, "wb") as f:
+        f.write(bz2.compress(large.getvalue().encode('utf-8')))
+    json_path = os.path.join(directory, "revisions.json")
+    with open(json_path, "w") as f:
+        for doc in SyntheticWiki(pages=2, seed=3).revision_docs():
+            f.write(json.dumps(doc) + "\n")
+
+    plan = plan_files([small_path, json_path, large_path], 2,
+                      revision_cost=100, largest_pages=2)
+
+    eq_(plan['order'][0], large_path)
+    eq_(set(plan['order']), {small_path, json_path, large_path})
+    eq_([f['path'] for f in plan['files']], plan['order'])
+    eq_(plan['shards'][0]['files'], [large_path])
+
+    large_file = plan['files'][0]
+    eq_(large_file['sampled'], 1)
+    eq_(large_file['pages'], 10)
+    eq_(large_file['revisions'], large.getvalue().count("<revision>"))
+    eq_(len(large_file['largest_pages']), 2)
+    costs = [p['cost'] for p in large_file['largest_pages']]
+    eq_(costs, sorted(costs, reverse=True))
+
+    json_file = [f for f in plan['files'] if f['path'] == json_path][0]
+    eq_(json_file['pages'], 2)
+
+    plan_path = os.path.join(directory, "plan.json")
+    with open(plan_path, "w") as f:
+        json.dump(plan, f)
+
+    eq_(load_plan(plan_path), plan['order'])
+    eq_(load_plan(plan_path, 1), plan['shards'][1]['files'])
+
+def write_plan(files, workers):
+    plan = {'order': [f['path'] for f in files], 'files': files,
+            'shards': pack(files, workers)}
+    plan_path = os.path.join(tempfile.mkdtemp(), "plan.json")
+    with open(plan_path, "w") as f:
+        json.dump(plan, f)
+    return plan_path
+
+def test_empty_shard():
+    plan_path = write_plan([{'path': "a.xml", 'cost': 1}], 2)
+    eq_(load_plan(plan_path, 1), [])
+
+    class UnreadableStdin:
+        def __getattr__(self, name):
+            raise AssertionError("<stdin> shouldn't be read")
+
+    stdin, stdout = sys.stdin, sys.stdout
+    sys.stdin, sys.stdout = UnreadableStdin(), io.StringIO()
+    try:
+        dump2json.main(["--plan=" + plan_path, "--shard=1"])
+        dump2diffs.main(["--config=" + os.path.join(os.path.dirname(__file__),
+                                                    "..", "..", "..",
+                                                    "config",
+                                                    "western.diffs.yaml"),
+                         "--plan=" + plan_path, "--shard=1"])
+        eq_(sys.stdout.getvalue(), "")
+    finally:
+        sys.stdin, sys.stdout = stdin, stdout
+
+@raises(RuntimeError)
+def test_missing_shard():
+    load_plan(write_plan([{'path': "a.xml", 'cost': 1}], 2), 2)
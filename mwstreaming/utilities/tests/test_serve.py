@@ -0,0 +1,123 @@
+import asyncio
+import json
+
+from deltas import Delete, Insert
+from nose.tools import eq_
+
+from .. import serve
+from ..serve import DiffService
+
+
+class FakeDiffEngine:
+    def processor(self, last_text=''):
+        return FakeProcessor(last_text)
+
+class FakeProcessor:
+    def __init__(self, last_text):
+        self.last_text = last_text
+
+    def process(self, text):
+        ops = [Delete(0,1,0,0),
+               Insert(0,0,0,1)]
+        a = [self.last_text]
+        b = [text]
+        self.last_text = text
+
+        return ops, a, b
+
+def revision_doc(id, page_id, text):
+    return {'id': id, 'page': {'id': page_id}, 'text': text,
+            'timestamp': "2015-01-0{0}T00:00:00Z".format(id)}
+
+def request(lines, workers=0, limit=2 ** 16):
+    async def send_lines():
+        service = DiffService(FakeDiffEngine(), workers, 1024)
+        server = await asyncio.start_server(service.handle_lines,
+                                            "127.0.0.1", 0, limit=limit)
+        port = server.sockets[0].getsockname()[1]
+
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        for line in lines:
+            writer.write(line + b"\n")
+        writer.write_eof()
+        response_lines = [line async for line in reader]
+
+        server.close()
+        service.close()
+        return [json.loads(str(line, 'utf-8')) for line in response_lines]
+
+    return asyncio.run(send_lines())
+
+def request_http(data):
+    async def send_request():
+        service = DiffService(FakeDiffEngine(), 0, 1024)
+        server = await asyncio.start_server(service.handle_http,
+                                            "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(data)
+        response = await reader.read()
+
+        server.close()
+        service.close()
+        return response
+
+    return asyncio.run(send_request())
+
+def test_handle_lines():
+    revision_docs = [revision_doc(1, 10, "Foo"),
+                     revision_doc(2, 20, "Bar"),
+                     revision_doc(3, 10, "Foo!"),
+                     revision_doc(3, 10, "Foo!")] # Duplicate
+    lines = [json.dumps(doc).encode('utf-8') for doc in revision_docs]
+
+    for workers in (0, 2):
+        diff_docs = request(lines, workers=workers)
+
+        eq_([d['id'] for d in diff_docs], [1, 2, 3, 3])
+        eq_(diff_docs[0]['diff']['last_id'], None)
+        eq_(diff_docs[2]['diff']['last_id'], 1)
+        eq_(diff_docs[2]['diff']['ops'][0]['tokens'], ["Foo"])
+        eq_(diff_docs[3]['diff'], None)
+
+def test_line_too_long():
+    lines = [json.dumps(revision_doc(1, 10, "Foo")).encode('utf-8'),
+             json.dumps(revision_doc(2, 10, "Foo" * 1000)).encode('utf-8'),
+             json.dumps(revision_doc(3, 10, "Bar")).encode('utf-8'),
+             b"x" * 5000]
+
+    diff_docs = request(lines, limit=1000)
+
+    eq_(len(diff_docs), 4)
+    eq_(diff_docs[0]['id'], 1)
+    eq_(diff_docs[1], {'error': "ValueError: Line is too long"})
+    eq_(diff_docs[2]['diff']['last_id'], 1)
+    eq_(diff_docs[3], {'error': "ValueError: Line is too long"})
+
+def test_handle_http():
+    body = json.dumps(revision_doc(1, 10, "Foo")).encode('utf-8') + b"\n"
+    response = request_http(
+        b"POST / HTTP/1.1\r\nConnection: close\r\n" +
+        "Content-Length: {0}\r\n\r\n".format(len(body)).encode('latin-1') +
+        body)
+    eq_(response.startswith(b"HTTP/1.1 200 OK\r\n"), True)
+    eq_(json.loads(str(response.split(b"\r\n\r\n", 1)[1], 'utf-8'))['id'], 1)
+
+    for request in (b"GARBAGE\r\n\r\n",
+                    b"POST / HTTP/1.1\r\nContent-Length\r\n\r\n",
+                    b"POST / HTTP/1.1\r\nContent-Length: abc\r\n\r\n"):
+        response = request_http(request)
+        eq_(response.startswith(b"HTTP/1.1 400 Bad Request\r\n"), True)
+
+def test_http_body_too_long():
+    max_line = serve.MAX_LINE
+    serve.MAX_LINE = 1000
+    try:
+        response = request_http(
+            b"POST / HTTP/1.1\r\nContent-Length: 1001\r\n\r\n" +
+            b"x" * 1001)
+    finally:
+        serve.MAX_LINE = max_line
+
+    eq_(response.startswith(b"HTTP/1.1 413 Payload Too Large\r\n"), True)
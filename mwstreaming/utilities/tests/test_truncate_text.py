@@ -0,0 +1,72 @@
+import io
+import json
+
+from nose.tools import eq_
+
+from ...checkpoint import InputPosition
+from .. import util
+from ..truncate_text import truncate_text
+from ..util import read_docs
+
+
+class FakeStdin:
+    def __init__(self, data):
+        self.buffer = io.BytesIO(data)
+
+def test_read_time_truncation():
+    docs = [
+        {'id': 1, 'comment': '"text": "', 'text': "Foo"},
+        {'id': 2, 'comment': None, 'bytes': 5,
+         'text': 'Bar \\ "baz" é ☃ \U0001F600 ' * 20},
+        {'id': 3, 'comment': None, 'text': None, 'bytes': 0}
+    ]
+    lines = [json.dumps(doc, ensure_ascii=False) + "\n" for doc in docs]
+    data = "".join(lines).encode('utf-8')
+
+    old_chunk_size = util.CHUNK_SIZE
+    util.CHUNK_SIZE = 7 # Make sure that chunk boundaries are crossed
+    try:
+        for max_bytes in range(len(lines[0]), 200):
+            position = InputPosition()
+            read = list(read_docs(FakeStdin(data), position=position,
+                                  max_bytes=max_bytes))
+
+            eq_(position.offset, len(data))
+            eq_([doc['id'] for doc in read], [1, 2, 3])
+            eq_(read[0]['text'], "Foo")
+            eq_(read[1]['truncated'], True)
+            eq_(read[1]['bytes'], 5)
+            ok = docs[1]['text'].startswith(read[1]['text']) and \
+                 len(json.dumps(read[1]['text'], ensure_ascii=False)
+                     .encode('utf-8')) - 2 <= max_bytes
+            eq_(ok, True)
+            eq_(read[2]['text'], None)
+    finally:
+        util.CHUNK_SIZE = old_chunk_size
+
+def test_read_time_limit():
+    docs = [{'id': 1, 'comment': "Foo" * 100, 'text': "Bar"},
+            {'id': 2, 'text': "Bar", 'diff': ["Foo"] * 100},
+            {'id': 3, 'text': None, 'comment': "Foo" * 100}]
+
+    old_chunk_size = util.CHUNK_SIZE
+    util.CHUNK_SIZE = 7
+    try:
+        for doc in docs:
+            data = (json.dumps(doc) + "\n").encode('utf-8')
+            try:
+                list(read_docs(FakeStdin(data), max_bytes=100))
+            except ValueError:
+                pass
+            else:
+                raise AssertionError("Expected a ValueError for {0}"
+                                     .format(doc['id']))
+    finally:
+        util.CHUNK_SIZE = old_chunk_size
+
+def test_truncate_text():
+    docs = [{'text': "Foo bar"}, {'text': None},
+            {'text': "Foo", 'truncated': True}]
+
+    eq_([(doc['text'], doc['truncated']) for doc in truncate_text(docs, 3)],
+        [("Foo", True), (None, False), ("Foo", True)])
@@ -4,48 +4,98 @@ characters.  The default '--max-chars' was set for addressing content dump
 vandalism in English Wikipedia.  This script adds a boolean 'truncated' field
 that will be True when the text field was changes and False when it was not.
 
+With `--max-bytes`, oversized 'text' fields are also cut down while they are
+read so that a single vandalism-sized revision is never held in memory in
+full.
+
 Usage:
     truncate_text (-h|--help)
-    truncate_text [--max-chars=<num>] [--verbose]
+    truncate_text [--max-chars=<num>] [--max-bytes=<num>] [--metrics=<path>]
+                  [--metrics-interval=<secs>] [--verbose]
+                  [--index=<path>] [--pages=<ids>] [--revisions=<ids>]
+                  [--threads=<num>]
 
 Options:
     -h|--help          Print this documentation
     --max-chars=<num>  The maximum number of characters that are allowed in a
                        'text' field. [default: 2097152]
-    --verbose          Prints debugging information.
+    --max-bytes=<num>  The maximum number of bytes of a 'text' field (as
+                       JSON) to read.  Longer texts are cut down as they are
+                       read.  Lines with more bytes than this outside of
+                       'text' are an error. [default: <none>]
+    --index=<path>     Read the documents of the file indexed at this path (see
+                       `index`) rather than <stdin>
+    --pages=<ids>      A comma separated list of page ids to read from
+                       `--index` [default: <all>]
+    --revisions=<ids>  A comma separated list of revision ids to read from
+                       `--index` [default: <all>]
+    --threads=<num>    The number of processes to parse the input with.  More
+                       than 1 requires an uncompressed regular file as input.
+                       [default: 1]
+    --metrics=<path>   Write periodic throughput metrics to this file as JSON
+                       lines
+    --metrics-interval=<secs>  The number of seconds between metrics reports
+                               [default: 60]
+    --verbose          Print periodic metrics reports to <stderr>
 """
-import json
 import sys
 
 import docopt
 
+from ..checkpoint import InputPosition
+from ..metrics import Metrics, from_verbose
+from ..pipeline import Writer
+from .index import open_input
 from .util import read_docs
 
 
 def main(argv=None):
     args = docopt.docopt(__doc__, argv=argv)
     
+    input_file = open_input(args['--index'], args['--pages'],
+                            args['--revisions'])
+    
     max_chars = int(args['--max-chars'])
-    verbose = args['--verbose']
     
-    run(read_docs(sys.stdin), max_chars, verbose)
+    if args['--max-bytes'] == "<none>":
+        max_bytes = None
+    else:
+        max_bytes = int(args['--max-bytes'])
+    
+    threads = int(args['--threads'])
+    
+    verbose = bool(args['--verbose'])
+    
+    position = InputPosition()
+    metrics = Metrics.from_options(args['--metrics'],
+                                   float(args['--metrics-interval']), verbose,
+                                   position=position)
+    
+    run(read_docs(input_file, position=position, max_bytes=max_bytes,
+                  threads=threads),
+        max_chars, verbose, metrics=metrics)
 
-def run(docs, max_chars, verbose):
+def run(docs, max_chars, verbose=False, metrics=None):
+    
+    metrics = from_verbose(verbose, metrics)
     
-    for doc in truncate_text(docs, max_chars):
-        if verbose and doc['truncated']: sys.stderr.write(".")
-        json.dump(doc, sys.stdout)
-        sys.stdout.write("\n")
+    with Writer(sys.stdout, metrics) as output:
+        for doc in truncate_text(docs, max_chars):
+            output.write_doc(doc)
+            if metrics is not None:
+                if doc['truncated']: metrics.count('truncated')
+                metrics.revision()
     
-    if verbose: sys.stderr.write("\n")
+    if metrics is not None: metrics.close()
     
 def truncate_text(docs, max_chars):
     
     for doc in docs:
-        if len(doc['text']) > max_chars:
+        if doc['text'] is not None and len(doc['text']) > max_chars:
             doc['text'] = doc['text'][:max_chars]
             doc['truncated'] = True
         else:
-            doc['truncated'] = False
+            # Might have been truncated as it was read
+            doc['truncated'] = doc.get('truncated', False)
         
         yield doc
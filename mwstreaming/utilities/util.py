@@ -1,56 +1,331 @@
 import io
 import json
+import re
+import time
+from functools import lru_cache
 
+from .. import profiling
+from ..records import RevisionRecord, to_json
+from ..text_store import hydrate_texts
 
-def read_docs(f, field=1):
-    input_stream = io.TextIOWrapper(f.buffer, encoding='utf-8')
-    for line in input_stream:
-        yield json.loads(line.strip().split("\t")[field-1])
+TEXT_START = re.compile(rb'"text"[ \t]*:[ \t]*"')
+HIGH_SURROGATE = re.compile(rb'\\u[dD][89abAB][0-9a-fA-F]{2}$')
+CHUNK_SIZE = 2 ** 16
 
-def revision2doc(revision, page):
+
+def read_docs(f, field=1, position=None, max_bytes=None, threads=1,
+              text_store=None, sampler=None, hydrate=False):
     """
-    Implements RevisionDocument v0.0.2
+    Reads JSON documents from the `field`th tab-separated column of each line.
+    If an :class:`~mwstreaming.checkpoint.InputPosition` is provided, it will
+    be advanced as lines are read.  If `max_bytes` is provided, the 'text' of
+    lines longer than `max_bytes` is cut to at most `max_bytes` bytes (of
+    JSON) while the line is read and the document is marked as 'truncated'.
+    If `threads` is more than 1, `f` must be an uncompressed regular file and
+    it is parsed in chunks by `threads` processes (see
+    :mod:`mwstreaming.mapped_input`).  If `hydrate` is set, texts that were
+    removed by a :class:`~mwstreaming.text_store.TextDeduplicator` are
+    restored (from `text_store` if they were moved to one).  Only readers that
+    need texts should set it, since restoring keeps the recent texts of many
+    pages in memory.  Otherwise, removed texts stay removed.  If a
+    :class:`~mwstreaming.sampling.PageSampler` is provided, only the
+    documents of sampled pages are decoded.  Lines are read ahead by a reader
+    thread (see :mod:`mwstreaming.pipeline`).
     """
+    if threads > 1:
+        from .. import mapped_input
+        docs = mapped_input.read_docs(f, threads, field, position, max_bytes)
+        if sampler is not None: docs = sampler.filter_docs(docs)
+    else:
+        docs = parse_docs(f, field, position, max_bytes, sampler)
+    if hydrate: docs = hydrate_texts(docs, text_store)
+    docs = profiling.timed_decode(docs)
+
+    return docs
+
+def parse_docs(f, field, position, max_bytes=None, sampler=None):
+    from .. import pipeline
+
+    if position is None and max_bytes is None and \
+       pipeline.queue_depth() == 0:
+        input_stream = io.TextIOWrapper(f.buffer, encoding='utf-8')
+        for line in input_stream:
+            value = line.strip().split("\t")[field-1]
+            if sampler is None or sampler.sampled_line(value):
+                yield json.loads(value)
+    else:
+        lines = pipeline.read_ahead(read_lines(f.buffer, max_bytes))
+        for line, length, truncated in lines:
+            if position is not None: position.advance(length)
+            value = str(line, 'utf-8').strip().split("\t")[field-1]
+            if sampler is not None and not sampler.sampled_line(value):
+                continue
+            doc = json.loads(value)
+            if truncated: doc['truncated'] = True
+            yield doc
+
+        if position is not None: position.eof = True
+
+def read_lines(buffer, max_bytes=None):
+    """
+    Generates (`line`, `length`, `truncated`) triples from a binary file.
+    Lines longer than `max_bytes` are never held in memory in full -- their
+    'text' value is cut down to `max_bytes` as it is read and a `ValueError`
+    is raised if the rest of the line is longer than `max_bytes` too (see
+    :func:`read_squeezed`).  `length` is the number of bytes consumed from
+    `buffer`.
+    """
+    while True:
+        if max_bytes is None:
+            line = buffer.readline()
+        else:
+            line = buffer.readline(max_bytes + 1)
+
+        if len(line) == 0:
+            break
+        elif max_bytes is None or len(line) <= max_bytes or \
+             line[-1:] == b"\n":
+            yield line, len(line), False
+        else:
+            yield read_squeezed(buffer, line, max_bytes)
+
+def read_squeezed(buffer, head, max_bytes):
+    """
+    Reads the rest of a line that starts with `head` from `buffer` and keeps
+    at most `max_bytes` of its 'text' value.  Returns (`line`, `length`,
+    `truncated`).  Raises a `ValueError` once more than `max_bytes` (give or
+    take a chunk) of the rest of the line has been read.
+    """
+    length = len(head)
+    parts = []
+    kept = 0 # Bytes outside of the text value
+
+    # Find the start of the text value
+    data = head
+    match = TEXT_START.search(data)
+    while match is None:
+        chunk = b"" if data[-1:] == b"\n" else buffer.readline(CHUNK_SIZE)
+        if len(chunk) == 0:
+            # No text to cut
+            check_kept(kept + len(data), max_bytes)
+            return b"".join(parts) + data, length, False
+        length += len(chunk)
+        # Keep a tail in case the key is split between chunks
+        parts.append(data[:-16])
+        kept += len(parts[-1])
+        check_kept(kept, max_bytes)
+        data = data[-16:] + chunk
+        match = TEXT_START.search(data)
+
+    parts.append(data[:match.end()])
+    kept += len(parts[-1])
+    data = data[match.end():]
+
+    # Keep the start of the text value and skip the rest of it
+    text = []
+    text_bytes = 0
+    escaped = False
+    truncated = False
+    while True:
+        end, escaped = string_end(data, escaped)
+        segment = data if end is None else data[:end]
+        if not truncated:
+            if text_bytes + len(segment) <= max_bytes:
+                text.append(segment)
+                text_bytes += len(segment)
+            else:
+                text.append(segment[:max_bytes - text_bytes])
+                text = [safe_prefix(b"".join(text))]
+                truncated = True
+
+        if end is not None:
+            data = data[end:]
+            break
+
+        data = buffer.readline(CHUNK_SIZE)
+        length += len(data)
+        if len(data) == 0:
+            # Unterminated.  Let the JSON decoder complain.
+            break
+
+    parts.extend(text)
+    parts.append(data)
+    kept += len(data)
+
+    # The rest of the line
+    while parts[-1][-1:] != b"\n":
+        check_kept(kept, max_bytes)
+        chunk = buffer.readline(CHUNK_SIZE)
+        if len(chunk) == 0:
+            break
+        length += len(chunk)
+        kept += len(chunk)
+        parts.append(chunk)
+
+    check_kept(kept, max_bytes)
+    return b"".join(parts), length, truncated
+
+def check_kept(kept, max_bytes):
+    if kept > max_bytes:
+        raise ValueError("Line has more than {0} bytes outside of its 'text' "
+                         .format(max_bytes) + "value.")
+
+def string_end(data, escaped):
+    """
+    Finds the closing quote of a JSON string in a chunk of its bytes.
+    `escaped` is whether the first byte of `data` is escaped by a backslash at
+    the end of the previous chunk.  Returns (`index`, `escaped`) where `index`
+    is `None` if the string doesn't end in `data`.
+    """
+    idx = 0
+    while True:
+        idx = data.find(b'"', idx)
+        if idx == -1:
+            backslashes = len(data) - len(data.rstrip(b"\\"))
+            if backslashes == len(data) and escaped:
+                backslashes += 1
+            return None, backslashes % 2 == 1
+
+        backslashes = 0
+        while idx - backslashes > 0 and data[idx - backslashes - 1] == 92:
+            backslashes += 1
+        if backslashes == idx and escaped:
+            backslashes += 1
+
+        if backslashes % 2 == 0:
+            return idx, False
+        idx += 1
+
+def safe_prefix(text):
+    """
+    Trims the bytes of the start of a JSON string so that they don't end in
+    the middle of an escape sequence or a UTF-8 character.
+    """
+    # Escape sequences
+    while True:
+        idx = text.rfind(b"\\", max(len(text) - 6, 0))
+        if idx == -1:
+            break
+        start = idx
+        while start > 0 and text[start - 1] == 92:
+            start -= 1
+        if (idx - start) % 2 == 1:
+            # text[idx] is an escaped backslash
+            break
+        escape_length = 6 if text[idx + 1:idx + 2] == b"u" else 2
+        if idx + escape_length > len(text) or \
+           HIGH_SURROGATE.match(text, idx):
+            # Incomplete or half of a surrogate pair
+            text = text[:idx]
+        else:
+            break
+
+    # UTF-8 characters
+    for i in range(1, min(len(text), 4) + 1):
+        byte = text[-i]
+        if byte < 0x80:
+            break
+        elif byte >= 0xC0:
+            char_length = 2 if byte < 0xE0 else 3 if byte < 0xF0 else 4
+            if char_length > i:
+                text = text[:-i]
+            break
+
+    return text
+
+def write_doc(doc, f):
+    """
+    Writes `doc` to `f` as a line of JSON.  Returns the number of characters
+    written.
+    """
+    stages = profiling.STAGES
+    if stages is not None: start = time.perf_counter()
+
+    line = json.dumps(doc, default=to_json) + "\n"
+    f.write(line)
+
+    if stages is not None: stages.encoded(time.perf_counter() - start)
+    return len(line)
+
+@lru_cache(maxsize=None)
+def load_diff_engine(path):
+    """
+    Constructs the DiffEngine configured in the yaml file at `path`.  Configs
+    are only parsed once per process.
+    """
+    from deltas import DiffEngine
+    import yamlconf
+
+    config_doc = yamlconf.load(open(path))
+    return DiffEngine.from_config(config_doc, config_doc["diff_engine"])
+
+def revision2doc(revision, page, max_bytes=None, interner=None):
+    """
+    Implements RevisionDocument v0.0.2.  If `max_bytes` is provided, 'text'
+    is cut to at most `max_bytes` bytes (UTF-8) and the document is marked as
+    'truncated'.  If an :class:`~mwstreaming.records.Interner` is provided, a
+    :class:`~mwstreaming.records.RevisionRecord` that shares its page and
+    contributor records with other revisions is returned instead of a dict.
+    """
+    if interner is None:
+        page_doc = page2doc(page)
+        if revision.contributor is not None:
+            contributor_doc = {
+                'id': revision.contributor.id,
+                'user_text': revision.contributor.user_text
+            }
+        else:
+            contributor_doc = None
+        revision_doc = {}
+    else:
+        page_doc = interner.source_page_record(page, page2doc)
+        if revision.contributor is not None:
+            contributor_doc = interner.contributor(
+                revision.contributor.id, revision.contributor.user_text)
+        else:
+            contributor_doc = None
+        revision_doc = RevisionRecord()
+    
+    revision_doc['page'] = page_doc
+    revision_doc['id'] = revision.id
+    revision_doc['timestamp'] = revision.timestamp.long_format()
+    revision_doc['contributor'] = contributor_doc
+    revision_doc['minor'] = revision.minor
+    revision_doc['comment'] = str(revision.comment) \
+                              if revision.comment is not None \
+                              else None
+    revision_doc['text'] = str(revision.text) \
+                           if revision.text is not None \
+                           else None
+    revision_doc['bytes'] = revision.bytes
+    revision_doc['sha1'] = revision.sha1
+    revision_doc['parent_id'] = revision.parent_id
+    revision_doc['model'] = revision.model
+    revision_doc['format'] = revision.format
+    
+    text = revision_doc['text']
+    if max_bytes is not None and text is not None and \
+       len(text) > max_bytes // 4:
+        text_bytes = text.encode('utf-8')
+        if len(text_bytes) > max_bytes:
+            revision_doc['text'] = str(text_bytes[:max_bytes], 'utf-8',
+                                       'ignore')
+            revision_doc['truncated'] = True
+    
+    return revision_doc
+
+def page2doc(page):
     redirect = None
     if page.redirect is not None:
         redirect = page.redirect.title
     
-    page_doc = {
+    return {
         'id': page.id,
         'title': page.title,
         'namespace': page.namespace,
         'redirect_title': redirect,
         'restrictions': page.restrictions
     }
-    
-    if revision.contributor is not None:
-        contributor_doc = {
-            'id': revision.contributor.id,
-            'user_text': revision.contributor.user_text
-        }
-    else:
-        contributor_doc = None
-    
-    revision_doc = {
-        'page': page_doc,
-        'id': revision.id,
-        'timestamp': revision.timestamp.long_format(),
-        'contributor': contributor_doc,
-        'minor': revision.minor,
-        'comment': str(revision.comment) \
-                   if revision.comment is not None \
-                   else None,
-        'text': str(revision.text) \
-               if revision.text is not None \
-               else None,
-        'bytes': revision.bytes,
-        'sha1': revision.sha1,
-        'parent_id': revision.parent_id,
-        'model': revision.model,
-        'format': revision.format
-    }
-    
-    return revision_doc
 
 def op2doc(operation, a, b):
     
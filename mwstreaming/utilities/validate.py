@@ -2,38 +2,163 @@
 Validates a stream of JSON documents against a JSON schema and writes them to
 stdout if they validate -- otherwise, complains noisily.
 
+By default, the first invalid document stops the stream.  With
+`--max-errors`, invalid documents are reported to <stderr> and dropped until
+more than <num> have been seen.  With `--sample-rate`, only a random sample of
+documents is validated and the rest are passed through unchecked.  Documents
+are always written in the order they were read.
+
+With more than one of `--threads`, an uncompressed regular file on <stdin> is
+memory-mapped and newline-aligned chunks of it are sent to the processes so
+that lines don't have to be read one at a time.
+
+$ bzcat revisions.json.bz2 | \\
+  validate revision_document-0.0.3.json --threads=4 --max-errors=100 | \\
+  bzip2 -c > valid_revisions.json.bz2
+
 Usage:
     validate (-h|--help)
-    validate <schema>
+    validate <schema> [--threads=<num>] [--sample-rate=<prop>]
+                      [--max-errors=<num>]
 
 Options:
-    -h|--help      Print this documentation
-    <schema>       The path of a JSON schema to use for validation
+    -h|--help             Print this documentation
+    <schema>              The path of a JSON schema to use for validation
+    --threads=<num>       The number of processes to validate with
+                          [default: 1]
+    --sample-rate=<prop>  The proportion of documents to validate
+                          [default: 1]
+    --max-errors=<num>    The number of invalid documents to report and drop
+                          before stopping [default: 0]
 """
+import io
 import json
+import random
 import sys
+from collections import deque
+from functools import partial
+from itertools import chain, islice
 
 import docopt
 
-from jsonschema import validate
+from ..mapped_input import chunk_lines, is_mappable, map_chunks
+from ..pipeline import Writer, read_ahead
+from ..profiling import timed_decode
+from ..validation import SchemaValidator, format_error
+
+BATCH_SIZE = 100
+"""
+The number of lines sent to a validation process at a time.
+"""
 
-from .util import read_docs
+VALIDATOR = None
 
 
 def main(argv=None):
     args = docopt.docopt(__doc__, argv=argv)
-    
+
     schema = json.load(open(args['<schema>']))
-    
-    run(read_docs(sys.stdin), schema)
+    threads = int(args['--threads'])
+    sample_rate = float(args['--sample-rate'])
+    max_errors = int(args['--max-errors'])
+
+    if threads > 1 and is_mappable(sys.stdin):
+        results = validate_chunks(sys.stdin, schema, threads, sample_rate)
+    else:
+        lines = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8')
+        results = validate_lines(timed_decode(read_ahead(lines)), schema,
+                                 threads, sample_rate)
+
+    run(results, max_errors)
+
+def run(results, max_errors):
+
+    errors = 0
+    with Writer(sys.stdout) as output:
+        for line, error in results:
+            if error is None:
+                output.write(line)
+            else:
+                errors += 1
+                sys.stderr.write("Invalid document: {0}\n".format(error))
+                if errors > max_errors:
+                    raise RuntimeError(
+                        "Stopping after {0} invalid document(s)."
+                        .format(errors))
+
+def validate_lines(lines, schema, threads=1, sample_rate=1):
+    """
+    Generates (`line`, `error`) pairs in the order of `lines`.  `line` is the
+    JSON part of each input line and `error` is a formatted error or `None`
+    if the document validated (or wasn't sampled).
+    """
+    sampled = ((line, sample_rate >= 1 or random.random() < sample_rate)
+               for line in lines)
 
-def run(docs, schema):
-    
-    for doc in jsonvalidate(docs, schema):
-        json.dump(doc, sys.stdout)
-        sys.stdout.write("\n")
+    if threads <= 1:
+        init_worker(schema)
+        for line, check in sampled:
+            yield validate_line(line, check)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        from multiprocessing import get_context
+
+        with ProcessPoolExecutor(threads, get_context("spawn"),
+                                 initializer=init_worker,
+                                 initargs=(schema,)) as executor:
+            # A bounded number of batches in flight keeps memory bounded and
+            # output in order.
+            pending = deque()
+            while True:
+                batch = list(islice(sampled, BATCH_SIZE))
+                if len(batch) > 0:
+                    pending.append(executor.submit(validate_batch, batch))
+                if len(pending) > 0 and \
+                   (len(batch) == 0 or len(pending) >= threads * 2):
+                    yield from pending.popleft().result()
+                elif len(batch) == 0:
+                    break
+
+def validate_chunks(f, schema, threads, sample_rate=1):
+    """
+    Like :func:`validate_lines`, but validates memory-mapped chunks of `f`.
+    """
+    chunk_results = map_chunks(f, partial(validate_chunk, sample_rate),
+                               threads, initializer=init_worker,
+                               initargs=(schema,))
+    return chain.from_iterable(chunk_results)
 
 def jsonvalidate(docs, schema):
+
+    validator = SchemaValidator(schema)
+
     for doc in docs:
-        validate(doc, schema)
+        validator.validate(doc)
         yield doc
+
+def init_worker(schema):
+    global VALIDATOR
+    VALIDATOR = SchemaValidator(schema)
+
+def validate_batch(batch):
+    return [validate_line(line, check) for line, check in batch]
+
+def validate_chunk(sample_rate, chunk):
+    return [validate_line(line, sample_rate >= 1 or
+                                random.random() < sample_rate)
+            for line in chunk_lines(chunk)]
+
+def validate_line(line, check):
+    line = line.strip().split("\t")[0] + "\n"
+    if not check:
+        return line, None
+
+    try:
+        doc = json.loads(line)
+    except ValueError as e:
+        return line, "Could not decode JSON: {0}".format(e)
+
+    error = VALIDATOR.error(doc)
+    return line, None if error is None else format_error(error)
+
+if __name__ == "__main__": main()
@@ -3,19 +3,23 @@ Converts Wikihadoop XML page pairs to JSON revision documents.
 
 Usage:
     wikihadoop2json (-h | --help)
-    wikihadoop2json [--validate=<path>] [--verbose]
+    wikihadoop2json [--validate=<path>] [--metrics=<path>]
+                    [--metrics-interval=<secs>] [--verbose]
 
 Options:
     -h|--help          Print this documentation
-    --verbose          Print progress information to stderr.  Kind of a mess
-                       when running multi-threaded.
+    --metrics=<path>   Write periodic throughput metrics to this file as JSON
+                       lines
+    --metrics-interval=<secs>  The number of seconds between metrics reports
+                               [default: 60]
+    --verbose          Print periodic metrics reports to <stderr>
 """
-import json
 import sys
 
 import docopt
-from mw import xml_dump
 
+from ..metrics import Metrics, from_verbose
+from ..pipeline import Writer, open_read_ahead
 from .util import revision2doc
 
 
@@ -24,31 +28,39 @@ def main(argv=None):
     
     verbose = bool(args['--verbose'])
     
-    run(verbose)
+    metrics = Metrics.from_options(args['--metrics'],
+                                   float(args['--metrics-interval']), verbose)
+    
+    run(verbose, metrics=metrics)
 
-def run(verbose):
+def run(verbose=False, metrics=None):
+    from mw import xml_dump
+    
+    metrics = from_verbose(verbose, metrics)
     
-    dump = xml_dump.Iterator.from_page_xml(sys.stdin)
+    dump = xml_dump.Iterator.from_page_xml(open_read_ahead(sys.stdin))
         
-    for revision_doc in wikihadoop2json(dump, verbose=verbose):
-        json.dump(revision_doc, sys.stdout)
-        sys.stdout.write("\n")
+    with Writer(sys.stdout, metrics) as output:
+        for revision_doc in wikihadoop2json(dump, metrics=metrics):
+            output.write_doc(revision_doc)
+    
+    if metrics is not None: metrics.close()
 
-def wikihadoop2json(dump, verbose=False):
+def wikihadoop2json(dump, verbose=False, metrics=None):
+    
+    metrics = from_verbose(verbose, metrics)
     
     for page in dump:
         
-        if verbose: sys.stderr.write(page.title + ": ")
+        if metrics is not None: metrics.page()
         
         revisions = [r for r in page]
         
         if len(revisions) == 2:
             revision = revisions[1]
             
-            if verbose: sys.stderr.write(".")
+            if metrics is not None: metrics.revision()
             
             yield revision2doc(revision, page)
-        
-        if verbose: sys.stderr.write("\n")
 
 if __name__ == "__main__": main()
@@ -0,0 +1,121 @@
+"""
+Validates documents against a JSON schema that is compiled once.
+
+The RevisionDocument schemas only use a small set of keywords (`type`,
+`required`, `properties`, `items` and `enum`).  Schemas like these are
+compiled into nested Python checks that are much faster than
+:mod:`jsonschema`.  The compiled check is never more lenient than
+:mod:`jsonschema`, so a document that fails it is re-checked with a
+:mod:`jsonschema` validator (built once) that decides and explains the error.
+Schemas that use other keywords are validated with :mod:`jsonschema` alone.
+"""
+ANNOTATIONS = {'$schema', '$id', 'id', 'title', 'description', 'default'}
+KEYWORDS = {'type', 'required', 'properties', 'items', 'enum'}
+
+TYPES = {
+    'object': lambda v: isinstance(v, dict),
+    'array': lambda v: isinstance(v, list),
+    'string': lambda v: isinstance(v, str),
+    'number': lambda v: isinstance(v, (int, float)) and
+                        not isinstance(v, bool),
+    'integer': lambda v: isinstance(v, int) and not isinstance(v, bool),
+    'boolean': lambda v: isinstance(v, bool),
+    'null': lambda v: v is None
+}
+
+
+class SchemaValidator:
+    """
+    Checks the schema and builds validators for it once.
+
+    :Parameters:
+        schema : dict
+            A JSON schema
+    """
+    def __init__(self, schema):
+        from jsonschema.validators import validator_for
+
+        cls = validator_for(schema)
+        cls.check_schema(schema)
+        self.validator = cls(schema)
+        self.check = compile_schema(schema)
+
+    def error(self, doc):
+        """
+        Returns the :class:`jsonschema.ValidationError` that best describes
+        why `doc` is invalid or `None` if `doc` is valid.
+        """
+        if self.check is not None and self.check(doc):
+            return None
+        else:
+            from jsonschema.exceptions import best_match
+            return best_match(self.validator.iter_errors(doc))
+
+    def validate(self, doc):
+        """
+        Raises a :class:`jsonschema.ValidationError` if `doc` is invalid.
+        """
+        error = self.error(doc)
+        if error is not None:
+            raise error
+
+
+def compile_schema(schema):
+    """
+    Compiles `schema` into a function that returns True when a value is valid.
+    Returns `None` if `schema` uses keywords that can't be compiled.
+    """
+    if not isinstance(schema, dict) or \
+       len(set(schema) - KEYWORDS - ANNOTATIONS) > 0:
+        return None
+
+    checks = []
+
+    if 'type' in schema:
+        types = schema['type']
+        types = types if isinstance(types, list) else [types]
+        if any(t not in TYPES for t in types):
+            return None
+        type_checks = [TYPES[t] for t in types]
+        checks.append(lambda v: any(check(v) for check in type_checks))
+
+    if 'enum' in schema:
+        enum = schema['enum']
+        # Matching types too means True never passes for 1
+        checks.append(lambda v: any(type(v) is type(e) and v == e
+                                    for e in enum))
+
+    if 'required' in schema:
+        required = schema['required']
+        checks.append(lambda v: not isinstance(v, dict) or
+                                all(key in v for key in required))
+
+    if 'properties' in schema:
+        properties = []
+        for key, subschema in schema['properties'].items():
+            check = compile_schema(subschema)
+            if check is None:
+                return None
+            properties.append((key, check))
+        checks.append(lambda v: not isinstance(v, dict) or
+                                all(key not in v or check(v[key])
+                                    for key, check in properties))
+
+    if 'items' in schema:
+        items_check = compile_schema(schema['items'])
+        if items_check is None:
+            return None
+        checks.append(lambda v: not isinstance(v, list) or
+                                all(items_check(item) for item in v))
+
+    if len(checks) == 1:
+        return checks[0]
+    else:
+        return lambda v: all(check(v) for check in checks)
+
+def format_error(error):
+    """
+    Formats a :class:`jsonschema.ValidationError` as a single line.
+    """
+    path = "/".join(str(p) for p in error.absolute_path)
+    return "{0}: {1}".format(path or "<root>", error.message)
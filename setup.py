@@ -30,6 +30,10 @@ setup(
     long_description = read('README.rst'),
     install_requires = ['docopt', 'deltas', 'yamlconf', 'mediawiki-utilities',
                         'jsonschema', 'stopit'],
+    extras_require = {
+        'parquet': ['pyarrow'],
+        'zstd': ['zstandard']
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "Development Status :: 3 - Alpha",